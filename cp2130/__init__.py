@@ -14,31 +14,92 @@
 
 from __future__ import absolute_import
 
-from cp2130.core import CP2130
+import importlib
+import sys
+
 from cp2130.data import *
 
-def find(vid=0x10c4, pid=0x87A0):
+# Names and submodules loaded on first access, so that importing the
+# package does not pay for bitstring and the register and command
+# tables until a device is actually used.
+_LAZY_NAMES = {
+    'CP2130'     : 'cp2130.core',
+    'CP2130Chip' : 'cp2130.chip',
+}
+
+_LAZY_MODULES = (
+    'benchmark', 'broker', 'capture', 'chip', 'clock', 'codec', 'core',
+    'cost', 'display', 'event_counter', 'flash', 'flash_view', 'gang', 'gpio',
+    'pin_config', 'provision', 'qualify', 'regmap', 'resilient', 'rom_cache',
+    'sdcard', 'shm_ring', 'spi', 'state', 'transaction', 'usb', 'usb_config',
+    'worker',
+)
+
+def __getattr__(name):
+    if name in _LAZY_NAMES:
+        value = getattr(importlib.import_module(_LAZY_NAMES[name]), name)
+        globals()[name] = value
+        return value
+    if name in _LAZY_MODULES:
+        return importlib.import_module('cp2130.%s'%name)
+    raise AttributeError("module %r has no attribute %r"%(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES) | set(_LAZY_MODULES))
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ (PEP 562) is not supported.
+    from cp2130.core import CP2130
+
+def _cached(dev, rom_cache):
+    if rom_cache is None or rom_cache is False:
+        return dev
+    from cp2130.rom_cache import CachedROMDevice, ROMCache
+    if rom_cache is True:
+        rom_cache = ROMCache()
+    return CachedROMDevice(dev, rom_cache)
+
+def find(vid=0x10c4, pid=0x87A0, rom_cache=None, backend=None):
     """Find the first CP2130 with the given vendor id and product id.
 
     :param: vid The vendor id to match.
     :param: pid The product id to match.
+    :param: rom_cache A cp2130.rom_cache.ROMCache to serve OTP ROM reads
+                      from, True for one at the default path, or None
+                      to always read the device.
+    :param: backend The USB backend, 'libusb1' or 'pyusb', or None for
+                    the preferred available one. See cp2130.usb.backend().
     :return: A cp2130.core.CP2130 instance for the matched device.
     :raises: A cp2130.usb.NoDeviceError if no matching device is found.
     """
     from cp2130.chip import CP2130Chip
     from cp2130.core import CP2130
+    from cp2130.usb import backend as usb_backend
 
-    try:
-        from cp2130.usb import libusb1 as usb
-    except:
-        raise
-        from cp2130.usb import pyusb as usb
-    
-    dev  = usb.find(vid, pid)
+    dev  = _cached(usb_backend(backend).find(vid, pid), rom_cache)
     chip = CP2130Chip(dev)
     return CP2130(chip)
 
-def hotplug(on_plugged, vid=0x10c4, pid=0x87A0):
+def find_all(vid=0x10c4, pid=0x87A0, rom_cache=None, backend=None):
+    """Find all CP2130s with the given vendor id and product id, e.g., to
+    program a fixture holding many devices.
+
+    :param: vid The vendor id to match.
+    :param: pid The product id to match.
+    :param: rom_cache A cp2130.rom_cache.ROMCache to serve OTP ROM reads
+                      from, True for one at the default path, or None
+                      to always read the device.
+    :param: backend The USB backend, 'libusb1' or 'pyusb', or None for
+                    the preferred available one. See cp2130.usb.backend().
+    :return: A list of cp2130.core.CP2130 instances, possibly empty.
+    """
+    from cp2130.chip import CP2130Chip
+    from cp2130.core import CP2130
+    from cp2130.usb import backend as usb_backend
+
+    return [CP2130(CP2130Chip(_cached(dev, rom_cache))) for dev in usb_backend(backend).find_all(vid, pid)]
+
+def hotplug(on_plugged, vid=0x10c4, pid=0x87A0, backend=None):
     """Register a function to call with each hotplugged CP2130 matching
     the given vendor id and product id.
 
@@ -47,6 +108,9 @@ def hotplug(on_plugged, vid=0x10c4, pid=0x87A0):
                        hotplugged device.
     :param: vid The vendor id to match.
     :param: pid The product id to match.
+    :param: backend The USB backend, 'libusb1' or 'pyusb', or None for
+                    the preferred available one. The PyUSB backend polls the
+                    bus.
 
     :return: A cp2130.usb.HotplugListener instance. Call '#stop()' to
     stop receiving events.
@@ -54,16 +118,10 @@ def hotplug(on_plugged, vid=0x10c4, pid=0x87A0):
     """
     from cp2130.chip import CP2130Chip
     from cp2130.core import CP2130
-
-    try:
-        from cp2130.usb import libusb1 as usb
-    except:
-        import logging
-        logging.getLogger().error("asdf", exc_info=True)
-        from cp2130.usb import pyusb as usb
+    from cp2130.usb import backend as usb_backend
 
     def on_new_device(dev):
         chip = CP2130Chip(dev)
         on_plugged(CP2130(chip))
 
-    return usb.hotplug(vid, pid, on_new_device)
+    return usb_backend(backend).hotplug(vid, pid, on_new_device)
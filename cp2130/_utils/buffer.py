@@ -0,0 +1,27 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+def byte_view(buffer):
+    """Returns a flat memoryview of a buffer as unsigned bytes, whatever
+    its item type, e.g., for an array('H') or a NumPy array.
+
+    :param buffer: a contiguous object supporting the buffer protocol.
+    :returns: a memoryview with one item per byte.
+    """
+    view = memoryview(buffer)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
@@ -0,0 +1,176 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import array
+import subprocess
+import sys
+import time
+
+# The statements timed by the import benchmark, from the cheapest
+# entry point to a fully loaded chip API.
+IMPORT_STATEMENTS = [
+    'import cp2130',
+    'import cp2130.core',
+    'import cp2130; cp2130.CP2130',
+]
+
+class Timing(object):
+
+    def __init__(self, name, samples, nbytes=0):
+        """The samples, in seconds, of one benchmarked operation.
+
+        :param: name The operation.
+        :param: samples The durations.
+        :param: nbytes The bytes transferred by one operation, to report
+                       throughput.
+
+        """
+        self.name    = name
+        self.samples = sorted(samples)
+        self.bytes   = nbytes
+
+    def __repr__(self):
+        return "Timing(%r)"%(self.name)
+
+    def __str__(self):
+        line = "%-40s min %8.2f ms  median %8.2f ms  max %8.2f ms"%(
+            self.name, self.min * 1000.0, self.median * 1000.0, self.max * 1000.0)
+        if self.bytes:
+            line += "  %8.1f kB/s"%(self.throughput / 1000.0)
+        return line
+
+    @property
+    def throughput(self):
+        """The bytes per second at the median duration.
+
+        """
+        return self.bytes / self.median if self.median else 0.0
+
+    @property
+    def min(self):
+        return self.samples[0]
+
+    @property
+    def max(self):
+        return self.samples[-1]
+
+    @property
+    def median(self):
+        return self.samples[len(self.samples) // 2]
+
+def _interpreter_time(statement):
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', statement])
+    return time.time() - start
+
+def import_time(statements=IMPORT_STATEMENTS, repeat=10):
+    """Measures the wall time of starting a fresh interpreter and running
+    each statement, net of the time to start an empty interpreter.
+
+    :param: statements The import statements to time.
+    :param: repeat The number of interpreters started per statement.
+    :return: A list of Timing instances, one per statement.
+
+    """
+    baseline = min(_interpreter_time('pass') for _ in range(repeat))
+    return [Timing(statement, [_interpreter_time(statement) - baseline for _ in range(repeat)])
+            for statement in statements]
+
+def _time(f, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        samples.append(time.time() - start)
+    return samples
+
+def usb_transfers(backends=None, vid=0x10c4, pid=0x87A0, sizes=(64, 4096, 65536), repeat=20):
+    """Measures control transfers and bulk reads through each USB backend.
+
+    The same device is opened through every backend in turn and
+    exercised identically: a GPIO register read, then bulk reads of
+    each size both with read(), which allocates the result, and
+    readinto() a preallocated buffer. No chip-select is asserted, so
+    no slave sees the reads.
+
+    :param: backends The backend names, or None for every available one.
+    :param: vid The vendor id to match.
+    :param: pid The product id to match.
+    :param: sizes The bulk read sizes in bytes.
+    :param: repeat The samples per operation.
+    :return: A list of Timing instances.
+
+    """
+    from cp2130.chip import CP2130Chip
+    from cp2130.usb import BACKENDS, backend
+
+    timings = []
+    for name in backends or BACKENDS:
+        try:
+            module = backend(name)
+        except ImportError:
+            if backends:
+                raise
+            continue
+
+        dev  = module.find(vid, pid)
+        chip = CP2130Chip(dev)
+        try:
+            timings.append(Timing("%s control"%name, _time(chip.get_gpio_values, repeat)))
+            timings.append(Timing("%s raw control"%name, _time(chip.gpio_levels_mask, repeat)))
+            for size in sizes:
+                buffer = array.array('B', bytes(bytearray(size)))
+                timings.append(Timing("%s read %d"%(name, size),
+                                      _time(lambda: chip.read(size), repeat), size))
+                timings.append(Timing("%s readinto %d"%(name, size),
+                                      _time(lambda: chip.readinto(buffer), repeat), size))
+        finally:
+            dev.close()
+
+    if not timings:
+        # Raises an ImportError naming the missing libraries.
+        backend()
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cp2130 library.")
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    imports = subparsers.add_parser('import', help="time importing the package")
+    imports.add_argument('-n', '--repeat', type=int, default=10,
+                         help="the number of interpreters started per statement")
+
+    transfers = subparsers.add_parser('usb', help="time USB transfers through each backend")
+    transfers.add_argument('-b', '--backend', action='append',
+                           help="a backend to measure; may be repeated (default: all available)")
+    transfers.add_argument('-n', '--repeat', type=int, default=20,
+                           help="the samples per operation")
+    transfers.add_argument('--vid', type=lambda v: int(v, 0), default=0x10c4)
+    transfers.add_argument('--pid', type=lambda v: int(v, 0), default=0x87A0)
+
+    args = parser.parse_args(argv)
+    if args.benchmark == 'import':
+        for timing in import_time(repeat=args.repeat):
+            print(timing)
+    elif args.benchmark == 'usb':
+        for timing in usb_transfers(args.backend, args.vid, args.pid, repeat=args.repeat):
+            print(timing)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import argparse
+import array
+import logging
+import os
+import socket
+import struct
+import threading
+
+from cp2130.usb.usb import NoDeviceError, USBDevice
+
+# Request: op, handle, request type/endpoint, request, value, index, length.
+_REQUEST  = struct.Struct('<BBBBHHI')
+# Response: status, length.
+_RESPONSE = struct.Struct('<BI')
+
+OP_OPEN       = 1
+OP_CLOSE      = 2
+OP_ENDPOINTS  = 3
+OP_CTRL_IN    = 4
+OP_CTRL_OUT   = 5
+OP_BULK_READ  = 6
+OP_BULK_WRITE = 7
+OP_LOCK       = 8
+OP_UNLOCK     = 9
+
+STATUS_OK       = 0
+STATUS_ERROR    = 1
+STATUS_NODEVICE = 2
+
+_PIPELINED = (OP_CTRL_OUT, OP_BULK_WRITE, OP_LOCK, OP_UNLOCK)
+
+class BrokerError(EnvironmentError):
+    """Raised if the broker reports an error for a request.
+
+    """
+    pass
+
+def _recv_exact(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise EOFError("Connection closed")
+        received += n
+    return data
+
+def _default_opener(vid, pid, serial):
+    from cp2130.usb import libusb1
+    return libusb1.find(vid, pid, serial)
+
+def _read_serial(usb_device):
+    from cp2130.chip import commands
+    cmd = commands.get_serial_string
+    raw = bytearray(usb_device.control_transfer(cmd.bm_request_type, cmd.b_request, cmd.w_value, cmd.w_index, cmd.w_length))
+    length = min(raw[0], len(raw))
+    return bytes(raw[2:length]).decode('utf-16-le')
+
+# =================================== Server ===================================
+class _SharedDevice(object):
+
+    def __init__(self, usb_device):
+        self.usb_device = usb_device
+        self.lock       = threading.RLock()
+        self.clients    = 0
+
+class BrokerServer(object):
+
+    def __init__(self, path, opener=None):
+        """A broker serving CP2130 devices over a Unix domain socket, so
+        several processes can share one device. Run it with 'python -m
+        cp2130.broker <socket>'.
+
+        Each message is a fixed binary header followed by the raw
+        payload, so bulk data crosses the socket without any per-byte
+        encoding. Devices are opened on a client's first request for
+        them and shared by all clients. Requests for one device are
+        serialized; a client holding the device lock (see
+        BrokerUSBDevice.acquire) has exclusive access until it
+        releases it or disconnects.
+
+        :param: path The filesystem path of the socket.
+        :param: opener A function taking (vid, pid, serial) and returning
+                       a cp2130.usb.USBDevice. Defaults to the libusb1
+                       backend.
+
+        """
+        self.path    = path
+        self._opener = opener or _default_opener
+        self._devices = {}
+        self._devices_lock = threading.Lock()
+        self._sock    = None
+        self._thread  = None
+        self._running = False
+
+    def __repr__(self):
+        return "BrokerServer(%r)"%(self.path)
+
+    def start(self):
+        """Starts serving in a background thread.
+
+        """
+        self._listen()
+        self._thread = threading.Thread(target=self._accept_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        """Serves in the calling thread until stop() is called.
+
+        """
+        self._listen()
+        self._accept_loop()
+
+    def stop(self):
+        """Stops accepting clients and closes all devices.
+
+        """
+        self._running = False
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self._sock.close()
+            self._sock = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._devices_lock:
+            for shared in self._devices.values():
+                shared.usb_device.close()
+            self._devices.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _listen(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(16)
+        self._running = True
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                (conn, _) = self._sock.accept()
+            except (socket.error, AttributeError):
+                if self._running:
+                    logging.getLogger("cp2130.broker").error("Error accepting client", exc_info=True)
+                return
+            thread = threading.Thread(target=self._serve_client, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _open(self, vid, pid, serial):
+        # Devices are keyed by their actual serial, so clients naming a
+        # device and clients taking the first match share one handle.
+        with self._devices_lock:
+            if serial is None:
+                matches = [key for key in self._devices if key[:2] == (vid, pid)]
+                key = matches[0] if matches else None
+            else:
+                key = (vid, pid, serial)
+            shared = self._devices.get(key)
+            if shared is None:
+                usb_device = self._opener(vid, pid, serial)
+                if serial is None:
+                    try:
+                        key = (vid, pid, _read_serial(usb_device))
+                    except:
+                        usb_device.close()
+                        raise
+                shared = _SharedDevice(usb_device)
+                self._devices[key] = shared
+            shared.clients += 1
+            return (key, shared)
+
+    def _close(self, key, shared):
+        with self._devices_lock:
+            shared.clients -= 1
+            if shared.clients == 0:
+                del self._devices[key]
+                shared.usb_device.close()
+
+    def _serve_client(self, conn):
+        handles = {}
+        locks   = {}
+        try:
+            while True:
+                try:
+                    header = _recv_exact(conn, _REQUEST.size)
+                except EOFError:
+                    return
+                (op, handle, rtype, request, value, index, length) = _REQUEST.unpack(bytes(header))
+                payload = None
+                if op in (OP_OPEN, OP_CTRL_OUT, OP_BULK_WRITE):
+                    payload = _recv_exact(conn, length)
+
+                try:
+                    result = self._dispatch(op, handle, rtype, request, value, index, length, payload, handles, locks)
+                    (status, data) = (STATUS_OK, result)
+                except NoDeviceError as e:
+                    (status, data) = (STATUS_NODEVICE, str(e).encode('utf-8'))
+                except Exception as e:
+                    (status, data) = (STATUS_ERROR, ("%s: %s"%(type(e).__name__, e)).encode('utf-8'))
+
+                data = bytes(data) if data is not None else b''
+                conn.sendall(_RESPONSE.pack(status, len(data)) + data)
+        except Exception:
+            logging.getLogger("cp2130.broker").error("Error serving client", exc_info=True)
+        finally:
+            for (handle, count) in locks.items():
+                for _ in range(count):
+                    handles[handle][1].lock.release()
+            for (key, shared) in handles.values():
+                self._close(key, shared)
+            conn.close()
+
+    def _dispatch(self, op, handle, rtype, request, value, index, length, payload, handles, locks):
+        if op == OP_OPEN:
+            (vid, pid) = struct.unpack('<HH', bytes(payload[:4]))
+            serial = bytes(payload[4:]).decode('utf-8') or None
+            handle = len(handles) + 1
+            while handle in handles:
+                handle += 1
+            handles[handle] = self._open(vid, pid, serial)
+            return struct.pack('<B', handle)
+
+        if handle not in handles:
+            raise ValueError("Unknown device handle %d"%handle)
+        (key, shared) = handles[handle]
+        device = shared.usb_device
+
+        if op == OP_CLOSE:
+            for _ in range(locks.pop(handle, 0)):
+                shared.lock.release()
+            del handles[handle]
+            self._close(key, shared)
+            return None
+        if op == OP_LOCK:
+            shared.lock.acquire()
+            locks[handle] = locks.get(handle, 0) + 1
+            return None
+        if op == OP_UNLOCK:
+            if not locks.get(handle):
+                raise ValueError("Device is not locked")
+            locks[handle] -= 1
+            shared.lock.release()
+            return None
+
+        with shared.lock:
+            if op == OP_ENDPOINTS:
+                return bytes(bytearray(device.endpoints()))
+            if op == OP_CTRL_IN:
+                return device.control_transfer(rtype, request, value, index, length)
+            if op == OP_CTRL_OUT:
+                device.control_transfer(rtype, request, value, index, bytes(payload))
+                return None
+            if op == OP_BULK_READ:
+                return device.read(rtype, length)
+            if op == OP_BULK_WRITE:
+                return struct.pack('<I', device.write(rtype, bytes(payload)))
+        raise ValueError("Unknown operation %d"%op)
+
+# =================================== Client ===================================
+class BrokerUSBDevice(USBDevice):
+
+    def __init__(self, path, vid=0x10c4, pid=0x87A0, serial=None):
+        """A USB device accessed through a BrokerServer.
+
+        Control and bulk writes are pipelined: they return immediately
+        and their acknowledgements are collected before the next
+        request that needs a reply. An error from a pipelined write is
+        raised by that later request or by flush().
+
+        :param: path The filesystem path of the broker socket.
+        :param: vid The vendor id to match.
+        :param: pid The product id to match.
+        :param: serial The serial number to match, or None for the first
+                       matching device.
+
+        """
+        self.path = path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._pending = 0
+        self._io_lock = threading.RLock()
+        self._depth   = 0
+
+        payload = struct.pack('<HH', vid, pid) + (serial or '').encode('utf-8')
+        self._handle = 0
+        self._handle = bytearray(self._call(OP_OPEN, payload=payload))[0]
+
+    def __repr__(self):
+        return "BrokerUSBDevice(%r)"%(self.path)
+
+    def _send(self, op, rtype=0, request=0, value=0, index=0, length=0, payload=None):
+        if payload is not None:
+            length = len(payload)
+        header = _REQUEST.pack(op, self._handle, rtype, request, value, index, length)
+        if payload is not None and len(payload) < 4096:
+            self._sock.sendall(header + bytes(payload))
+        else:
+            self._sock.sendall(header)
+            if payload is not None:
+                self._sock.sendall(payload)
+
+    def _receive(self):
+        (status, length) = _RESPONSE.unpack(bytes(_recv_exact(self._sock, _RESPONSE.size)))
+        data = _recv_exact(self._sock, length)
+        if status == STATUS_NODEVICE:
+            raise NoDeviceError(data.decode('utf-8'))
+        if status != STATUS_OK:
+            raise BrokerError(data.decode('utf-8'))
+        return data
+
+    def _drain(self):
+        while self._pending:
+            self._pending -= 1
+            self._receive()
+
+    def _call(self, op, **kwargs):
+        with self._io_lock:
+            self._send(op, **kwargs)
+            if op in _PIPELINED:
+                self._pending += 1
+                return None
+            self._drain()
+            return self._receive()
+
+    def flush(self):
+        """Waits for the acknowledgements of all pipelined requests.
+
+        :raises: A BrokerError if any of them failed.
+
+        """
+        with self._io_lock:
+            self._drain()
+
+    def acquire(self):
+        """Locks the device in the broker for exclusive use by this client.
+        Nested calls are counted.
+
+        """
+        with self._io_lock:
+            self._depth += 1
+            if self._depth == 1:
+                self._call(OP_LOCK)
+
+    def release(self):
+        """Releases one acquire().
+
+        """
+        with self._io_lock:
+            self._depth -= 1
+            if self._depth == 0:
+                self._call(OP_UNLOCK)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._call(OP_CLOSE)
+            finally:
+                self._sock.close()
+                self._sock = None
+
+    def endpoints(self):
+        return list(bytearray(self._call(OP_ENDPOINTS)))
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if type(wLengthOrData) == int:
+            data = self._call(OP_CTRL_IN, rtype=bmRequestType, request=bRequest,
+                              value=wValue, index=wIndex, length=wLengthOrData)
+            return array.array('B', bytes(data))
+        data = bytes(bytearray(wLengthOrData))
+        self._call(OP_CTRL_OUT, rtype=bmRequestType, request=bRequest,
+                   value=wValue, index=wIndex, payload=data)
+        return len(data)
+
+    def read(self, endpoint, size):
+        return array.array('B', bytes(self._call(OP_BULK_READ, rtype=endpoint, length=size)))
+
+    def write(self, endpoint, data):
+        data = bytes(bytearray(data))
+        self._call(OP_BULK_WRITE, rtype=endpoint, payload=data)
+        return len(data)
+
+def find(path, vid=0x10c4, pid=0x87A0, serial=None):
+    """Opens a CP2130 through the broker listening on the given socket.
+
+    :param: path The filesystem path of the broker socket.
+    :param: vid The vendor id to match.
+    :param: pid The product id to match.
+    :param: serial The serial number to match, or None for the first
+                   matching device.
+    :return: A cp2130.core.CP2130 instance for the device.
+
+    """
+    from cp2130.chip import CP2130Chip
+    from cp2130.core import CP2130
+
+    dev = BrokerUSBDevice(path, vid, pid, serial)
+    return CP2130(CP2130Chip(dev))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Share CP2130 devices between processes.")
+    parser.add_argument('socket', help="the path of the Unix domain socket to listen on")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    server = BrokerServer(args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import logging
+import mmap
+import threading
+import time
+
+from six.moves import queue
+
+class CaptureStats(object):
+
+    def __init__(self):
+        """Counters describing the progress and health of a Capture.
+
+        """
+        self.chunks          = 0
+        self.bytes           = 0
+        self.overruns        = 0
+        self.dropped_bytes   = 0
+        self.stalls          = 0
+        self.stall_time      = 0.0
+        self.max_queue_depth = 0
+        self.segments        = 0
+
+    def __repr__(self):
+        return "CaptureStats()"
+
+    def __str__(self):
+        return """CaptureStats
+  chunks:          %d
+  bytes:           %d
+  overruns:        %d
+  dropped_bytes:   %d
+  stalls:          %d
+  stall_time:      %.3f s
+  max_queue_depth: %d
+  segments:        %d"""%(self.chunks, self.bytes, self.overruns, self.dropped_bytes,
+                          self.stalls, self.stall_time, self.max_queue_depth,
+                          self.segments)
+
+class _Output(object):
+
+    def __init__(self, path, segment_size, preallocate):
+        """Memory-mapped output file, optionally rotated into fixed-size
+        segments named <path>.0000, <path>.0001, ...
+
+        """
+        self.path         = path
+        self.segment_size = segment_size
+        self.preallocate  = preallocate
+
+        self.segment = -1
+        self.file    = None
+        self.map     = None
+        self.offset  = 0
+        self.index   = None
+
+    def open_index(self):
+        self.index = open(self.path + '.idx', 'w')
+        self.index.write("# seq segment offset length timestamp\n")
+
+    def _segment_path(self):
+        if self.segment_size:
+            return "%s.%04d"%(self.path, self.segment)
+        return self.path
+
+    def _open(self):
+        self._close()
+        self.segment += 1
+        size = self.segment_size or self.preallocate
+        self.file = open(self._segment_path(), 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.offset = 0
+
+    def _grow(self, needed):
+        size = len(self.map)
+        while size < needed:
+            size *= 2
+        self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+    def _close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.truncate(self.offset)
+            self.file.close()
+            self.file = None
+
+    def write(self, seq, view, timestamp):
+        if self.map is None:
+            self._open()
+        end = self.offset + len(view)
+        if end > len(self.map):
+            if self.segment_size:
+                self._open()
+                end = len(view)
+            else:
+                self._grow(end)
+        self.map[self.offset:end] = view
+        self.index.write("%d %d %d %d %.6f\n"%(seq, self.segment, self.offset, len(view), timestamp))
+        self.offset = end
+
+    def close(self):
+        self._close()
+        if self.index is not None:
+            self.index.close()
+
+class Capture(object):
+
+    def __init__(self, channel, path, chunk_size=65536, buffers=16,
+                 segment_size=None, preallocate=64 * 1024 * 1024, block=True,
+                 read=None, readinto=None):
+        """A continuous capture of SPI data to disk.
+
+        A reader thread reads from the channel directly into a fixed
+        pool of preallocated buffers. A writer thread copies them into a memory-mapped
+        output file and returns them to the pool, so memory use is
+        bounded regardless of the capture length. An index file
+        <path>.idx records the sequence number, segment, offset,
+        length and timestamp of every chunk.
+
+        If the writer falls behind and the pool runs dry, the reader
+        either waits for a free buffer (block=True), which is counted
+        as a stall, or reads and discards the chunk to keep the USB
+        pipe draining (block=False), which is counted as an overrun.
+
+        :param: channel The cp2130.spi.SPIChannel to read.
+        :param: path The output file path.
+        :param: chunk_size The number of bytes per read.
+        :param: buffers The number of buffers in the pool.
+        :param: segment_size The size in bytes at which to rotate to a
+                             new segment file, or None for a single
+                             file. Should be a multiple of chunk_size.
+        :param: preallocate The initial size of a single output file. The
+                            file grows as needed and is truncated to the
+                            captured length when the capture stops.
+        :param: block True to wait for a free buffer, False to drop data.
+        :param: read A function taking a length and returning data, to use
+                     instead of channel.readinto, e.g., to issue a
+                     command before each read. The data is copied into
+                     the pool buffers.
+        :param: readinto A function taking a writable buffer, filling it
+                         and returning the number of bytes read, to use
+                         instead of channel.readinto without a copy.
+        :raises: A ValueError if segment_size is smaller than chunk_size,
+                 or a single output file has no preallocated size.
+
+        """
+        if segment_size is not None and segment_size < chunk_size:
+            raise ValueError("segment_size must be at least chunk_size")
+        if segment_size is None and preallocate <= 0:
+            raise ValueError("preallocate must be positive without a segment_size")
+
+        self.channel    = channel
+        self.path       = path
+        self.chunk_size = chunk_size
+        self.block      = block
+        self.stats      = CaptureStats()
+        self.error      = None
+
+        if readinto is None and read is not None:
+            readinto = lambda view: self._copy(read, view)
+        self._readinto = readinto or channel.readinto
+        self._free     = queue.Queue()
+        self._filled   = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(bytearray(chunk_size))
+        # Chunks dropped on an overrun are read into this.
+        self._discard = bytearray(chunk_size)
+
+        self._output  = _Output(path, segment_size, preallocate)
+        self._running = False
+        self._limit   = None
+        self._reader  = None
+        self._writer  = None
+
+    def __repr__(self):
+        return "Capture(%r, %r)"%(self.channel, self.path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def _copy(read, view):
+        data = read(len(view))
+        length = len(data)
+        view[:length] = memoryview(data)
+        return length
+
+    def start(self, total_bytes=None):
+        """Starts capturing in the background.
+
+        :param: total_bytes The number of bytes after which to stop, or
+                            None to capture until stop() is called.
+        :raises: A RuntimeError if the capture was already started. A
+                 Capture writes its output once; create another to
+                 capture again.
+
+        """
+        if self._output.index is not None:
+            raise RuntimeError("Capture of %s was already started"%self.path)
+        self._output.open_index()
+        self._limit   = total_bytes
+        self._running = True
+        self._writer = threading.Thread(target=self._write_loop)
+        self._reader = threading.Thread(target=self._read_loop)
+        for thread in (self._writer, self._reader):
+            thread.daemon = True
+            thread.start()
+
+    def wait(self, timeout=None):
+        """Waits for a capture started with a byte limit to finish.
+
+        :return: True if the capture finished, or was never started.
+
+        """
+        if self._reader is None:
+            return True
+        self._reader.join(timeout)
+        if self._reader.is_alive():
+            return False
+        self.stop()
+        return True
+
+    def stop(self):
+        """Stops capturing, writes out all buffered data and closes the
+        output.
+
+        :raises: Any error raised by the reader or writer thread.
+
+        """
+        if self._reader is None:
+            return
+        self._running = False
+        self._reader.join()
+        self._filled.put(None)
+        self._writer.join()
+        self._output.close()
+        self.stats.segments = self._output.segment + 1
+        self._reader = None
+        if self.error is not None:
+            raise self.error
+
+    def _read_loop(self):
+        seq = 0
+        try:
+            while self._running:
+                n = self.chunk_size
+                if self._limit is not None:
+                    n = min(n, self._limit - self.stats.bytes - self.stats.dropped_bytes)
+                    if n <= 0:
+                        break
+
+                try:
+                    buf = self._free.get_nowait()
+                except queue.Empty:
+                    if self.block:
+                        start = time.time()
+                        buf = self._free.get()
+                        self.stats.stalls += 1
+                        self.stats.stall_time += time.time() - start
+                    else:
+                        buf = None
+
+                length = self._readinto(memoryview(self._discard if buf is None else buf)[:n])
+                timestamp = time.time()
+                if buf is None:
+                    self.stats.overruns += 1
+                    self.stats.dropped_bytes += length
+                    seq += 1
+                    continue
+
+                self._filled.put((seq, buf, length, timestamp))
+                self.stats.max_queue_depth = max(self.stats.max_queue_depth, self._filled.qsize())
+                self.stats.chunks += 1
+                self.stats.bytes += length
+                seq += 1
+        except Exception as e:
+            logging.getLogger("cp2130.capture").error("Error reading capture data", exc_info=True)
+            self.error = e
+
+    def _write_loop(self):
+        while True:
+            item = self._filled.get()
+            if item is None:
+                return
+            (seq, buf, length, timestamp) = item
+            try:
+                if self.error is None:
+                    self._output.write(seq, memoryview(buf)[:length], timestamp)
+            except Exception as e:
+                logging.getLogger("cp2130.capture").error("Error writing capture data", exc_info=True)
+                self.error = e
+                self._running = False
+            finally:
+                self._free.put(buf)
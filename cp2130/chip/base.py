@@ -86,40 +86,31 @@ class RegisterBase(type):
     """A meta-class that generates properties (setters and getters) for in
     field in the 'pattern' member of the class.
 
+    The bitstring format and the properties are generated on first use
+    of the class, so that importing the register tables stays cheap.
+
     """
 
     def __new__(cls, name, bases, attrs):
         # Only generate members and methods on subclasses of Register
         if any(isinstance(b, RegisterBase) for b in bases):
-            pattern = attrs['pattern']
-            fields  = [f for f in pattern if is_field(f)]
-
-            attrs['_fields'] = fields
-            
-            # bitstring format 
-            attrs['format'] = ", ".join([f.format for f in pattern])
-
-            # properties for each field
-            for (idx, f) in enumerate(fields):
-                fget = lambda self, i=idx: self._get_field(i)
-                fset = lambda self, value, i=idx: self._set_field(i, value)
-                attrs[f.name] = property(fget, fset)
-
-            @classmethod
-            def make(cls, *values):
-                encoded = [f.from_python(v) for (f, v) in zip(cls._fields, values)]
-                packed = bitstring.pack(cls.format, *encoded).tobytes()
-                return cls(packed)
-            attrs['make'] = make
-
-            @classmethod
-            def default(cls):
-                defaults = [f.default() for f in cls._fields]
-                return cls.make(*defaults)
-            attrs['default'] = default
+            attrs['_fields']   = [f for f in attrs['pattern'] if is_field(f)]
+            attrs['_prepared'] = False
 
         return super(RegisterBase, cls).__new__(cls, name, bases, attrs)
 
+    def _prepare(cls):
+        # bitstring format
+        cls.format = ", ".join([f.format for f in cls.pattern])
+
+        # properties for each field
+        for (idx, f) in enumerate(cls._fields):
+            fget = lambda self, i=idx: self._get_field(i)
+            fset = lambda self, value, i=idx: self._set_field(i, value)
+            setattr(cls, f.name, property(fget, fset))
+
+        cls._prepared = True
+
 class Register(object, six.with_metaclass(RegisterBase)):
 
     def __init__(self, raw):
@@ -128,17 +119,32 @@ class Register(object, six.with_metaclass(RegisterBase)):
         The 'pattern' class member list defines the placeholders and
         fields.
 
-        The RegisterBase metaclass generated a 'property' for each
+        The RegisterBase metaclass generates a 'property' for each
         field.
 
         """
         if not isinstance(raw, bytes):
             raise ValueError("Argument :raw: must be of type :bytes:")
+        if not self._prepared:
+            type(self)._prepare()
 
         self._values = bitstring.BitArray(bytes = raw).unpack(self.format)
 
         self.name = self.__class__.__name__
 
+    @classmethod
+    def make(cls, *values):
+        if not cls._prepared:
+            cls._prepare()
+        encoded = [f.from_python(v) for (f, v) in zip(cls._fields, values)]
+        packed = bitstring.pack(cls.format, *encoded).tobytes()
+        return cls(packed)
+
+    @classmethod
+    def default(cls):
+        defaults = [f.default() for f in cls._fields]
+        return cls.make(*defaults)
+
     @property
     def raw(self):
         return bitstring.pack(self.format, *self._values).tobytes()
@@ -16,32 +16,91 @@ from __future__ import absolute_import
 
 import six
 import struct
+import threading
 
+from cp2130.chip import commands
 from cp2130.chip.commands import *
 
+def _to_bytes(data):
+    # array.tostring() was removed in Python 3.9 and tobytes() does not
+    # exist in Python 2.
+    if isinstance(data, bytes):
+        return data
+    tobytes = getattr(data, 'tobytes', None)
+    return tobytes() if tobytes is not None else bytes(bytearray(data))
+
+def _raw_setup(cmd):
+    # (bmRequestType, bRequest, wValue, wIndex, wLength, indexed). wIndex
+    # is None for commands addressed by wIndex; indexed is True for
+    # writes that prefix the data with the entry index.
+    return (cmd.bm_request_type, cmd.b_request, cmd.w_value, getattr(cmd, 'w_index', None),
+            cmd.w_length, isinstance(cmd, ArrayCommand) and cmd.direction == Dir.OUT)
+
+# Factories of the generated command methods, by direction and command type.
+_METHODS = {
+    Dir.IN : {
+        Command      : lambda cmd: lambda self:                  self.do_in_command(cmd),
+        ArrayCommand : lambda cmd: lambda self, index:           self.do_in_command(cmd.at(index)),
+        IndexCommand : lambda cmd: lambda self, index:           self.do_in_command(cmd.at(index)),
+    },
+    Dir.OUT: {
+        Command      : lambda cmd: lambda self,        register: self.do_out_command(cmd, register),
+        ArrayCommand : lambda cmd: lambda self, index, register: self.do_out_command(cmd.at(index), register),
+        IndexCommand : lambda cmd: lambda self, index, register: self.do_out_command(cmd.at(index), register),
+        UnitCommand  : lambda cmd: lambda self:                  self.do_out_command(cmd, None)
+    }
+}
+
 class ChipBase(type):
 
     def __new__(cls, cls_name, bases, attrs):
         # Generate a class method for each command
         for name in attrs['commands']:
-            cmd    = globals()[name]
-            method = {
-                Dir.IN : {
-                    Command      : lambda self,                  cmd=cmd: self.do_in_command(cmd),
-                    ArrayCommand : lambda self, index,           cmd=cmd: self.do_in_command(cmd.at(index)),
-                    IndexCommand : lambda self, index,           cmd=cmd: self.do_in_command(cmd.at(index)),
-                },
-                Dir.OUT: {
-                    Command      : lambda self,        register, cmd=cmd: self.do_out_command(cmd, register),
-                    ArrayCommand : lambda self, index, register, cmd=cmd: self.do_out_command(cmd.at(index), register),
-                    IndexCommand : lambda self, index, register, cmd=cmd: self.do_out_command(cmd.at(index), register),
-                    UnitCommand  : lambda self,                  cmd=cmd: self.do_out_command(cmd, None)
-                }
-            }[cmd.direction][type(cmd)]
-            attrs[name] = method
-            
+            cmd = globals()[name]
+            attrs[name] = _METHODS[cmd.direction][type(cmd)](cmd)
+
+        # Filled in on first use of each command by raw_in() and raw_out().
+        attrs['raw_setups'] = {}
+
         return super(ChipBase, cls).__new__(cls, cls_name, bases, attrs)
 
+class _TransactionLock(object):
+
+    def __init__(self, lock, usb_device):
+        """A re-entrant lock that also holds the USB device for the duration,
+        for devices shared with other processes.
+
+        """
+        self._lock       = lock
+        self._usb_device = usb_device
+        self._depth      = 0
+
+    def acquire(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            try:
+                getattr(self._usb_device, 'acquire', lambda: None)()
+            except:
+                self._depth -= 1
+                self._lock.release()
+                raise
+
+    def release(self):
+        try:
+            if self._depth == 1:
+                getattr(self._usb_device, 'release', lambda: None)()
+        finally:
+            self._depth -= 1
+            self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
 class CP2130Chip(object, six.with_metaclass(ChipBase)):
 
     commands = [
@@ -84,37 +143,145 @@ class CP2130Chip(object, six.with_metaclass(ChipBase)):
     ]
 
     def __init__(self, usb_device):
-        self._usb_device = usb_device
+        self._usb_device  = usb_device
+        self._lock        = threading.RLock()
+        self._transaction = _TransactionLock(self._lock, usb_device)
 
     @property
     def usb_device(self):
         return self._usb_device
 
+    def transaction(self):
+        """Returns a context manager that gives the calling thread exclusive
+        access to the device for the duration of the 'with' block.
+
+        Each command is already atomic. Use this to group several
+        commands, e.g., asserting a chip-select, transferring data,
+        and deasserting the chip-select, into one indivisible
+        unit. The lock is re-entrant, so transactions may be nested.
+
+        """
+        return self._transaction
+
     def do_in_command(self, cmd):
-        data = self.usb_device.control_transfer(cmd.bm_request_type, cmd.b_request, cmd.w_value, cmd.w_index, cmd.w_length)
-        return cmd.to_register(data.tostring())
+        with self._transaction:
+            data = self.usb_device.control_transfer(cmd.bm_request_type, cmd.b_request, cmd.w_value, cmd.w_index, cmd.w_length)
+        return cmd.to_register(_to_bytes(data))
+
+    def get_spi_words(self):
+        """Gets the SPI word registers of all channels with one control
+        transfer.
+
+        :return: A list of the eleven spi_word registers, indexed by channel.
+
+        """
+        cmd = commands.get_spi_word
+        with self._lock:
+            data = self.usb_device.control_transfer(cmd.bm_request_type, cmd.b_request, cmd.w_value, cmd.w_index, cmd.w_length)
+        data = _to_bytes(data)
+        return [cmd.at(index).to_register(data) for index in range(cmd.w_length // cmd.entry_len)]
+
+    def _raw_setup(self, name):
+        setup = self.raw_setups.get(name)
+        if setup is None:
+            if name not in self.commands:
+                raise KeyError(name)
+            setup = self.raw_setups[name] = _raw_setup(globals()[name])
+        return setup
+
+    def raw_in(self, name, index=0):
+        """Issues an IN command and returns its data undecoded.
+
+        This skips the register, field and enum decoding of the get_
+        methods, for code that knows the register layouts.
+
+        :param: name The name of the command, e.g., 'get_gpio_values'.
+        :param: index The wIndex, for commands addressed by one, e.g.,
+                      the channel of 'get_spi_delay'.
+        :return: The data as bytes.
+
+        """
+        (request_type, request, value, w_index, length, _) = self._raw_setup(name)
+        if w_index is None:
+            w_index = index
+        with self._lock:
+            data = self.usb_device.control_transfer(request_type, request, value, w_index, length)
+        return _to_bytes(data)
+
+    def raw_out(self, name, data=b'', index=None):
+        """Issues an OUT command with the given data unencoded.
+
+        :param: name The name of the command, e.g., 'set_gpio_values'.
+        :param: data The data as bytes.
+        :param: index The entry index, prefixed to the data for
+                      per-channel commands like 'set_spi_word', or None
+                      if it is already included.
+
+        """
+        (request_type, request, value, w_index, _, indexed) = self._raw_setup(name)
+        if indexed and index is not None:
+            data = struct.pack('<B', index) + data
+        with self._lock:
+            self.usb_device.control_transfer(request_type, request, value, w_index or 0, data)
+
+    def gpio_levels_mask(self):
+        """Gets the logic levels of all GPIOs with one control transfer.
+
+        :return: An int with bit n set if GPIO n is high.
+
+        """
+        (value,) = struct.unpack('>H', self.raw_in('get_gpio_values'))
+        return ((value >> 3) & 0x003F) | ((value >> 4) & 0x07C0)
+
+    def set_gpio_levels_mask(self, levels, mask=0x07FF):
+        """Sets the logic levels of several GPIOs with one control transfer.
+
+        :param: levels An int with bit n set to drive GPIO n high.
+        :param: mask An int with bit n set to change GPIO n.
+
+        """
+        def wire(bits):
+            return ((bits & 0x003F) << 3) | ((bits & 0x07C0) << 4)
+        self.raw_out('set_gpio_values', struct.pack('>HH', wire(levels), wire(mask)))
 
     def do_out_command(self, cmd, register):
         data = cmd.to_data(register)
-        self.usb_device.control_transfer(cmd.bm_request_type, cmd.b_request, cmd.w_value, cmd.w_index, data)
+        with self._lock:
+            self.usb_device.control_transfer(cmd.bm_request_type, cmd.b_request, cmd.w_value, cmd.w_index, data)
         
     def read(self, size):
         command = struct.pack('<HBBI', 0x0000, 0x00, 0x00, size)
-        self.usb_device.write(0x01, command)
-        return self.usb_device.read(0x82, size)
+        with self._transaction:
+            self.usb_device.write(0x01, command)
+            return self.usb_device.read(0x82, size)
+
+    def readinto(self, buffer):
+        """Reads the size of a preallocated buffer in bytes into it, avoiding
+        a new allocation per read.
+
+        :return: The number of bytes read.
+
+        """
+        command = struct.pack('<HBBI', 0x0000, 0x00, 0x00, memoryview(buffer).nbytes)
+        with self._transaction:
+            self.usb_device.write(0x01, command)
+            return self.usb_device.readinto(0x82, buffer)
 
     def write(self, data):
         size = len(data)
         command = struct.pack('<HBBI%ds'%size, 0x0000, 0x01, 0x00, size, data)
-        return self.usb_device.write(0x01, command)
+        with self._lock:
+            return self.usb_device.write(0x01, command)
 
     def write_read(self, data):
         size = len(data)
         command = struct.pack('<HBBI%ds'%size, 0x0000, 0x02, 0x00, size, data)
-        self.usb_device.write(0x01, command)
-        return self.usb_device.read(0x82, size)
+        with self._transaction:
+            self.usb_device.write(0x01, command)
+            return self.usb_device.read(0x82, size)
 
     def read_with_rtr(self, size):
         command = struct.pack('<HBBI', 0x0000, 0x04, 0x00, size)
-        self.usb_device.write(0x01, command)
-        return self.usb_device.read(0x82, size)
+        with self._transaction:
+            self.usb_device.write(0x01, command)
+            return self.usb_device.read(0x82, size)
@@ -16,8 +16,6 @@ from __future__ import absolute_import
 
 import bitstring
 
-from bidict import bidict
-
 from cp2130.chip.base import Field
 from cp2130._utils.bcd import *
 
@@ -72,7 +70,17 @@ class DictField(Field):
         :encoding: a 'dict' mapping the Python values to register values
         """
         super(DictField, self).__init__(name, format, next(iter(encoding)))
-        self._encoding = bidict(encoding)
+        self._dict     = encoding
+        self._bidict   = None
+
+    @property
+    def _encoding(self):
+        # Built on first use, as importing and constructing the bidicts
+        # for every register field dominates the import time.
+        if self._bidict is None:
+            from bidict import bidict
+            self._bidict = bidict(self._dict)
+        return self._bidict
 
     def to_python(self, value):
         if value not in self._encoding.inv:
@@ -100,6 +108,13 @@ class DiscreteRangeField(Field):
         self._drange = drange
         self._pred = pred
 
+    @property
+    def values(self):
+        """The discrete values of the range, in register order.
+
+        """
+        return list(self._drange)
+
     def to_python(self, value):
         if value not in range(0, len(self._drange)):
             raise ValueError("%s is not a valid value for %s"%(value, self.name))
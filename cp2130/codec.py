@@ -0,0 +1,196 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import array
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class SampleFormat(object):
+
+    WIDTHS = (8, 12, 16, 24, 32)
+
+    def __init__(self, width=16, big_endian=True, signed=False, channels=1,
+                 mask=None, shift=0):
+        """A declarative description of packed samples in a SPI data stream.
+
+        Samples are decoded into NumPy arrays if NumPy is installed,
+        and into 'array.array' instances otherwise. With NumPy,
+        byte-aligned samples that need no masking are decoded without
+        copying the buffer; all other layouts are decoded with
+        vectorized operations.
+
+        :param: width The number of bits per sample in the stream: 8, 12,
+                      16, 24 or 32. 12-bit samples are packed two per
+                      three bytes.
+        :param: big_endian True if multi-byte samples are transmitted
+                           most-significant byte first. 12-bit samples
+                           are always big-endian.
+        :param: signed True if the samples are two's complement.
+        :param: mask A mask selecting the data bits of each raw sample,
+                     e.g., to drop status bits, or None for all bits.
+        :param: shift The number of bits to shift the masked sample right.
+        :param: channels The number of interleaved channels. With NumPy,
+                         the result has one column per channel.
+
+        """
+        if width not in self.WIDTHS:
+            raise ValueError("Width must be one of %s"%(self.WIDTHS,))
+        self.width      = width
+        self.big_endian = big_endian
+        self.signed     = signed
+        self.channels   = channels
+        self.mask       = mask
+        self.shift      = shift
+
+        full = (1 << width) - 1
+        self._mask = full if mask is None else (mask & full)
+        self.bits  = (self._mask >> shift).bit_length()
+
+    def __repr__(self):
+        return "SampleFormat(%r, big_endian=%r, signed=%r, channels=%r, mask=%r, shift=%r)"%(
+            self.width, self.big_endian, self.signed, self.channels, self.mask, self.shift)
+
+    @property
+    def frame_size(self):
+        """The number of bytes in the smallest whole group of samples, i.e.,
+        one sample per channel, doubled for packed 12-bit samples.
+
+        """
+        if self.width == 12:
+            return 3 * self.channels
+        return (self.width // 8) * self.channels
+
+    def nbytes(self, frames):
+        """Returns the number of bytes holding the given number of frames
+        (one sample per channel).
+
+        """
+        if self.width == 12:
+            return (3 * frames * self.channels + 1) // 2
+        return frames * (self.width // 8) * self.channels
+
+    @property
+    def _is_plain(self):
+        return self.width != 12 and self.width != 24 and self._mask == (1 << self.width) - 1 and self.shift == 0
+
+    def decode(self, data):
+        """Decodes a buffer of samples.
+
+        :param: data Any object supporting the buffer protocol, e.g., the
+                     'array.array' returned by SPIChannel.read().
+        :return: A NumPy array of shape (n, channels), or, without NumPy,
+                 a flat 'array.array' of interleaved samples.
+
+        """
+        if len(data) % self.frame_size and self.width != 12:
+            raise ValueError("Buffer length %d is not a multiple of the frame size %d"%(len(data), self.frame_size))
+        if numpy is not None:
+            return self._decode_numpy(data)
+        return self._decode_array(data)
+
+    def iter_decode(self, chunks):
+        """Decodes a stream of buffers, carrying partial frames over to the
+        next buffer.
+
+        :param: chunks An iterable of buffers.
+        :return: An iterator of decoded arrays.
+
+        """
+        pending = b''
+        for chunk in chunks:
+            if pending:
+                chunk = pending + bytes(bytearray(chunk))
+            size = len(chunk) - (len(chunk) % self.frame_size)
+            pending = bytes(bytearray(chunk[size:]))
+            if size:
+                yield self.decode(memoryview(chunk)[:size] if size < len(chunk) else chunk)
+
+    # -------------------------------- NumPy --------------------------------
+    def _decode_numpy(self, data):
+        width = self.width
+        if width in (8, 16, 32):
+            order = '>' if self.big_endian else '<'
+            kind = 'i' if (self.signed and self._is_plain) else 'u'
+            samples = numpy.frombuffer(data, dtype='%s%s%d'%(order, kind, width // 8))
+        else:
+            raw = numpy.frombuffer(data, dtype=numpy.uint8)
+            if width == 24:
+                raw = raw.reshape(-1, 3).astype(numpy.uint32)
+                if self.big_endian:
+                    samples = (raw[:, 0] << 16) | (raw[:, 1] << 8) | raw[:, 2]
+                else:
+                    samples = (raw[:, 2] << 16) | (raw[:, 1] << 8) | raw[:, 0]
+            else:
+                whole = len(raw) - (len(raw) % 3)
+                groups = raw[:whole].reshape(-1, 3).astype(numpy.uint16)
+                samples = numpy.empty(2 * len(groups) + (len(raw) - whole > 1), dtype=numpy.uint16)
+                samples[0:2 * len(groups):2] = (groups[:, 0] << 4) | (groups[:, 1] >> 4)
+                samples[1:2 * len(groups):2] = ((groups[:, 1] & 0x0F) << 8) | groups[:, 2]
+                if len(samples) > 2 * len(groups):
+                    samples[-1] = (int(raw[whole]) << 4) | (int(raw[whole + 1]) >> 4)
+
+        if not self._is_plain:
+            samples = (samples.astype(numpy.int64 if self.signed else numpy.uint32) & self._mask) >> self.shift
+            if self.signed:
+                sign = 1 << (self.bits - 1)
+                samples = ((samples ^ sign) - sign).astype(numpy.int32)
+
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels)
+        return samples
+
+    # -------------------------------- array --------------------------------
+    def _decode_array(self, data):
+        raw = bytearray(data)
+        width = self.width
+        if width == 8:
+            samples = array.array('b' if (self.signed and self._is_plain) else 'B', bytes(raw))
+        elif width in (16, 32):
+            typecode = self._typecode(width // 8, self.signed and self._is_plain)
+            samples = array.array(typecode, bytes(raw))
+            if self.big_endian != (sys.byteorder == 'big'):
+                samples.byteswap()
+        elif width == 24:
+            (hi, lo) = (0, 2) if self.big_endian else (2, 0)
+            samples = array.array('L', [(raw[i + hi] << 16) | (raw[i + 1] << 8) | raw[i + lo]
+                                        for i in range(0, len(raw), 3)])
+        else:
+            values = []
+            for i in range(0, len(raw) - 1, 3):
+                values.append((raw[i] << 4) | (raw[i + 1] >> 4))
+                if i + 2 < len(raw):
+                    values.append(((raw[i + 1] & 0x0F) << 8) | raw[i + 2])
+            samples = array.array('L', values)
+
+        if not self._is_plain:
+            (mask, shift) = (self._mask, self.shift)
+            if self.signed:
+                sign = 1 << (self.bits - 1)
+                samples = array.array('l', [(((v & mask) >> shift) ^ sign) - sign for v in samples])
+            else:
+                samples = array.array('L', [(v & mask) >> shift for v in samples])
+        return samples
+
+    @staticmethod
+    def _typecode(size, signed):
+        for code in ('H', 'I', 'L'):
+            if array.array(code).itemsize == size:
+                return code.lower() if signed else code
+        raise ValueError("No array type with %d-byte items"%size)
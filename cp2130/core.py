@@ -14,7 +14,7 @@
 
 from __future__ import absolute_import
 
-from cp2130.chip import registers
+from cp2130.chip import CP2130Chip, registers
 from cp2130.data import *
 from cp2130.spi import *
 
@@ -22,6 +22,8 @@ from cp2130.clock import Clock
 from cp2130.event_counter import EventCounter
 from cp2130.gpio import Pin, GPIO
 from cp2130.pin_config import PinConfig
+from cp2130.state import ChipState
+from cp2130.transaction import Transaction
 from cp2130.usb_config import USBConfig
 
 class CP2130(object):
@@ -60,8 +62,10 @@ class CP2130(object):
         self.gpio9  = GPIO( 9, chip)
         self.gpio10 = GPIO(10, chip)
 
+        # The pin configuration is read once for all channels.
+        pin_config = chip.get_pin_config()
         def channel_for(gpio):
-            function = gpio.function
+            function = getattr(pin_config, gpio.name)
             if function in [OutputMode.PUSH_PULL, OutputMode.OPEN_DRAIN]:
                 return SPIChannelGPIO(self, gpio.num)
             else:
@@ -109,12 +113,157 @@ class CP2130(object):
         version = self.chip.get_readonly_version()
         return Version(version.major, version.minor)
 
+    def group(self, *channels):
+        """Returns a cp2130.spi.ChannelGroup that writes to several channels
+        at once.
+
+        :param: channels The SPIChannel instances to group.
+
+        """
+        return ChannelGroup(channels)
+
+    def sweep(self, operations):
+        """Performs an operation on each of several SPI channels, back to
+        back, in one transaction on the chip.
+
+        The operations are reordered to minimize chip-select
+        changes. Channels using the native chip-select are visited
+        first; each is selected with a single exclusive enable that
+        also deselects the previous one. Channels using a GPIO
+        chip-select follow; the previous line is released and the
+        next asserted in a single masked GPIO write. The SPI word
+        settings are per-channel registers, so no reconfiguration is
+        needed between slaves.
+
+        :param: operations An iterable of (channel, operation) pairs. The
+                           operation is either a
+                           cp2130.transaction.Transaction or bytes to
+                           exchange with write_read. Each channel may
+                           appear at most once.
+        :return: A dict mapping each channel to the result of its
+                 operation, i.e., the read data for bytes or the list
+                 of read results for a Transaction.
+
+        """
+        native = []
+        manual = []
+        seen   = set()
+        for (channel, operation) in operations:
+            if channel.master is not self:
+                raise ValueError("%r is not a channel of this device"%(channel))
+            if channel.cs_num in seen:
+                raise ValueError("Channel %d appears more than once; combine its operations in one Transaction"%channel.cs_num)
+            seen.add(channel.cs_num)
+
+            if isinstance(operation, Transaction):
+                entry = (channel, operation.compile(), False)
+            else:
+                entry = (channel, Transaction().write_read(operation).compile(), True)
+
+            if isinstance(channel, SPIChannelGPIO):
+                manual.append(entry)
+            else:
+                native.append(entry)
+
+        native.sort(key=lambda entry: entry[0].cs_num)
+        manual.sort(key=lambda entry: entry[0].cs_num)
+
+        results = {}
+        def run(entry):
+            (channel, segments, single) = entry
+            data = channel._run(segments)
+            results[channel] = data[0] if single else data
+
+        with self.chip.transaction():
+            self._sweep_native(native, run)
+            self._sweep_manual(manual, run)
+        return results
+
+    def _sweep_native(self, entries, run):
+        selected = None
+        try:
+            for entry in entries:
+                selected = entry[0]
+                selected.gpio.cs_enable = ChipSelectControl.ENABLED_EXCLUSIVE
+                run(entry)
+        finally:
+            if selected is not None:
+                selected.gpio.cs_enable = ChipSelectControl.DISABLED
+
+    def _sweep_manual(self, entries, run):
+        selected = None
+        try:
+            for entry in entries:
+                reg = registers.gpio_values_setter.default()
+                if selected is not None:
+                    reg.set_level(selected.cs_num, LogicLevel.HIGH)
+                selected = entry[0]
+                reg.set_level(selected.cs_num, LogicLevel.LOW)
+                self.chip.set_gpio_values(reg)
+                run(entry)
+        finally:
+            if selected is not None:
+                selected.gpio.value = LogicLevel.HIGH
+
+    def snapshot(self):
+        """Captures the volatile runtime configuration of the device: the SPI
+        word and delay settings of every channel, the GPIO modes and
+        levels, the chip-select enables, the clock divider, the event
+        counter mode and the FIFO full threshold. The pin configuration
+        is read too, so that only GPIOs configured as outputs have
+        their levels restored.
+
+        Each register is read once, 18 control transfers in all.
+
+        :return: An immutable cp2130.state.ChipState.
+
+        """
+        return ChipState.read(self.chip)
+
+    def restore(self, state, current=None):
+        """Returns the device to a state captured by snapshot(), writing only
+        the registers that differ from the device's current state.
+
+        Chip-selects enabled in the state are restored as
+        ChipSelectControl.ENABLED, as the chip does not report
+        whether an enable was exclusive.
+
+        :param: state The cp2130.state.ChipState to restore.
+        :param: current The device's current state, if known, e.g., from an
+                        earlier snapshot(), to avoid reading it.
+        :return: The number of registers written.
+
+        """
+        return state.apply(self.chip, current)
+
     def reset(self):
         """Resets the device.  After approximately one millisecond, the device
         will reset and reenumerate on the USB bus.
 
         """
         self.chip.reset_device()
+
+    def reset_and_wait(self, timeout=5.0, state=None):
+        """Resets the device and waits for it to re-enumerate.
+
+        The same physical device is matched by its USB port path, or
+        by its serial number if the port path is unknown, and opened
+        as soon as it reappears, rather than after a fixed sleep. This
+        instance is closed and must not be used afterward.
+
+        :param: timeout The maximum time in seconds to wait.
+        :param: state A cp2130.state.ChipState, e.g., from snapshot(), to
+                      restore once the device is back, or None.
+        :return: A new CP2130 instance for the re-enumerated device.
+        :raises: A cp2130.usb.NoDeviceError if the device does not reappear
+                 in time.
+
+        """
+        usb_device = self.usb_device.reenumerate(self.chip.reset_device, timeout)
+        device = CP2130(CP2130Chip(usb_device))
+        if state is not None:
+            device.restore(state)
+        return device
         
     @property
     def lock(self):
@@ -0,0 +1,267 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import time
+
+from cp2130.spi import SPIChannelGPIO
+from cp2130.transaction import Transaction
+
+class USBOverhead(object):
+
+    def __init__(self, control=0.001, bulk=0.001, per_byte=1.0e-6):
+        """The host and bus costs of talking to a CP2130, in seconds.
+
+        The defaults are typical of a full-speed device on an idle
+        bus. Use calibrate() to measure them for a particular host.
+
+        :param: control The time of one control transfer, e.g., a
+                        chip-select or GPIO change.
+        :param: bulk The fixed time of one bulk command, excluding data.
+        :param: per_byte The USB time per data byte, which overlaps with
+                         the SPI clocking through the chip's FIFOs.
+
+        """
+        self.control  = control
+        self.bulk     = bulk
+        self.per_byte = per_byte
+
+    def __repr__(self):
+        return "USBOverhead(%r, %r, %r)"%(self.control, self.bulk, self.per_byte)
+
+    def __str__(self):
+        return """USBOverhead
+  control:  %.1f us
+  bulk:     %.1f us
+  per_byte: %.3f us"""%(self.control * 1e6, self.bulk * 1e6, self.per_byte * 1e6)
+
+class Prediction(object):
+
+    def __init__(self, duration, nbytes, bulk_commands, control_transfers):
+        """The predicted cost of an SPI operation.
+
+        """
+        self.duration          = duration
+        self.bytes             = nbytes
+        self.bulk_commands     = bulk_commands
+        self.control_transfers = control_transfers
+
+    def __repr__(self):
+        return "Prediction(%r, %r)"%(self.duration, self.bytes)
+
+    def __str__(self):
+        return """Prediction
+  duration:          %.3f ms
+  bytes:             %d
+  bulk_commands:     %d
+  control_transfers: %d
+  throughput:        %.1f kB/s"""%(self.duration * 1000.0, self.bytes, self.bulk_commands,
+                                   self.control_transfers, self.throughput / 1000.0)
+
+    @property
+    def throughput(self):
+        return self.bytes / self.duration if self.duration else 0.0
+
+class CostModel(object):
+
+    def __init__(self, clock_frequency, inter_byte_delay=0, pre_deassert_delay=0,
+                 post_assert_delay=0, cs_toggle=False, manual_cs=False, overhead=None):
+        """Predicts the duration of SPI transfers on one channel from its
+        timing settings and the USB overheads.
+
+        A bulk command takes the bulk overhead plus the longer of its
+        USB and SPI data times, as the two overlap. The SPI time is
+        eight clock periods per byte, plus the inter-byte delay
+        between bytes (and one more clock period if the chip-select
+        toggles there), plus the post-assert and pre-deassert delays
+        around each native chip-select assertion. Each chip-select
+        change made by the host costs a control transfer.
+
+        The delays are in microseconds and are zero if disabled, as
+        reported by the SPIChannel properties.
+
+        :param: clock_frequency The SPI clock frequency in Hz.
+        :param: inter_byte_delay The delay between bytes.
+        :param: pre_deassert_delay The delay before the chip-select is
+                                   deasserted.
+        :param: post_assert_delay The delay after the chip-select is
+                                  asserted.
+        :param: cs_toggle True if the chip-select toggles between bytes.
+        :param: manual_cs True if the channel drives its chip-select as a
+                          GPIO, which the chip's delays do not apply to.
+        :param: overhead The USBOverhead, or None for the defaults.
+
+        """
+        self.clock_frequency    = clock_frequency
+        self.inter_byte_delay   = inter_byte_delay
+        self.pre_deassert_delay = pre_deassert_delay
+        self.post_assert_delay  = post_assert_delay
+        self.cs_toggle          = cs_toggle
+        self.manual_cs          = manual_cs
+        self.overhead           = overhead or USBOverhead()
+
+    def __repr__(self):
+        return "CostModel(%r)"%(self.clock_frequency)
+
+    @classmethod
+    def from_channel(cls, channel, overhead=None):
+        """Builds the model from a channel's current settings, reading its
+        SPI word and delay registers once each.
+
+        """
+        word  = channel.chip.get_spi_word(channel.cs_num)
+        delay = channel.chip.get_spi_delay(channel.cs_num)
+        return cls(word.clock_frequency,
+                   delay.inter_byte_delay_10us * 10 if delay.inter_byte else 0,
+                   delay.pre_deassert_delay_10us * 10 if delay.pre_deassert else 0,
+                   delay.post_assert_delay_10us * 10 if delay.post_assert else 0,
+                   delay.cs_toggle,
+                   isinstance(channel, SPIChannelGPIO),
+                   overhead)
+
+    def spi_time(self, nbytes):
+        """The time to clock the given number of bytes within one bulk
+        command.
+
+        """
+        if not nbytes:
+            return 0.0
+        period = 1.0 / self.clock_frequency
+        gaps   = nbytes - 1
+        t = nbytes * 8 * period + gaps * self.inter_byte_delay * 1e-6
+        if self.cs_toggle and self.inter_byte_delay:
+            t += gaps * period
+        if not self.manual_cs:
+            t += (self.post_assert_delay + self.pre_deassert_delay) * 1e-6
+        return t
+
+    def bulk_time(self, nbytes):
+        """The time of one bulk command transferring the given number of bytes.
+
+        """
+        return self.overhead.bulk + max(nbytes * self.overhead.per_byte, self.spi_time(nbytes))
+
+    def predict(self, operation):
+        """Predicts the cost of an operation as performed by SPIChannel.
+
+        :param: operation A cp2130.transaction.Transaction, or a number of
+                          bytes for a single read, write or write_read.
+        :return: A Prediction.
+
+        """
+        if isinstance(operation, Transaction):
+            segments = operation.compile()
+        else:
+            segments = Transaction().write(b'\x00' * operation).compile()
+
+        # Asserting and releasing the chip-select.
+        control  = 2
+        duration = 0.0
+        nbytes   = 0
+        bulk     = 0
+        for segment in segments:
+            if segment.data:
+                bulk     += 1
+                nbytes   += len(segment.data)
+                duration += self.bulk_time(len(segment.data))
+            duration += segment.delay
+            if segment.toggle:
+                control += 2
+        duration += control * self.overhead.control
+        return Prediction(duration, nbytes, bulk, control)
+
+    def timeout(self, operation, factor=2.0, minimum=0.1):
+        """A timeout for an operation, as a multiple of its predicted duration.
+
+        :param: operation As for predict().
+        :param: factor The multiple of the prediction allowed.
+        :param: minimum The shortest timeout in seconds returned, to absorb
+                        scheduling jitter on the host.
+
+        """
+        return max(minimum, factor * self.predict(operation).duration)
+
+    def max_bytes(self, duration):
+        """The largest single transfer predicted to complete within a
+        duration, e.g., to size chunks for a latency budget.
+
+        """
+        fixed = 2 * self.overhead.control + self.bulk_time(0)
+        if duration <= fixed:
+            return 0
+        (lo, hi) = (0, 1)
+        while self.predict(hi).duration <= duration:
+            (lo, hi) = (hi, hi * 2)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.predict(mid).duration <= duration:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+def _fit(points):
+    # Least-squares line through (x, y) points.
+    n  = float(len(points))
+    sx = sum(x for (x, _) in points)
+    sy = sum(y for (_, y) in points)
+    sxx = sum(x * x for (x, _) in points)
+    sxy = sum(x * y for (x, y) in points)
+    slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    return ((sy - slope * sx) / n, slope)
+
+def calibrate(channel, sizes=(64, 1024, 4096, 16384, 65536), repeat=5):
+    """Measures the USB overheads of a device.
+
+    The control transfer time is the median time to read a
+    register. The bulk overheads are fitted to the median times of
+    reads of several sizes, at the fastest clock so the USB time
+    dominates. The clock frequency is restored afterwards.
+
+    The reads are clocked to the channel's slave with its
+    chip-select asserted. Use a channel whose slave ignores reads, or
+    an unconnected chip-select.
+
+    :param: channel The cp2130.spi.SPIChannel to measure on.
+    :param: sizes The read sizes in bytes. At least two are needed.
+    :param: repeat The measurements per size.
+    :return: A USBOverhead.
+
+    """
+    def median(f):
+        samples = []
+        for _ in range(repeat):
+            start = time.time()
+            f()
+            samples.append(time.time() - start)
+        return sorted(samples)[len(samples) // 2]
+
+    chip    = channel.chip
+    control = median(lambda: chip.get_spi_word(channel.cs_num))
+
+    original = channel.clock_frequency
+    try:
+        channel.clock_frequency = 12000000
+        model  = CostModel.from_channel(channel, USBOverhead(control, 0.0, 0.0))
+        points = []
+        for size in sizes:
+            t = median(lambda: channel.read(size))
+            points.append((size, t - 2 * control))
+    finally:
+        channel.clock_frequency = original
+
+    (bulk, per_byte) = _fit(points)
+    per_byte = max(per_byte, 8.0 / model.clock_frequency)
+    return USBOverhead(control, max(bulk, 0.0), per_byte)
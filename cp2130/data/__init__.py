@@ -34,3 +34,12 @@ class Version(object):
 
     def __str__(self):
         return "%d.%d"%(self.major, self.minor)
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and (self.major, self.minor) == (other.major, other.minor)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.major, self.minor))
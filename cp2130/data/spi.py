@@ -14,7 +14,6 @@
 
 from __future__ import absolute_import
 
-from bidict import bidict
 from enum import Enum
 
 class ClockPhase(Enum):
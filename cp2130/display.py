@@ -0,0 +1,422 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cp2130.chip import registers
+from cp2130.data import ChipSelectControl, LogicLevel
+from cp2130.spi import SPIChannelGPIO
+
+class PixelFormat(object):
+
+    def __init__(self, name, bytes_per_pixel):
+        """A pixel encoding accepted by a display controller.
+
+        Colors are given as (r, g, b) tuples of 8-bit values. Images
+        are given as arrays of shape (height, width, 3) of 8-bit RGB
+        values and are converted with vectorized NumPy operations, or
+        pixel by pixel without NumPy.
+
+        """
+        self.name            = name
+        self.bytes_per_pixel = bytes_per_pixel
+
+    def __repr__(self):
+        return "PixelFormat(%r)"%(self.name)
+
+    def encode_color(self, color):
+        """Encodes one (r, g, b) color.
+
+        """
+        (r, g, b) = color
+        if self is RGB565:
+            return struct.pack('>H', ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3))
+        if self is RGB666:
+            return struct.pack('BBB', r & 0xFC, g & 0xFC, b & 0xFC)
+        return struct.pack('BBB', r, g, b)
+
+    def encode(self, image):
+        """Encodes an image of shape (height, width, 3).
+
+        :return: The encoded pixels as bytes, row-major.
+
+        """
+        if numpy is None:
+            return b''.join(self.encode_color(pixel) for row in image for pixel in row)
+
+        rgb = numpy.asarray(image, dtype=numpy.uint8)
+        if self is RGB565:
+            r = rgb[..., 0].astype(numpy.uint16)
+            g = rgb[..., 1].astype(numpy.uint16)
+            b = rgb[..., 2].astype(numpy.uint16)
+            pixels = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+            return pixels.astype('>u2').tobytes()
+        if self is RGB666:
+            return (rgb & 0xFC).tobytes()
+        return numpy.ascontiguousarray(rgb).tobytes()
+
+RGB565 = PixelFormat('RGB565', 2)
+RGB666 = PixelFormat('RGB666', 3)
+RGB888 = PixelFormat('RGB888', 3)
+
+class Rect(object):
+
+    __slots__ = ('x', 'y', 'width', 'height')
+
+    def __init__(self, x, y, width, height):
+        """A rectangle of pixels.
+
+        """
+        self.x      = x
+        self.y      = y
+        self.width  = width
+        self.height = height
+
+    def __repr__(self):
+        return "Rect(%d, %d, %d, %d)"%(self.x, self.y, self.width, self.height)
+
+    def __eq__(self, other):
+        return isinstance(other, Rect) and \
+            (self.x, self.y, self.width, self.height) == (other.x, other.y, other.width, other.height)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def area(self):
+        return self.width * self.height
+
+    def union(self, other):
+        x0 = min(self.x, other.x)
+        y0 = min(self.y, other.y)
+        x1 = max(self.x + self.width, other.x + other.width)
+        y1 = max(self.y + self.height, other.y + other.height)
+        return Rect(x0, y0, x1 - x0, y1 - y0)
+
+class Framebuffer(object):
+
+    def __init__(self, width, height, format=RGB565, max_dirty_rects=32):
+        """An in-memory image in a display's native pixel format that
+        records the rectangles changed since the last flush.
+
+        The pixels are held in a bytearray, also available as a NumPy
+        array of shape (height, width, bytes_per_pixel) if NumPy is
+        installed. Drawing methods mark what they change; code that
+        writes to the buffer directly must call mark_dirty().
+
+        A changed rectangle is folded into any recorded one it touches,
+        overlaps or contains, when their union is no larger than the
+        two apart. If more than max_dirty_rects remain, they are
+        replaced by their bounding box, so per-pixel drawing keeps the
+        list short.
+
+        :param: width The width in pixels.
+        :param: height The height in pixels.
+        :param: format The PixelFormat of the display.
+        :param: max_dirty_rects The most changed rectangles recorded.
+
+        """
+        self.width  = width
+        self.height = height
+        self.format = format
+        self.max_dirty_rects = max_dirty_rects
+        self.stride = width * format.bytes_per_pixel
+        self.buffer = bytearray(self.stride * height)
+        self.dirty  = [Rect(0, 0, width, height)]
+
+    def __repr__(self):
+        return "Framebuffer(%d, %d, %r)"%(self.width, self.height, self.format)
+
+    @property
+    def array(self):
+        """A writable NumPy view of the pixels.
+
+        """
+        if numpy is None:
+            raise NotImplementedError("Framebuffer.array requires NumPy")
+        return numpy.frombuffer(self.buffer, dtype=numpy.uint8).reshape(
+            self.height, self.width, self.format.bytes_per_pixel)
+
+    def _clip(self, x, y, width, height):
+        x0 = max(0, x)
+        y0 = max(0, y)
+        x1 = min(self.width, x + width)
+        y1 = min(self.height, y + height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return Rect(x0, y0, x1 - x0, y1 - y0)
+
+    def mark_dirty(self, x=0, y=0, width=None, height=None):
+        """Marks a rectangle, by default the whole frame, as changed.
+
+        """
+        width  = self.width  if width  is None else width
+        height = self.height if height is None else height
+        rect = self._clip(x, y, width, height)
+        if rect is not None:
+            self._add_dirty(rect)
+
+    def _add_dirty(self, rect):
+        dirty = self.dirty
+        i = 0
+        while i < len(dirty):
+            union = dirty[i].union(rect)
+            if union.area <= dirty[i].area + rect.area:
+                # The merged rectangle may now fold into an earlier one.
+                del dirty[i]
+                rect = union
+                i = 0
+            else:
+                i += 1
+        dirty.append(rect)
+        if len(dirty) > self.max_dirty_rects:
+            bounds = dirty[0]
+            for other in dirty[1:]:
+                bounds = bounds.union(other)
+            self.dirty = [bounds]
+
+    def fill(self, color):
+        """Fills the whole frame with one (r, g, b) color.
+
+        """
+        self.fill_rect(0, 0, self.width, self.height, color)
+
+    def fill_rect(self, x, y, width, height, color):
+        """Fills a rectangle with one (r, g, b) color.
+
+        """
+        rect = self._clip(x, y, width, height)
+        if rect is None:
+            return
+        row = self.format.encode_color(color) * rect.width
+        bpp = self.format.bytes_per_pixel
+        for line in range(rect.y, rect.y + rect.height):
+            start = line * self.stride + rect.x * bpp
+            self.buffer[start:start + len(row)] = row
+        self._add_dirty(rect)
+
+    def set_pixel(self, x, y, color):
+        """Sets one pixel to an (r, g, b) color.
+
+        """
+        self.fill_rect(x, y, 1, 1, color)
+
+    def blit(self, x, y, image):
+        """Copies an RGB image of shape (height, width, 3) into the frame,
+        converting it to the display's pixel format.
+
+        """
+        height = len(image)
+        width  = len(image[0]) if height else 0
+        self.blit_raw(x, y, width, height, self.format.encode(image))
+
+    def blit_raw(self, x, y, width, height, data):
+        """Copies pixels already in the display's pixel format into the frame.
+        The image must lie within the frame.
+
+        """
+        bpp = self.format.bytes_per_pixel
+        if x < 0 or y < 0 or x + width > self.width or y + height > self.height:
+            raise ValueError("Image exceeds the frame")
+        if len(data) != width * height * bpp:
+            raise ValueError("Expected %d bytes of pixel data"%(width * height * bpp))
+        data = memoryview(data)
+        row = width * bpp
+        for line in range(height):
+            start = (y + line) * self.stride + x * bpp
+            self.buffer[start:start + row] = data[line * row:(line + 1) * row]
+        if width and height:
+            self._add_dirty(Rect(x, y, width, height))
+
+    def region(self, rect):
+        """Returns the pixels of a rectangle as bytes, row-major.
+
+        """
+        bpp = self.format.bytes_per_pixel
+        if rect.x == 0 and rect.width == self.width:
+            start = rect.y * self.stride
+            return bytes(self.buffer[start:start + rect.height * self.stride])
+        if numpy is not None:
+            return self.array[rect.y:rect.y + rect.height, rect.x:rect.x + rect.width].tobytes()
+        row = rect.width * bpp
+        return b''.join(bytes(self.buffer[start:start + row]) for start in
+                        range(rect.y * self.stride + rect.x * bpp, (rect.y + rect.height) * self.stride, self.stride))
+
+    def take_dirty(self, overhead=0):
+        """Returns the changed rectangles merged to minimize the cost of
+        sending them, and clears them.
+
+        Two rectangles are merged if the pixels added by their union
+        cost less than sending the second rectangle separately.
+
+        :param: overhead The fixed cost of sending a rectangle, in pixels.
+
+        """
+        rects = list(self.dirty)
+        self.dirty = []
+        merged = True
+        while merged and len(rects) > 1:
+            merged = False
+            i = 0
+            while i < len(rects):
+                j = i + 1
+                while j < len(rects):
+                    union = rects[i].union(rects[j])
+                    if union.area <= rects[i].area + rects[j].area + overhead:
+                        rects[i] = union
+                        del rects[j]
+                        merged = True
+                    else:
+                        j += 1
+                i += 1
+        return rects
+
+class Display(object):
+
+    CASET = 0x2A
+    RASET = 0x2B
+    RAMWR = 0x2C
+
+    def __init__(self, channel, dc, width, height, format=RGB565,
+                 x_offset=0, y_offset=0, rect_overhead=None):
+        """A SPI display controller using MIPI DCS window addressing, e.g., an
+        ST7735, ST7789 or ILI9341, with a Framebuffer.
+
+        flush() sends only the changed rectangles of the framebuffer,
+        each as a column address set, row address set and memory
+        write, all in one transaction on the chip. Nearby rectangles
+        are merged when sending the pixels between them costs less
+        than the commands of another rectangle.
+
+        The data/command line is a GPIO driven low for command bytes
+        and high for parameters and pixels. If the channel uses a GPIO
+        chip-select, it is held asserted for the whole flush and set
+        together with the data/command line in one masked write.
+
+        The controller must already be initialized, e.g., with
+        command() calls for its power-up sequence.
+
+        :param: channel The cp2130.spi.SPIChannel of the display.
+        :param: dc The cp2130.gpio.GPIO driving the data/command line.
+        :param: width The width in pixels.
+        :param: height The height in pixels.
+        :param: format The PixelFormat the controller is configured for.
+        :param: x_offset The column of the first visible pixel in the
+                         controller's memory.
+        :param: y_offset The row of the first visible pixel.
+        :param: rect_overhead The cost of an extra rectangle in pixels, or
+                              None to estimate it from the command
+                              overhead.
+
+        """
+        self.channel  = channel
+        self.chip     = channel.chip
+        self.dc       = dc
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+        self.framebuffer = Framebuffer(width, height, format)
+
+        if rect_overhead is None:
+            # Six control and six bulk transfers, each worth roughly a
+            # few hundred bytes of bulk data.
+            rect_overhead = 12 * 256 // format.bytes_per_pixel
+        self.rect_overhead = rect_overhead
+
+        self._assert_cs   = False
+
+        self.flushes      = 0
+        self.rects_sent   = 0
+        self.pixels_sent  = 0
+
+    def __repr__(self):
+        return "Display(%r, %r)"%(self.channel, self.dc)
+
+    def _lines(self, dc_level):
+        # The first write of a session also asserts a GPIO chip-select.
+        reg = registers.gpio_values_setter.default()
+        reg.set_level(self.dc.num, dc_level)
+        if self._assert_cs:
+            reg.set_level(self.channel.cs_num, LogicLevel.LOW)
+            self._assert_cs = False
+        self.chip.set_gpio_values(reg)
+
+    def _send(self, cmd, data):
+        self._lines(LogicLevel.LOW)
+        self.chip.write(struct.pack('B', cmd))
+        if len(data):
+            self._lines(LogicLevel.HIGH)
+            self.chip.write(data)
+
+    def _session(self, body):
+        manual_cs = isinstance(self.channel, SPIChannelGPIO)
+        with self.chip.transaction():
+            try:
+                if manual_cs:
+                    self._assert_cs = True
+                else:
+                    self.channel.gpio.cs_enable = ChipSelectControl.ENABLED_EXCLUSIVE
+                body()
+            finally:
+                self._assert_cs = False
+                if manual_cs:
+                    self.channel.gpio.value = LogicLevel.HIGH
+                else:
+                    self.channel.gpio.cs_enable = ChipSelectControl.DISABLED
+
+    def command(self, cmd, params=b''):
+        """Sends one command with its parameters.
+
+        """
+        self._session(lambda: self._send(cmd, params))
+
+    def _window(self, rect):
+        x0 = rect.x + self.x_offset
+        y0 = rect.y + self.y_offset
+        self._send(self.CASET, struct.pack('>HH', x0, x0 + rect.width - 1))
+        self._send(self.RASET, struct.pack('>HH', y0, y0 + rect.height - 1))
+
+    def flush(self):
+        """Sends the changed parts of the framebuffer to the display.
+
+        :return: The list of rectangles sent.
+
+        """
+        fb = self.framebuffer
+        rects = fb.take_dirty(self.rect_overhead)
+        if not rects:
+            return rects
+
+        def body():
+            for rect in rects:
+                self._window(rect)
+                self._send(self.RAMWR, fb.region(rect))
+
+        try:
+            self._session(body)
+        except:
+            for rect in rects:
+                fb._add_dirty(rect)
+            raise
+
+        self.flushes     += 1
+        self.rects_sent  += len(rects)
+        self.pixels_sent += sum(rect.area for rect in rects)
+        return rects
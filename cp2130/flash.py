@@ -0,0 +1,475 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import struct
+import time
+import zlib
+
+import six
+
+class FlashError(EnvironmentError):
+    """Raised if a flash operation fails or times out.
+
+    """
+    pass
+
+class VerifyError(FlashError):
+    """Raised if the flash contents do not match the expected data.
+
+    """
+    pass
+
+class JedecID(object):
+
+    def __init__(self, manufacturer, memory_type, capacity):
+        """The JEDEC identification of a flash device.
+
+        """
+        self.manufacturer = manufacturer
+        self.memory_type  = memory_type
+        self.capacity     = capacity
+
+    def __repr__(self):
+        return "JedecID(0x%02x, 0x%02x, 0x%02x)"%(self.manufacturer, self.memory_type, self.capacity)
+
+    def __str__(self):
+        return "%02x %02x %02x"%(self.manufacturer, self.memory_type, self.capacity)
+
+    @property
+    def size(self):
+        """The size of the device in bytes as encoded by the capacity byte,
+        or None if the encoding is not recognized.
+
+        """
+        if 0x10 <= self.capacity <= 0x1F:
+            return 1 << self.capacity
+        if 0x20 <= self.capacity <= 0x22:
+            # Some vendors continue the sequence from 0x20 = 2**26.
+            return 1 << (self.capacity - 6)
+        return None
+
+class ProgramReport(object):
+
+    def __init__(self):
+        """A summary of the work done by SPIFlash.program().
+
+        """
+        self.sectors_skipped   = 0
+        self.sectors_erased    = 0
+        self.pages_programmed  = 0
+        self.bytes_programmed  = 0
+        self.elapsed           = 0.0
+
+    def __repr__(self):
+        return "ProgramReport()"
+
+    def __str__(self):
+        return """ProgramReport
+  sectors_skipped:  %d
+  sectors_erased:   %d
+  pages_programmed: %d
+  bytes_programmed: %d
+  elapsed:          %.3f s"""%(self.sectors_skipped, self.sectors_erased,
+                              self.pages_programmed, self.bytes_programmed,
+                              self.elapsed)
+
+class SPIFlash(object):
+
+    WRITE_ENABLE   = 0x06
+    READ_STATUS    = 0x05
+    READ_ID        = 0x9F
+    CHIP_ERASE     = 0xC7
+
+    FAST_READ      = 0x0B
+    PAGE_PROGRAM   = 0x02
+    SECTOR_ERASE   = 0x20
+
+    FAST_READ_4B    = 0x0C
+    PAGE_PROGRAM_4B = 0x12
+    SECTOR_ERASE_4B = 0x21
+
+    STATUS_BUSY    = 0x01
+
+    def __init__(self, channel, size=None, page_size=256, sector_size=4096,
+                 chunk_size=65536, poll_bytes=256, page_program_time=0.0015):
+        """A driver for a SPI NOR flash device.
+
+        Reads use the FAST_READ command in large chunks, each a single
+        full-duplex bulk command. Page programs issue the write
+        enable, the program command and a burst of status reads in
+        one transaction, so a page usually completes without extra
+        polling round trips.
+
+        :param: channel The cp2130.spi.SPIChannel of the flash device.
+        :param: size The size of the device in bytes, or None to probe it
+                     from the JEDEC id.
+        :param: page_size The program page size in bytes.
+        :param: sector_size The erase sector size in bytes.
+        :param: chunk_size The number of bytes per read transaction.
+        :param: poll_bytes The number of status samples read after each
+                           page program.
+        :param: page_program_time The typical page program time (tPP) in
+                                  seconds, used to size the status poll
+                                  that program_pages() overlaps with the
+                                  next page.
+
+        """
+        self.channel     = channel
+        self.page_size   = page_size
+        self.sector_size = sector_size
+        self.chunk_size  = chunk_size
+        self.poll_bytes  = poll_bytes
+        self.page_program_time = page_program_time
+
+        self._write_listeners = []
+
+        if size is None:
+            size = self.jedec_id().size
+            if size is None:
+                raise FlashError("Unable to determine the flash size from JEDEC id %s"%self.jedec_id())
+        self.size = size
+
+        if size > (1 << 24):
+            (self._read_op, self._program_op, self._erase_op) = \
+                (self.FAST_READ_4B, self.PAGE_PROGRAM_4B, self.SECTOR_ERASE_4B)
+            self._addr_format = '>BI'
+        else:
+            (self._read_op, self._program_op, self._erase_op) = \
+                (self.FAST_READ, self.PAGE_PROGRAM, self.SECTOR_ERASE)
+            self._addr_format = '>I'
+
+    def __repr__(self):
+        return "SPIFlash(%r, %r)"%(self.channel, self.size)
+
+    def __len__(self):
+        return self.size
+
+    def _command(self, op, address):
+        if self._addr_format == '>I':
+            return struct.pack('>I', (op << 24) | address)
+        return struct.pack(self._addr_format, op, address)
+
+    def add_write_listener(self, callback):
+        """Registers a function to call with (address, length) whenever a
+        range of the flash is erased or programmed through this driver.
+
+        """
+        self._write_listeners.append(callback)
+
+    def remove_write_listener(self, callback):
+        """Unregisters a function registered with add_write_listener().
+
+        """
+        self._write_listeners.remove(callback)
+
+    def _notify_write(self, address, length):
+        for callback in list(self._write_listeners):
+            callback(address, length)
+
+    def view(self, **kwargs):
+        """Returns a cp2130.flash_view.FlashView of this flash. Keyword
+        arguments are passed to the FlashView constructor.
+
+        """
+        from cp2130.flash_view import FlashView
+        return FlashView(self, **kwargs)
+
+    def _check(self, address, length):
+        if address < 0 or address + length > self.size:
+            raise ValueError("Range 0x%x-0x%x exceeds the flash size 0x%x"%(address, address + length, self.size))
+
+    # ------------------------------ Identity -------------------------------
+    def jedec_id(self):
+        """Reads the JEDEC manufacturer and device id.
+
+        """
+        data = bytearray(self.channel.write_read(b'\x9f\x00\x00\x00'))
+        return JedecID(data[1], data[2], data[3])
+
+    def status(self):
+        """Reads status register 1.
+
+        """
+        return bytearray(self.channel.write_read(b'\x05\x00'))[1]
+
+    @property
+    def busy(self):
+        """True if a program or erase operation is in progress.
+
+        """
+        return bool(self.status() & self.STATUS_BUSY)
+
+    def wait_ready(self, timeout=10.0):
+        """Waits for the current program or erase operation to complete.
+
+        :raises: A FlashError if the timeout expires.
+
+        """
+        deadline = time.time() + timeout
+        while True:
+            transaction = self.channel.transaction()
+            transaction.write(six.int2byte(self.READ_STATUS)).read(self.poll_bytes)
+            samples = bytearray(transaction.execute()[0])
+            if not (samples[-1] & self.STATUS_BUSY):
+                return
+            if time.time() > deadline:
+                raise FlashError("Flash still busy after %s seconds"%timeout)
+
+    # -------------------------------- Read ---------------------------------
+    def iter_chunks(self, address=0, length=None, chunk_size=None):
+        """Streams a range of the flash.
+
+        :return: An iterator of (address, data) tuples, each covering at
+                 most chunk_size bytes.
+
+        """
+        if length is None:
+            length = self.size - address
+        chunk_size = chunk_size or self.chunk_size
+        self._check(address, length)
+
+        end = address + length
+        while address < end:
+            n = min(chunk_size, end - address)
+            transaction = self.channel.transaction()
+            transaction.write(self._command(self._read_op, address) + b'\x00')
+            transaction.read(n)
+            yield (address, transaction.execute()[0])
+            address += n
+
+    def read(self, address, length):
+        """Reads a range of the flash.
+
+        :return: The data as a bytearray.
+
+        """
+        data = bytearray(length)
+        view = memoryview(data)
+        for (a, chunk) in self.iter_chunks(address, length):
+            view[a - address:a - address + len(chunk)] = bytearray(chunk)
+        return data
+
+    def dump(self, fileobj=None, address=0, length=None, chunk_size=None):
+        """Streams a range of the flash, by default the whole device, to a
+        file or into a buffer.
+
+        :param: fileobj A writable file-like object, or None to return the
+                        data.
+        :return: The data as a bytearray if fileobj is None, otherwise the
+                 number of bytes written.
+
+        """
+        if fileobj is None:
+            if length is None:
+                length = self.size - address
+            return self.read(address, length)
+
+        total = 0
+        for (_, chunk) in self.iter_chunks(address, length, chunk_size):
+            fileobj.write(bytearray(chunk))
+            total += len(chunk)
+        return total
+
+    def crc32(self, address=0, length=None):
+        """Computes the CRC-32 of a range of the flash, streaming it in large
+        chunks.
+
+        """
+        crc = 0
+        for (_, chunk) in self.iter_chunks(address, length):
+            crc = zlib.crc32(bytes(bytearray(chunk)), crc)
+        return crc & 0xFFFFFFFF
+
+    # ---------------------------- Erase/Program ----------------------------
+    def erase_sector(self, address):
+        """Erases the sector containing the given address.
+
+        """
+        address -= address % self.sector_size
+        transaction = self.channel.transaction()
+        transaction.write(six.int2byte(self.WRITE_ENABLE)).boundary()
+        transaction.write(self._command(self._erase_op, address))
+        try:
+            transaction.execute()
+            self.wait_ready()
+        finally:
+            self._notify_write(address, self.sector_size)
+
+    def erase_chip(self, timeout=300.0):
+        """Erases the entire device.
+
+        """
+        transaction = self.channel.transaction()
+        transaction.write(six.int2byte(self.WRITE_ENABLE)).boundary()
+        transaction.write(six.int2byte(self.CHIP_ERASE))
+        try:
+            transaction.execute()
+            self.wait_ready(timeout)
+        finally:
+            self._notify_write(0, self.size)
+
+    def program_page(self, address, data):
+        """Programs data within one page. The page must already be erased.
+
+        The write enable, page program and a burst of status reads are
+        issued in a single transaction. Additional polling is only
+        needed if the program is still in progress at the end of the
+        burst.
+
+        """
+        if (address % self.page_size) + len(data) > self.page_size:
+            raise ValueError("Data crosses a page boundary")
+        transaction = self.channel.transaction()
+        transaction.write(six.int2byte(self.WRITE_ENABLE)).boundary()
+        transaction.write(self._command(self._program_op, address) + bytes(bytearray(data))).boundary()
+        transaction.write(six.int2byte(self.READ_STATUS)).read(self.poll_bytes)
+        try:
+            samples = bytearray(transaction.execute()[0])
+            if samples[-1] & self.STATUS_BUSY:
+                self.wait_ready()
+        finally:
+            self._notify_write(address, len(data))
+
+    def program_pages(self, pages):
+        """Programs a sequence of erased pages, one transaction per page.
+
+        The status poll confirming that each page has finished is
+        issued in the same transaction as the write enable and program
+        of the next page, so consecutive pages are pipelined without
+        extra round trips. The poll lasts at least the page program
+        time at the channel's clock frequency. If it shows the flash
+        still busy, the next page is reissued after waiting, and the
+        poll is doubled for the remaining pages.
+
+        :param: pages An iterable of (address, data) tuples, each within
+                      one page.
+        :return: The number of pages programmed.
+
+        """
+        count = 0
+        previous = None
+        poll = max(self.poll_bytes, int(self.page_program_time * self.channel.clock_frequency / 8))
+        for (address, data) in pages:
+            if (address % self.page_size) + len(data) > self.page_size:
+                raise ValueError("Data crosses a page boundary")
+            transaction = self.channel.transaction()
+            if previous is not None:
+                transaction.write(six.int2byte(self.READ_STATUS)).read(poll).boundary()
+            transaction.write(six.int2byte(self.WRITE_ENABLE)).boundary()
+            transaction.write(self._command(self._program_op, address) + bytes(bytearray(data)))
+            try:
+                results = transaction.execute()
+                if previous is not None and bytearray(results[0])[-1] & self.STATUS_BUSY:
+                    # The write enable and program were ignored.
+                    self.wait_ready()
+                    self.program_page(address, data)
+                    poll = min(poll * 2, self.chunk_size)
+            finally:
+                if previous is not None:
+                    self._notify_write(*previous)
+            previous = (address, len(data))
+            count += 1
+
+        if previous is not None:
+            try:
+                self.wait_ready()
+            finally:
+                self._notify_write(*previous)
+        return count
+
+    def program(self, address, data, incremental=True, verify=True):
+        """Writes data to the flash, erasing sectors as needed. Data in
+        partially covered sectors outside the range is preserved.
+
+        :param: incremental True to read back each sector first and skip
+                            sectors whose content already matches. A
+                            sector that only needs bits cleared is
+                            programmed without erasing it.
+        :param: verify True to verify the range by CRC afterwards.
+        :return: A ProgramReport.
+        :raises: A VerifyError if verification fails.
+
+        """
+        data = bytearray(data)
+        self._check(address, len(data))
+        report = ProgramReport()
+        start = time.time()
+
+        end = address + len(data)
+        sector = address - (address % self.sector_size)
+        while sector < end:
+            lo = max(address, sector)
+            hi = min(end, sector + self.sector_size)
+            image = data[lo - address:hi - address]
+            partial = (lo != sector or hi != sector + self.sector_size)
+
+            if incremental or partial:
+                current = self.read(sector, self.sector_size)
+                target = bytearray(current)
+                target[lo - sector:hi - sector] = image
+            else:
+                current = None
+                target = image
+
+            if current == target:
+                report.sectors_skipped += 1
+            else:
+                erase = current is None or \
+                        any((c & t) != t for (c, t) in zip(current, target))
+                if erase:
+                    self.erase_sector(sector)
+                    report.sectors_erased += 1
+                    current = None
+                self._program_sector(sector, target, current, report)
+
+            sector += self.sector_size
+
+        if verify:
+            self.verify(address, data)
+        report.elapsed = time.time() - start
+        return report
+
+    def _program_sector(self, sector, target, current, report):
+        pages = []
+        for offset in range(0, self.sector_size, self.page_size):
+            page = target[offset:offset + self.page_size]
+            if current is not None:
+                if current[offset:offset + self.page_size] == page:
+                    continue
+            elif page.count(0xFF) == len(page):
+                continue
+            pages.append((sector + offset, page))
+        report.pages_programmed += self.program_pages(pages)
+        report.bytes_programmed += sum(len(page) for (_, page) in pages)
+
+    def verify(self, address, data):
+        """Verifies a range of the flash against the given data by CRC-32.
+
+        :raises: A VerifyError if the contents differ.
+
+        """
+        expected = zlib.crc32(bytes(bytearray(data))) & 0xFFFFFFFF
+        self.verify_crc(address, len(data), expected)
+
+    def verify_crc(self, address, length, expected):
+        """Verifies a range of the flash against a precomputed CRC-32.
+
+        :raises: A VerifyError if the CRC of the range differs.
+
+        """
+        actual = self.crc32(address, length)
+        if actual != expected:
+            raise VerifyError("CRC mismatch at 0x%x-0x%x: expected 0x%08x, read 0x%08x"%(address, address + length, expected, actual))
@@ -0,0 +1,249 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import collections
+import os
+
+class FlashView(object):
+
+    def __init__(self, flash, page_size=4096, cache_pages=256, read_ahead=4):
+        """A read-only, random-access view of the contents of a SPI flash,
+        with an interface modeled on 'mmap'.
+
+        The view supports len(), indexing and slicing, and the
+        read(), readinto(), seek(), tell() and find() methods of an
+        mmap object. Data is fetched in pages held in an LRU
+        cache. Adjacent missing pages, plus up to read_ahead pages
+        beyond them, are fetched with a single streaming read. Pages
+        are invalidated when the same cp2130.flash.SPIFlash driver
+        erases or programs them.
+
+        :param: flash The cp2130.flash.SPIFlash driver.
+        :param: page_size The cache page size in bytes.
+        :param: cache_pages The maximum number of pages to cache.
+        :param: read_ahead The number of following pages to fetch on a
+                           miss.
+
+        """
+        self.flash       = flash
+        self.page_size   = page_size
+        self.cache_pages = cache_pages
+        self.read_ahead  = read_ahead
+
+        self.hits      = 0
+        self.misses    = 0
+        self.transfers = 0
+
+        self._pages = collections.OrderedDict()
+        self._pos   = 0
+        self._closed = False
+        flash.add_write_listener(self.invalidate)
+
+    def __repr__(self):
+        return "FlashView(%r)"%(self.flash)
+
+    def __str__(self):
+        return """FlashView
+  size:         %d
+  cached pages: %d
+  hits:         %d
+  misses:       %d
+  transfers:    %d"""%(len(self), len(self._pages), self.hits, self.misses, self.transfers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.flash.size
+
+    def __getitem__(self, key):
+        size = len(self)
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(size)
+            if step == 1:
+                return self._fetch(start, max(0, stop - start))
+            if (step > 0 and start >= stop) or (step < 0 and start <= stop):
+                return b''
+            (lo, hi) = (start, stop) if step > 0 else (stop + 1, start + 1)
+            return self._fetch(lo, hi - lo)[start - lo::step]
+        if key < 0:
+            key += size
+        if not (0 <= key < size):
+            raise IndexError("FlashView index out of range")
+        return bytearray(self._fetch(key, 1))[0]
+
+    def close(self):
+        """Discards the cache and stops tracking writes to the flash.
+
+        """
+        if not self._closed:
+            self.flash.remove_write_listener(self.invalidate)
+            self._pages.clear()
+            self._closed = True
+
+    # --------------------------- mmap interface ----------------------------
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += len(self)
+        if not (0 <= pos <= len(self)):
+            raise ValueError("seek out of range")
+        self._pos = pos
+        return pos
+
+    def read(self, n=-1):
+        """Reads up to n bytes from the current position, or to the end if n
+        is negative.
+
+        """
+        remaining = len(self) - self._pos
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        data = self._fetch(self._pos, n)
+        self._pos += n
+        return data
+
+    def readinto(self, buffer):
+        """Reads into a writable buffer from the current position.
+
+        :return: The number of bytes read.
+
+        """
+        view = memoryview(buffer)
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def find(self, sub, start=0, end=None):
+        """Returns the lowest index of sub in the range [start, end), or -1.
+
+        The search proceeds page by page, so only the pages up to the
+        first match are fetched.
+
+        """
+        end = len(self) if end is None else min(end, len(self))
+        sub = bytes(sub)
+        window = max(self.page_size, len(sub))
+        pos = start
+        while pos < end:
+            chunk = self._fetch(pos, min(window + len(sub) - 1, end - pos))
+            index = chunk.find(sub)
+            if index >= 0:
+                return pos + index
+            pos += window
+        return -1
+
+    def memoryview(self, start=0, stop=None):
+        """Returns a read-only memoryview of a range of the flash.
+
+        """
+        if stop is None:
+            stop = len(self)
+        return memoryview(self._fetch(start, stop - start))
+
+    # -------------------------------- Cache --------------------------------
+    def invalidate(self, address=0, length=None):
+        """Drops the cached pages overlapping the given range, by default the
+        whole device.
+
+        """
+        if length is None:
+            self._pages.clear()
+            return
+        first = address // self.page_size
+        last  = (address + length - 1) // self.page_size
+        for index in range(first, last + 1):
+            self._pages.pop(index, None)
+
+    def _fetch(self, address, length):
+        if length <= 0:
+            return b''
+        if address < 0 or address + length > len(self):
+            raise ValueError("Range exceeds the flash size")
+
+        first = address // self.page_size
+        last  = (address + length - 1) // self.page_size
+        pages = [self._lookup(index) for index in range(first, last + 1)]
+
+        missing = [first + i for (i, page) in enumerate(pages) if page is None]
+        if missing:
+            # Built from the data read, not the cache, which may have
+            # evicted pages of a request larger than itself.
+            loaded = self._load(missing, last - first + 1)
+            pages = [loaded[first + i] if page is None else page for (i, page) in enumerate(pages)]
+
+        data = b''.join(pages)
+        offset = address - first * self.page_size
+        return data[offset:offset + length]
+
+    def _lookup(self, index):
+        page = self._pages.get(index)
+        if page is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Mark as most recently used.
+        del self._pages[index]
+        self._pages[index] = page
+        return page
+
+    def _load(self, missing, requested):
+        """Fetches the missing pages, coalescing runs of adjacent pages into
+        one read each and extending the last run by the read-ahead.
+
+        The read-ahead is limited to the cache space not needed by the
+        requested pages, so it never evicts them.
+
+        :return: A dict of the pages read, by index.
+
+        """
+        npages = (len(self) + self.page_size - 1) // self.page_size
+        runs = []
+        for index in missing:
+            if runs and index == runs[-1][1]:
+                runs[-1][1] += 1
+            else:
+                runs.append([index, index + 1])
+
+        read_ahead = min(self.read_ahead, max(0, self.cache_pages - requested))
+        stop = runs[-1][1]
+        while stop < npages and stop - runs[-1][1] < read_ahead and stop not in self._pages:
+            stop += 1
+        runs[-1][1] = stop
+
+        loaded = {}
+        for (lo, hi) in runs:
+            address = lo * self.page_size
+            length = min(hi * self.page_size, len(self)) - address
+            data = bytes(self.flash.read(address, length))
+            self.transfers += 1
+            for index in range(lo, hi):
+                offset = (index - lo) * self.page_size
+                loaded[index] = data[offset:offset + self.page_size]
+                self._store(index, loaded[index])
+        return loaded
+
+    def _store(self, index, page):
+        self._pages[index] = page
+        while len(self._pages) > self.cache_pages:
+            self._pages.popitem(last=False)
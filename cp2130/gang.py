@@ -0,0 +1,229 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+import zlib
+
+from cp2130.flash import SPIFlash
+
+class GangImage(object):
+
+    def __init__(self, data, address=0, page_size=256, sector_size=4096):
+        """A firmware image split once into page-sized, read-only views that
+        are shared by every target of a GangProgrammer.
+
+        Pages that are entirely 0xFF are dropped, as an erased page
+        already holds them. The CRC-32 used to verify each target is
+        also computed once.
+
+        :param: data The image.
+        :param: address The flash address of the first byte.
+        :param: page_size The program page size in bytes.
+        :param: sector_size The erase sector size in bytes.
+
+        """
+        self.data        = bytes(bytearray(data))
+        self.address     = address
+        self.page_size   = page_size
+        self.sector_size = sector_size
+        self.crc32       = zlib.crc32(self.data) & 0xFFFFFFFF
+
+        view  = memoryview(self.data)
+        end   = address + len(self.data)
+        pages = []
+        page  = address - (address % page_size)
+        while page < end:
+            lo = max(address, page)
+            hi = min(end, page + page_size)
+            chunk = view[lo - address:hi - address]
+            if self.data.count(b'\xff', lo - address, hi - address) != hi - lo:
+                pages.append((lo, chunk))
+            page += page_size
+        self.pages = tuple(pages)
+
+        first = address - (address % sector_size)
+        self.sectors = tuple(range(first, end, sector_size))
+
+    def __repr__(self):
+        return "GangImage(%d bytes at 0x%x)"%(len(self.data), self.address)
+
+    def __len__(self):
+        return len(self.data)
+
+class TargetReport(object):
+
+    def __init__(self, device, channel):
+        """The outcome of programming one target of a GangProgrammer.
+
+        """
+        self.device   = device
+        self.channel  = channel
+        self.ok       = False
+        self.error    = None
+        self.pages    = 0
+        self.bytes    = 0
+        self.erase_time   = 0.0
+        self.program_time = 0.0
+        self.verify_time  = 0.0
+        self.elapsed  = 0.0
+
+    def __repr__(self):
+        return "TargetReport(%r)"%(self.channel)
+
+    def __str__(self):
+        return """TargetReport
+  channel:      %r
+  ok:           %s
+  error:        %s
+  pages:        %d
+  erase_time:   %.3f s
+  program_time: %.3f s
+  verify_time:  %.3f s
+  elapsed:      %.3f s
+  throughput:   %.1f kB/s"""%(self.channel, self.ok, self.error, self.pages,
+                             self.erase_time, self.program_time,
+                             self.verify_time, self.elapsed,
+                             self.throughput / 1000.0)
+
+    @property
+    def throughput(self):
+        """The image bytes written per second, including erase and verify.
+
+        """
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+class GangReport(object):
+
+    def __init__(self, targets, elapsed):
+        """The per-target reports of a GangProgrammer run.
+
+        """
+        self.targets = targets
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return "GangReport(%d targets)"%len(self.targets)
+
+    def __str__(self):
+        slowest = max([t.elapsed for t in self.targets] or [0.0])
+        return """GangReport
+  targets:    %d
+  succeeded:  %d
+  failed:     %d
+  slowest:    %.3f s
+  elapsed:    %.3f s"""%(len(self.targets), len(self.succeeded), len(self.failed),
+                         slowest, self.elapsed)
+
+    @property
+    def succeeded(self):
+        return [target for target in self.targets if target.ok]
+
+    @property
+    def failed(self):
+        return [target for target in self.targets if not target.ok]
+
+class GangProgrammer(object):
+
+    ERASE_SECTORS = 'sectors'
+    ERASE_CHIP    = 'chip'
+    ERASE_NONE    = 'none'
+
+    def __init__(self, image, erase=ERASE_SECTORS, verify=True, size=None,
+                 poll_bytes=256):
+        """Writes the same image to the SPI flash behind many CP2130s at once.
+
+        Every target is driven by its own thread, so the transfers to
+        different bridges overlap and the wall time is that of the
+        slowest target. Each page is programmed with
+        SPIFlash.program_pages(), which folds the status poll of one
+        page into the transaction programming the next.
+
+        :param: image The GangImage, or the image data to write at address 0.
+        :param: erase ERASE_SECTORS to erase the sectors covered by the
+                      image, ERASE_CHIP to erase the whole device, or
+                      ERASE_NONE if the devices are already blank.
+        :param: verify True to verify each target by CRC-32.
+        :param: size The flash size in bytes, or None to probe each target.
+        :param: poll_bytes The number of status samples read per page.
+
+        """
+        if erase not in (self.ERASE_SECTORS, self.ERASE_CHIP, self.ERASE_NONE):
+            raise ValueError("Unknown erase mode %r"%(erase,))
+        if not isinstance(image, GangImage):
+            image = GangImage(image)
+        self.image      = image
+        self.erase      = erase
+        self.verify     = verify
+        self.size       = size
+        self.poll_bytes = poll_bytes
+
+    def __repr__(self):
+        return "GangProgrammer(%r)"%(self.image)
+
+    def run(self, targets):
+        """Programs every target concurrently.
+
+        A failure on one target is recorded in its report and does
+        not stop the others.
+
+        :param: targets An iterable of (cp2130.core.CP2130, SPIChannel)
+                        pairs.
+        :return: A GangReport with one TargetReport per target, in order.
+
+        """
+        reports = [TargetReport(device, channel) for (device, channel) in targets]
+        threads = [threading.Thread(target=self._program, args=(report,)) for report in reports]
+
+        start = time.time()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return GangReport(reports, time.time() - start)
+
+    def _program(self, report):
+        image = self.image
+        start = time.time()
+        try:
+            flash = SPIFlash(report.channel, size=self.size, page_size=image.page_size,
+                             sector_size=image.sector_size, poll_bytes=self.poll_bytes)
+            flash._check(image.address, len(image))
+
+            t = time.time()
+            if self.erase == self.ERASE_CHIP:
+                flash.erase_chip()
+            elif self.erase == self.ERASE_SECTORS:
+                for sector in image.sectors:
+                    flash.erase_sector(sector)
+            report.erase_time = time.time() - t
+
+            t = time.time()
+            report.pages = flash.program_pages(image.pages)
+            report.bytes = len(image)
+            report.program_time = time.time() - t
+
+            if self.verify:
+                t = time.time()
+                flash.verify_crc(image.address, len(image), image.crc32)
+                report.verify_time = time.time() - t
+            report.ok = True
+        except Exception as e:
+            logging.getLogger("cp2130.gang").error("Error programming %r", report.channel, exc_info=True)
+            report.error = e
+        report.elapsed = time.time() - start
@@ -0,0 +1,310 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from six.moves import queue
+
+from cp2130.chip import registers
+from cp2130.data import LockState
+from cp2130.usb_config import LockedFieldError, USBConfig
+
+class ProvisionError(EnvironmentError):
+    """Raised if a device does not read back as provisioned.
+
+    """
+    pass
+
+class Profile(object):
+
+    # The lock register fields.
+    LOCK_FIELDS = ('vid', 'pid', 'max_power', 'power_mode', 'release_version',
+                   'transfer_priority', 'manufacturing_string1',
+                   'manufacturing_string2', 'product_string1',
+                   'product_string2', 'serial_string', 'pin_config')
+
+    def __init__(self, usb=None, pin_config=None, lock=()):
+        """A declarative description of the one-time programmable ROM
+        contents shared by every unit in a production run. The serial
+        string is assigned per unit.
+
+        :param: usb A dict of cp2130.usb_config.USBConfig field values keyed
+                    by property name, e.g., {'vendor_id': 0x1234,
+                    'product_string': 'Widget'}. May not include the
+                    serial_string.
+        :param: pin_config The cp2130.pin_config.PinConfig to program, or
+                           None to leave the pin configuration alone.
+        :param: lock The lock register fields to lock once programmed,
+                     e.g., Profile.LOCK_FIELDS to lock everything.
+
+        """
+        usb = dict(usb or {})
+        if 'serial_string' in usb:
+            raise ValueError("The serial string is assigned per unit")
+        unknown = set(usb) - set(USBConfig._LOCK_FIELDS)
+        if unknown:
+            raise ValueError("Unknown USB config fields: %s"%", ".join(sorted(unknown)))
+        if 'max_power' in usb:
+            # The ROM stores the power in 2 mA units.
+            usb['max_power'] = int(usb['max_power'] / 2) * 2
+
+        unknown = set(lock) - set(self.LOCK_FIELDS)
+        if unknown:
+            raise ValueError("Unknown lock fields: %s"%", ".join(sorted(unknown)))
+
+        self.usb        = usb
+        self.pin_config = pin_config
+        self.lock       = tuple(lock)
+
+    def __repr__(self):
+        return "Profile(%r, %r, %r)"%(self.usb, self.pin_config, self.lock)
+
+class UnitReport(object):
+
+    PROGRAMMED = 'programmed'
+    UNCHANGED  = 'unchanged'
+    FAILED     = 'failed'
+
+    def __init__(self, device, serial):
+        """The outcome of provisioning one unit.
+
+        """
+        self.device   = device
+        self.serial   = serial
+        self.status   = None
+        self.writes   = []
+        self.verified = False
+        self.error    = None
+        self.elapsed  = 0.0
+
+    def __repr__(self):
+        return "UnitReport(%r, %r)"%(self.device, self.serial)
+
+    def __str__(self):
+        return """UnitReport
+  serial:   %s
+  status:   %s
+  writes:   %s
+  verified: %s
+  error:    %s
+  elapsed:  %.3f s"""%(self.serial, self.status, ", ".join(self.writes) or "none",
+                       self.verified, self.error, self.elapsed)
+
+    @property
+    def ok(self):
+        return self.status != UnitReport.FAILED
+
+class ProvisionReport(object):
+
+    def __init__(self, units, elapsed):
+        """The per-unit reports of a production run.
+
+        """
+        self.units   = units
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return "ProvisionReport(%d units)"%len(self.units)
+
+    def __str__(self):
+        return """ProvisionReport
+  units:      %d
+  programmed: %d
+  unchanged:  %d
+  failed:     %d
+  elapsed:    %.3f s
+  throughput: %.2f units/s"""%(len(self.units), len(self.programmed), len(self.unchanged),
+                               len(self.failed), self.elapsed, self.throughput)
+
+    def _with_status(self, status):
+        return [unit for unit in self.units if unit.status == status]
+
+    @property
+    def programmed(self):
+        return self._with_status(UnitReport.PROGRAMMED)
+
+    @property
+    def unchanged(self):
+        return self._with_status(UnitReport.UNCHANGED)
+
+    @property
+    def failed(self):
+        return self._with_status(UnitReport.FAILED)
+
+    @property
+    def throughput(self):
+        """The number of units provisioned per second.
+
+        """
+        return len(self.units) / self.elapsed if self.elapsed else 0.0
+
+class Provisioner(object):
+
+    def __init__(self, profile, verify=True, max_workers=None):
+        """Programs the one-time programmable ROM of many CP2130s in
+        parallel.
+
+        Each unit is read once to find the fields that differ from
+        the profile, and only those are written: the usb_config
+        fields in one masked transfer, strings in as few transfers as
+        fit, and the lock byte only if a requested field is still
+        unlocked. A unit whose ROM already matches is not written at
+        all. Locked fields that differ fail the unit before anything
+        is written to it.
+
+        :param: profile The Profile to program.
+        :param: verify True to read back every programmed field.
+        :param: max_workers The number of units to program at once, or
+                            None for all of them.
+
+        """
+        self.profile     = profile
+        self.verify      = verify
+        self.max_workers = max_workers
+
+    def __repr__(self):
+        return "Provisioner(%r)"%(self.profile)
+
+    def run(self, devices, serials=None):
+        """Provisions a set of units in parallel.
+
+        A failure on one unit is recorded in its report and does not
+        stop the others.
+
+        :param: devices The cp2130.core.CP2130 instances, e.g., from
+                        cp2130.find_all().
+        :param: serials The serial strings to assign, in the same order as
+                        the devices, or None to leave the serials alone.
+        :return: A ProvisionReport with one UnitReport per device, in the
+                 same order as the devices.
+
+        """
+        devices = list(devices)
+        if serials is None:
+            serials = [None] * len(devices)
+        else:
+            serials = list(serials)
+            if len(serials) < len(devices):
+                raise ValueError("%d serials for %d devices"%(len(serials), len(devices)))
+
+        reports = [None] * len(devices)
+        jobs = queue.Queue()
+        for job in enumerate(zip(devices, serials)):
+            jobs.put(job)
+
+        def work():
+            while True:
+                try:
+                    (i, (device, serial)) = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                reports[i] = self.provision(device, serial)
+
+        start = time.time()
+        workers = min(self.max_workers or len(devices), len(devices))
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return ProvisionReport(reports, time.time() - start)
+
+    def provision(self, device, serial=None):
+        """Provisions one unit.
+
+        :param: device The cp2130.core.CP2130 to program.
+        :param: serial The serial string to assign, or None.
+        :return: A UnitReport. Errors are recorded in the report rather
+                 than raised.
+
+        """
+        report = UnitReport(device, serial)
+        start = time.time()
+        try:
+            self._provision(device, serial, report)
+            report.status = UnitReport.PROGRAMMED if report.writes else UnitReport.UNCHANGED
+        except Exception as e:
+            logging.getLogger("cp2130.provision").error("Error provisioning %s", serial, exc_info=True)
+            report.status = UnitReport.FAILED
+            report.error  = e
+        report.elapsed = time.time() - start
+        return report
+
+    def _desired(self, serial):
+        fields = dict(self.profile.usb)
+        if serial is not None:
+            fields['serial_string'] = serial
+        return fields
+
+    def _provision(self, device, serial, report):
+        chip    = device.chip
+        profile = self.profile
+        desired = self._desired(serial)
+
+        lock    = chip.get_lock_byte()
+        current = device.usb.read(*desired) if desired else {}
+        changes = dict((name, value) for (name, value) in desired.items()
+                       if current[name] != value)
+
+        pin_config = None
+        if profile.pin_config is not None:
+            if chip.get_pin_config().raw != profile.pin_config.register.raw:
+                if lock.pin_config == LockState.LOCKED:
+                    raise LockedFieldError("Locked fields: pin_config")
+                pin_config = profile.pin_config.register
+
+        to_lock = [field for field in profile.lock if getattr(lock, field) == LockState.UNLOCKED]
+
+        # Raises before writing anything if a changed field is locked.
+        if changes:
+            device.usb.update(lock=lock, **changes)
+            report.writes.extend(sorted(changes))
+        if pin_config is not None:
+            chip.set_pin_config(pin_config)
+            report.writes.append('pin_config')
+        if to_lock:
+            reg = registers.lock(lock.raw)
+            for field in to_lock:
+                setattr(reg, field, LockState.LOCKED)
+            chip.set_lock_byte(reg)
+            report.writes.append('lock')
+
+        if self.verify:
+            self._verify(device, desired)
+            report.verified = True
+
+    def _verify(self, device, desired):
+        mismatched = []
+
+        if desired:
+            actual = device.usb.read(*desired)
+            mismatched.extend(name for (name, value) in desired.items() if actual[name] != value)
+
+        if self.profile.pin_config is not None:
+            if device.chip.get_pin_config().raw != self.profile.pin_config.register.raw:
+                mismatched.append('pin_config')
+
+        if self.profile.lock:
+            lock = device.chip.get_lock_byte()
+            mismatched.extend("lock.%s"%field for field in self.profile.lock
+                              if getattr(lock, field) != LockState.LOCKED)
+
+        if mismatched:
+            raise ProvisionError("Readback mismatch: %s"%", ".join(sorted(mismatched)))
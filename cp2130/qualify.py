@@ -0,0 +1,199 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import time
+
+from cp2130.chip import registers
+
+# The SPI clock frequencies supported by the chip, in register order.
+FREQUENCIES = [f for f in registers.spi_word._fields if f.name == 'clock_frequency'][0].values
+
+def loopback(length=256):
+    """Returns a verification function for qualify_clock() that exchanges
+    a test pattern with a channel whose MISO is wired to its MOSI.
+
+    The function's nbytes attribute is the length, which qualify_clock()
+    uses to report throughput.
+
+    :param: length The number of bytes exchanged per trial.
+
+    """
+    pattern = bytes(bytearray((i * 0x5B + 0xA5) & 0xFF for i in range(length)))
+    def verify(channel):
+        return bytes(bytearray(channel.write_read(pattern))) == pattern
+    verify.nbytes = length
+    return verify
+
+class ClockStep(object):
+
+    def __init__(self, frequency):
+        """The outcome of the trials at one SPI clock frequency.
+
+        """
+        self.frequency = frequency
+        self.trials    = 0
+        self.errors    = 0
+        self.bytes     = 0
+        self.elapsed   = 0.0
+        self.reliable  = False
+
+    def __repr__(self):
+        return "ClockStep(%r)"%(self.frequency)
+
+    def __str__(self):
+        return "%10.1f kHz  errors %4d/%-4d %6.2f%%  %8.1f kB/s  %s"%(
+            self.frequency / 1000.0, self.errors, self.trials, self.error_rate * 100.0,
+            self.throughput / 1000.0, "ok" if self.reliable else "FAIL")
+
+    @property
+    def error_rate(self):
+        return float(self.errors) / self.trials if self.trials else 0.0
+
+    @property
+    def throughput(self):
+        """The verified bytes transferred per second, including USB overhead.
+
+        """
+        return (self.bytes * (self.trials - self.errors)) / self.elapsed if self.elapsed else 0.0
+
+class ClockQualification(object):
+
+    def __init__(self, channel, steps, frequency):
+        """The per-frequency results of qualify_clock() and the frequency
+        chosen, or None if no frequency was reliable.
+
+        """
+        self.channel   = channel
+        self.steps     = steps
+        self.frequency = frequency
+
+    def __repr__(self):
+        return "ClockQualification(%r, %r)"%(self.channel, self.frequency)
+
+    def __str__(self):
+        lines = ["ClockQualification",
+                 "  channel:   %r"%(self.channel,),
+                 "  frequency: %s"%(self.frequency,)]
+        return "\n".join(lines + ["  " + str(step) for step in self.steps])
+
+def _key(channel):
+    serial = channel.master.usb.read('serial_string')['serial_string']
+    return "%s/%d"%(serial, channel.cs_num)
+
+def qualify_clock(channel, verify, nbytes=None, trials=20, max_error_rate=0.0,
+                  margin=0, frequencies=None, apply=True, persist=None):
+    """Finds the fastest SPI clock frequency at which a slave works reliably.
+
+    The frequencies are tried from the slowest up. At each, the
+    verification function is called the given number of times. The
+    search stops at the first frequency whose error rate exceeds the
+    limit, and the fastest frequency below it is chosen, less the
+    safety margin.
+
+    :param: channel The cp2130.spi.SPIChannel of the slave.
+    :param: verify A function called with the channel that performs a
+                   transfer and returns True if the result is correct,
+                   e.g., a loopback, an ID read or a CRC check. An
+                   exception counts as an error.
+    :param: nbytes The bytes transferred by one verification, to report
+                   throughput, or None for the nbytes attribute of the
+                   verification function, as set by loopback().
+    :param: trials The verifications per frequency.
+    :param: max_error_rate The highest acceptable fraction of failures.
+    :param: margin The number of frequency steps to back off from the
+                   fastest reliable one.
+    :param: frequencies The frequencies to try, or None for all.
+    :param: apply True to set the chosen frequency on the channel, False
+                  to restore the original one.
+    :param: persist A JSON file to record the chosen frequency in, for
+                    load_clock(), or None.
+    :return: A ClockQualification.
+
+    """
+    if nbytes is None:
+        nbytes = getattr(verify, 'nbytes', 0)
+    candidates = sorted(frequencies or FREQUENCIES)
+    original   = channel.clock_frequency
+    steps      = []
+    try:
+        for frequency in candidates:
+            step = ClockStep(frequency)
+            steps.append(step)
+            channel.clock_frequency = frequency
+            start = time.time()
+            for _ in range(trials):
+                step.trials += 1
+                try:
+                    ok = verify(channel)
+                except Exception:
+                    logging.getLogger("cp2130.qualify").debug("Verification raised at %d Hz", frequency, exc_info=True)
+                    ok = False
+                if not ok:
+                    step.errors += 1
+            step.elapsed  = time.time() - start
+            step.bytes    = nbytes
+            step.reliable = step.error_rate <= max_error_rate
+            if not step.reliable:
+                break
+    finally:
+        channel.clock_frequency = original
+
+    reliable  = [step.frequency for step in steps if step.reliable]
+    frequency = None
+    if reliable:
+        frequency = reliable[max(0, len(reliable) - 1 - margin)]
+        if apply:
+            channel.clock_frequency = frequency
+        if persist is not None:
+            save_clock(channel, frequency, persist)
+    return ClockQualification(channel, steps, frequency)
+
+def save_clock(channel, frequency, path):
+    """Records the qualified frequency of a channel, keyed by the device's
+    serial number and the channel number.
+
+    """
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except (IOError, OSError, ValueError):
+        saved = {}
+    saved[_key(channel)] = frequency
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(saved, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+def load_clock(channel, path, apply=True):
+    """Looks up the frequency recorded for a channel by qualify_clock().
+
+    :param: channel The cp2130.spi.SPIChannel.
+    :param: path The JSON file given as persist to qualify_clock().
+    :param: apply True to set the frequency on the channel.
+    :return: The frequency, or None if none was recorded.
+
+    """
+    try:
+        with open(path, 'r') as f:
+            frequency = json.load(f).get(_key(channel))
+    except (IOError, OSError, ValueError):
+        return None
+    if frequency is not None and apply:
+        channel.clock_frequency = frequency
+    return frequency
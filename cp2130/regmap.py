@@ -0,0 +1,315 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+def _to_bytes(value, length, big_endian):
+    data = bytearray(length)
+    for i in range(length):
+        data[i] = (value >> (8 * i)) & 0xFF
+    if big_endian:
+        data.reverse()
+    return bytes(data)
+
+def _from_bytes(data, big_endian):
+    data = bytearray(data)
+    if not big_endian:
+        data.reverse()
+    value = 0
+    for b in data:
+        value = (value << 8) | b
+    return value
+
+class RegisterMap(object):
+
+    def __init__(self, channel, addr_bits=8, val_bits=8, pad_bits=0,
+                 read_flag_mask=0x80, write_flag_mask=0x00, big_endian=True,
+                 auto_increment=True, max_register=None, volatile=(),
+                 precious=(), defaults=None, cache=True, fill=0x00):
+        """A register map for a register-based SPI slave, modeled on the
+        Linux kernel regmap API.
+
+        Each access is framed as the address, optionally flagged as a
+        read or a write, followed by any padding and then the
+        register values. The map caches the values of non-volatile
+        registers, so repeated reads and unchanged read-modify-write
+        updates cost no SPI traffic.
+
+        :param: channel The cp2130.spi.SPIChannel of the slave.
+        :param: addr_bits The width of the register address in bits. Must
+                          be a multiple of 8.
+        :param: val_bits The width of a register value in bits. Must be
+                         a multiple of 8.
+        :param: pad_bits The number of padding bits between the address
+                         and the value. Must be a multiple of 8.
+        :param: read_flag_mask A mask OR'ed into the first address byte
+                               for reads.
+        :param: write_flag_mask A mask OR'ed into the first address byte
+                                for writes.
+        :param: big_endian True if multi-byte addresses and values are
+                           transmitted most-significant byte first.
+        :param: auto_increment True if the slave advances the address
+                               after each value, allowing burst
+                               accesses to consecutive registers.
+        :param: max_register The highest valid register address, or None.
+        :param: volatile The addresses of registers whose values may be
+                         changed by the slave. They are never cached.
+        :param: precious The addresses of registers that must only be read
+                         when explicitly requested, e.g., because
+                         reading clears them. They are never cached or
+                         read as part of a bulk access.
+        :param: defaults A dict of known register values, e.g., the reset
+                         values, used to prime the cache.
+        :param: cache False to disable caching.
+        :param: fill The byte clocked out on MOSI during reads.
+
+        """
+        for (name, bits) in [('addr_bits', addr_bits), ('val_bits', val_bits), ('pad_bits', pad_bits)]:
+            if bits % 8 != 0:
+                raise ValueError("%s must be a multiple of 8"%name)
+
+        self.channel         = channel
+        self.addr_bytes      = addr_bits // 8
+        self.val_bytes       = val_bits // 8
+        self.pad_bytes       = pad_bits // 8
+        self.read_flag_mask  = read_flag_mask
+        self.write_flag_mask = write_flag_mask
+        self.big_endian      = big_endian
+        self.auto_increment  = auto_increment
+        self.max_register    = max_register
+        self.volatile        = frozenset(volatile)
+        self.precious        = frozenset(precious)
+        self.cache_enabled   = cache
+        self.fill            = fill
+
+        self.cache_only = False
+        self._cache = dict(defaults) if (cache and defaults) else {}
+        self._dirty = set()
+
+    def __repr__(self):
+        return "RegisterMap(%r)"%(self.channel)
+
+    def __str__(self):
+        lines = ["RegisterMap"]
+        for reg in sorted(self._cache):
+            dirty = " (dirty)" if reg in self._dirty else ""
+            lines.append("  0x%x: 0x%x%s"%(reg, self._cache[reg], dirty))
+        return "\n".join(lines)
+
+    # ------------------------------- Framing -------------------------------
+    def _check(self, reg, count=1):
+        if reg < 0 or (self.max_register is not None and reg + count - 1 > self.max_register):
+            raise ValueError("Register 0x%x is out of range"%(reg + count - 1))
+
+    def _header(self, reg, flag):
+        header = bytearray(_to_bytes(reg, self.addr_bytes, self.big_endian))
+        header[0] |= flag
+        return bytes(header) + b'\x00' * self.pad_bytes
+
+    def _encode(self, values):
+        return b''.join(_to_bytes(v, self.val_bytes, self.big_endian) for v in values)
+
+    def _decode(self, data):
+        data = bytes(bytearray(data))
+        n = self.val_bytes
+        return [_from_bytes(data[i:i + n], self.big_endian) for i in range(0, len(data), n)]
+
+    def _is_cacheable(self, reg):
+        return self.cache_enabled and reg not in self.volatile and reg not in self.precious
+
+    def _runs(self, regs):
+        """Splits sorted register addresses into runs that may be accessed in
+        one burst.
+
+        """
+        runs = []
+        for reg in regs:
+            if runs and self.auto_increment and reg == runs[-1][-1] + 1:
+                runs[-1].append(reg)
+            else:
+                runs.append([reg])
+        return runs
+
+    def _add_read(self, transaction, reg, count):
+        if self.auto_increment:
+            transaction.write(self._header(reg, self.read_flag_mask))
+            transaction.read(count * self.val_bytes)
+            transaction.boundary()
+        else:
+            for r in range(reg, reg + count):
+                transaction.write(self._header(r, self.read_flag_mask))
+                transaction.read(self.val_bytes)
+                transaction.boundary()
+
+    def _add_write(self, transaction, reg, values):
+        if self.auto_increment:
+            transaction.write(self._header(reg, self.write_flag_mask) + self._encode(values))
+            transaction.boundary()
+        else:
+            for (r, v) in enumerate(values, reg):
+                transaction.write(self._header(r, self.write_flag_mask) + self._encode([v]))
+                transaction.boundary()
+
+    # ------------------------------- Access --------------------------------
+    def read(self, reg):
+        """Reads a register, from the cache if possible.
+
+        """
+        self._check(reg)
+        if reg in self._cache and self._is_cacheable(reg):
+            return self._cache[reg]
+        if self.cache_only:
+            raise ValueError("Register 0x%x is not cached and the map is cache-only"%reg)
+
+        transaction = self.channel.transaction(self.fill)
+        self._add_read(transaction, reg, 1)
+        value = self._decode(b''.join(bytes(bytearray(r)) for r in transaction.execute()))[0]
+        if self._is_cacheable(reg):
+            self._cache[reg] = value
+        return value
+
+    def write(self, reg, value):
+        """Writes a register. In cache-only mode the value is only recorded in
+        the cache and written by the next sync().
+
+        """
+        self._check(reg)
+        if self.cache_only:
+            if not self._is_cacheable(reg):
+                raise ValueError("Register 0x%x cannot be cached"%reg)
+            self._cache[reg] = value
+            self._dirty.add(reg)
+            return
+
+        transaction = self.channel.transaction(self.fill)
+        self._add_write(transaction, reg, [value])
+        transaction.execute()
+        if self._is_cacheable(reg):
+            self._cache[reg] = value
+            self._dirty.discard(reg)
+
+    def update_bits(self, reg, mask, value):
+        """Performs a read-modify-write of the masked bits of a register. The
+        register is not written if the bits are unchanged.
+
+        :return: True if the register value changed.
+
+        """
+        old = self.read(reg)
+        new = (old & ~mask) | (value & mask)
+        if new == old:
+            return False
+        self.write(reg, new)
+        return True
+
+    def bulk_read(self, reg, count):
+        """Reads a range of consecutive registers in a single transaction.
+        If every register in the range is cached, no SPI traffic is
+        generated.
+
+        :return: A list of the register values.
+
+        """
+        self._check(reg, count)
+        regs = range(reg, reg + count)
+        if any(r in self.precious for r in regs):
+            raise ValueError("Range includes a precious register; read it explicitly")
+        if all(r in self._cache and self._is_cacheable(r) for r in regs):
+            return [self._cache[r] for r in regs]
+        if self.cache_only:
+            raise ValueError("Range is not cached and the map is cache-only")
+
+        transaction = self.channel.transaction(self.fill)
+        self._add_read(transaction, reg, count)
+        values = self._decode(b''.join(bytes(bytearray(r)) for r in transaction.execute()))
+        for (r, v) in zip(regs, values):
+            if self._is_cacheable(r) and r not in self._dirty:
+                self._cache[r] = v
+        return [self._cache[r] if r in self._dirty else v for (r, v) in zip(regs, values)]
+
+    def bulk_write(self, reg, values):
+        """Writes a range of consecutive registers in a single transaction.
+
+        """
+        values = list(values)
+        self._check(reg, len(values))
+        if self.cache_only:
+            for (r, v) in enumerate(values, reg):
+                self.write(r, v)
+            return
+
+        transaction = self.channel.transaction(self.fill)
+        self._add_write(transaction, reg, values)
+        transaction.execute()
+        for (r, v) in enumerate(values, reg):
+            if self._is_cacheable(r):
+                self._cache[r] = v
+                self._dirty.discard(r)
+
+    # -------------------------------- Cache --------------------------------
+    def sync(self):
+        """Writes all dirty registers to the slave. Runs of adjacent dirty
+        registers are coalesced into burst writes, and all bursts are
+        sent as a single transaction.
+
+        :return: The number of registers written.
+
+        """
+        if not self._dirty:
+            return 0
+        dirty = sorted(self._dirty)
+        transaction = self.channel.transaction(self.fill)
+        for run in self._runs(dirty):
+            self._add_write(transaction, run[0], [self._cache[r] for r in run])
+        transaction.execute()
+        self._dirty.clear()
+        return len(dirty)
+
+    def refresh(self):
+        """Rereads every cached register from the slave, coalescing adjacent
+        registers into burst reads in a single transaction. Dirty
+        registers are left untouched.
+
+        """
+        regs = sorted(r for r in self._cache if self._is_cacheable(r) and r not in self._dirty)
+        if not regs:
+            return
+        transaction = self.channel.transaction(self.fill)
+        runs = self._runs(regs)
+        for run in runs:
+            self._add_read(transaction, run[0], len(run))
+        data = b''.join(bytes(bytearray(r)) for r in transaction.execute())
+        for (r, v) in zip([r for run in runs for r in run], self._decode(data)):
+            self._cache[r] = v
+
+    def mark_dirty(self):
+        """Marks every cached register as dirty, e.g., after the slave was
+        reset, so the next sync() restores them.
+
+        """
+        self._dirty.update(self._cache)
+
+    def invalidate(self):
+        """Discards the cache, including any dirty values.
+
+        """
+        self._cache.clear()
+        self._dirty.clear()
+
+    @property
+    def dirty(self):
+        """The sorted addresses of registers awaiting sync().
+
+        """
+        return sorted(self._dirty)
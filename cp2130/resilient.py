@@ -0,0 +1,355 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import struct
+import threading
+import time
+
+from cp2130.chip import commands, registers
+from cp2130.data import LogicLevel
+from cp2130.usb.usb import NoDeviceError, NoHotplugSupportError, USBDevice
+
+# The volatile configuration commands, keyed by bRequest, and whether
+# the first data byte selects a channel. Writes to these are cached and
+# replayed on reconnect. OTP ROM writes and resets are never replayed.
+_VOLATILE = {
+    commands.set_gpio_chip_select.b_request    : True,
+    commands.set_gpio_mode_and_level.b_request : True,
+    commands.set_spi_word.b_request            : True,
+    commands.set_spi_delay.b_request           : True,
+    commands.set_clock_divider.b_request       : False,
+    commands.set_event_counter.b_request       : False,
+    commands.set_full_threshold.b_request      : False,
+}
+
+_SET_GPIO_VALUES         = commands.set_gpio_values.b_request
+_SET_GPIO_MODE_AND_LEVEL = commands.set_gpio_mode_and_level.b_request
+
+def _gpio_mask(num):
+    reg = registers.gpio_values_setter.default()
+    reg.set_level(num, LogicLevel.LOW)
+    return struct.unpack('>HH', reg.raw)[1]
+
+class DisconnectedError(NoDeviceError):
+    """Raised by a call on a ResilientUSBDevice that is disconnected, or
+    that was in flight when the device disconnected.
+
+    """
+    pass
+
+class ReconnectStats(object):
+
+    def __init__(self):
+        """Counters describing the connection history of a
+        ResilientUSBDevice.
+
+        """
+        self.disconnects       = 0
+        self.reconnects        = 0
+        self.failed_reconnects = 0
+        self.replayed          = 0
+        self.last_latency      = None
+        self.max_latency       = 0.0
+        self.total_downtime    = 0.0
+
+    def __repr__(self):
+        return "ReconnectStats()"
+
+    def __str__(self):
+        return """ReconnectStats
+  disconnects:       %d
+  reconnects:        %d
+  failed_reconnects: %d
+  replayed:          %d
+  last_latency:      %s
+  mean_latency:      %s
+  max_latency:       %.3f s
+  total_downtime:    %.3f s"""%(self.disconnects, self.reconnects, self.failed_reconnects,
+                               self.replayed, _seconds(self.last_latency),
+                               _seconds(self.mean_latency), self.max_latency,
+                               self.total_downtime)
+
+    @property
+    def mean_latency(self):
+        """The mean time in seconds from a disconnect to the device being
+        ready again, or None if it never reconnected.
+
+        """
+        if not self.reconnects:
+            return None
+        return self.total_downtime / self.reconnects
+
+def _seconds(value):
+    return "n/a" if value is None else "%.3f s"%value
+
+class ResilientUSBDevice(USBDevice):
+
+    def __init__(self, vid=0x10c4, pid=0x87A0, serial=None, block=True,
+                 timeout=None):
+        """A USB device handle that survives the device being unplugged and
+        plugged back in, so the CP2130, SPIChannel and GPIO objects
+        built on it stay usable.
+
+        The device is identified by its serial number. A hotplug
+        listener notices when it leaves and when it returns; a
+        background thread then reopens it and replays the cached
+        volatile configuration (the last SPI word, SPI delay, GPIO
+        mode and level, chip-select, clock divider, event counter
+        and FIFO threshold writes) before calls resume.
+
+        The call in flight when the device disappears raises a
+        DisconnectedError, as it is unknown whether it took
+        effect. Later calls either wait for the device to return
+        (block=True) or raise a DisconnectedError immediately.
+
+        Requires the libusb1 backend. Without hotplug support, a
+        disconnect is noticed by the next failed transfer and the bus
+        is polled until the device returns.
+
+        :param: vid The vendor id to match.
+        :param: pid The product id to match.
+        :param: serial The serial number to match, or None to use the
+                       first matching device and follow its serial.
+        :param: block True to wait for a reconnect, False to fail fast.
+        :param: timeout The maximum time in seconds a blocked call waits,
+                        or None to wait forever.
+
+        """
+        from cp2130.usb import libusb1
+        import usb1
+
+        self._backend  = libusb1
+        self._no_device = (usb1.USBErrorNoDevice, NoDeviceError)
+
+        self.vid     = vid
+        self.pid     = pid
+        self.block   = block
+        self.timeout = timeout
+        self.stats   = ReconnectStats()
+
+        self._device = libusb1.find(vid, pid, serial)
+        self.serial  = serial or self._device.handle.getSerialNumber()
+
+        self._cache     = collections.OrderedDict()
+        self._condition = threading.Condition(threading.RLock())
+        self._connected = True
+        self._closed    = False
+        self._left_at   = None
+        self._arrived   = threading.Event()
+
+        self._listener = libusb1.HotplugListener(vid, pid, self._on_arrived, self._on_left)
+        try:
+            self._listener.start()
+        except NoHotplugSupportError:
+            # Disconnects are then noticed by failed transfers, and the
+            # device is polled for until it returns.
+            self._listener = None
+
+        self._thread = threading.Thread(target=self._reconnect_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return "ResilientUSBDevice(%r)"%(self.serial)
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def close(self):
+        with self._condition:
+            self._closed    = True
+            self._connected = False
+            if self._listener is not None:
+                self._listener.stop()
+            self._arrived.set()
+            if self._device is not None:
+                self._device.close()
+                self._device = None
+            self._condition.notify_all()
+
+    # ------------------------------ Delegation -----------------------------
+    def _current(self):
+        with self._condition:
+            deadline = None if self.timeout is None else time.time() + self.timeout
+            while not self._connected:
+                if self._closed:
+                    raise DisconnectedError("Device %s is closed"%self.serial)
+                if not self.block:
+                    raise DisconnectedError("Device %s is disconnected"%self.serial)
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise DisconnectedError("Device %s did not reconnect within %s s"%(self.serial, self.timeout))
+                self._condition.wait(remaining)
+            return self._device
+
+    def _call(self, name, *args):
+        device = self._current()
+        try:
+            return getattr(device, name)(*args)
+        except self._no_device:
+            self._disconnected(device)
+            raise DisconnectedError("Device %s disconnected during %s"%(self.serial, name))
+
+    def endpoints(self):
+        return self._call('endpoints')
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        result = self._call('control_transfer', bmRequestType, bRequest, wValue, wIndex, wLengthOrData)
+        if not isinstance(wLengthOrData, int):
+            self._remember(bmRequestType, bRequest, wValue, wIndex, bytes(bytearray(wLengthOrData)))
+        return result
+
+    def read(self, endpoint, size):
+        return self._call('read', endpoint, size)
+
+    def readinto(self, endpoint, buffer):
+        return self._call('readinto', endpoint, buffer)
+
+    def write(self, endpoint, data):
+        return self._call('write', endpoint, data)
+
+    # ------------------------------- Caching -------------------------------
+    def _remember(self, bmRequestType, bRequest, wValue, wIndex, data):
+        """Records a volatile configuration write, keeping only the last
+        write to each register so the replay is as short as possible.
+
+        """
+        with self._condition:
+            if bRequest == _SET_GPIO_VALUES:
+                (levels, mask) = struct.unpack('>HH', data)
+                key = (bRequest,)
+                if key in self._cache:
+                    (_, _, _, _, old) = self._cache.pop(key)
+                    (old_levels, old_mask) = struct.unpack('>HH', old)
+                    levels = (old_levels & ~mask) | (levels & mask)
+                    mask |= old_mask
+                data = struct.pack('>HH', levels, mask)
+            elif bRequest in _VOLATILE:
+                key = (bRequest, bytearray(data)[0]) if _VOLATILE[bRequest] else (bRequest,)
+                self._cache.pop(key, None)
+                if bRequest == _SET_GPIO_MODE_AND_LEVEL:
+                    self._forget_level(bytearray(data)[0])
+            else:
+                return
+            self._cache[key] = (bmRequestType, bRequest, wValue, wIndex, data)
+
+    def _forget_level(self, num):
+        # A later mode and level write supersedes any cached level.
+        key = (_SET_GPIO_VALUES,)
+        if key in self._cache:
+            (rtype, request, value, index, data) = self._cache[key]
+            (levels, mask) = struct.unpack('>HH', data)
+            mask &= ~_gpio_mask(num)
+            if mask:
+                self._cache[key] = (rtype, request, value, index, struct.pack('>HH', levels, mask))
+            else:
+                del self._cache[key]
+
+    # ------------------------------ Reconnect ------------------------------
+    def _disconnected(self, device):
+        with self._condition:
+            if self._device is not device or not self._connected:
+                return
+            self._connected = False
+            self._left_at   = time.time()
+            self.stats.disconnects += 1
+            try:
+                device.close()
+            except Exception:
+                pass
+            self._device = None
+            # The device may already be back, e.g., after a missed event.
+            self._arrived.set()
+        logging.getLogger("cp2130.resilient").warning("Device %s disconnected", self.serial)
+
+    def _on_left(self, device):
+        current = self._device
+        if current is not None and current.is_same_device(device):
+            self._disconnected(current)
+
+    def _on_arrived(self, device):
+        # Opening the device is not allowed in the hotplug callback.
+        if not self._connected:
+            self._arrived.set()
+
+    def _reconnect_loop(self):
+        while not self._closed:
+            self._arrived.wait()
+            self._arrived.clear()
+            while not self._closed and not self._connected:
+                if self._reconnect():
+                    break
+                # Not yet accessible; retry until the next arrival or shortly.
+                self._arrived.wait(0.1)
+                self._arrived.clear()
+
+    def _reconnect(self):
+        try:
+            device = self._backend.find(self.vid, self.pid, self.serial)
+        except NoDeviceError:
+            return False
+        except Exception:
+            self.stats.failed_reconnects += 1
+            logging.getLogger("cp2130.resilient").warning("Error reopening %s", self.serial, exc_info=True)
+            return False
+
+        with self._condition:
+            try:
+                for (rtype, request, value, index, data) in self._cache.values():
+                    device.control_transfer(rtype, request, value, index, data)
+                self.stats.replayed += len(self._cache)
+            except Exception:
+                self.stats.failed_reconnects += 1
+                logging.getLogger("cp2130.resilient").warning("Error restoring %s", self.serial, exc_info=True)
+                device.close()
+                return False
+
+            latency = time.time() - self._left_at
+            self.stats.reconnects     += 1
+            self.stats.last_latency    = latency
+            self.stats.max_latency     = max(self.stats.max_latency, latency)
+            self.stats.total_downtime += latency
+
+            self._device    = device
+            self._connected = True
+            self._condition.notify_all()
+
+        logging.getLogger("cp2130.resilient").info("Device %s reconnected after %.3f s", self.serial, latency)
+        return True
+
+def find(vid=0x10c4, pid=0x87A0, serial=None, block=True, timeout=None):
+    """Opens a CP2130 through a ResilientUSBDevice, so it survives being
+    unplugged and plugged back in.
+
+    :param: vid The vendor id to match.
+    :param: pid The product id to match.
+    :param: serial The serial number to match, or None for the first
+                   matching device.
+    :param: block True for calls to wait for a reconnect, False to fail fast.
+    :param: timeout The maximum time in seconds a blocked call waits, or
+                    None to wait forever.
+    :return: A cp2130.core.CP2130 instance for the device. Its
+             usb_device.stats holds the reconnect metrics.
+
+    """
+    from cp2130.chip import CP2130Chip
+    from cp2130.core import CP2130
+
+    dev = ResilientUSBDevice(vid, pid, serial, block, timeout)
+    return CP2130(CP2130Chip(dev))
@@ -0,0 +1,252 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import array
+import binascii
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from cp2130.chip import commands
+from cp2130.usb.usb import USBDevice
+
+_LOCK_BYTE = commands.get_lock_byte.b_request
+_SERIAL    = commands.get_serial_string.b_request
+
+# The read-only registers served from the cache, by bRequest. All are
+# in the OTP ROM except the version, which never changes.
+_CACHED = frozenset(cmd.b_request for cmd in [
+    commands.get_manufacturing_string1,
+    commands.get_manufacturing_string2,
+    commands.get_pin_config,
+    commands.get_product_string1,
+    commands.get_product_string2,
+    commands.get_readonly_version,
+    commands.get_serial_string,
+    commands.get_usb_config,
+])
+
+# The OTP ROM writes, which invalidate the cache.
+_OTP_WRITES = frozenset(cmd.b_request for cmd in [
+    commands.set_lock_byte,
+    commands.set_manufacturing_string1,
+    commands.set_manufacturing_string2,
+    commands.set_pin_config,
+    commands.set_product_string1,
+    commands.set_product_string2,
+    commands.set_serial_string,
+    commands.set_usb_config,
+])
+
+def default_path():
+    """The default cache file, in $XDG_CACHE_HOME or ~/.cache.
+
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'cp2130', 'rom.json')
+
+def _hex(data):
+    return binascii.hexlify(bytes(bytearray(data))).decode('ascii')
+
+def _unhex(text):
+    return binascii.unhexlify(text.encode('ascii'))
+
+class ROMCache(object):
+
+    def __init__(self, path=None):
+        """A persistent store of the OTP ROM contents of CP2130s, keyed by
+        serial number.
+
+        Each entry also records the lock byte it was read under. As
+        every OTP write locks the fields it changes, a lock byte that
+        no longer matches means the ROM was programmed since, by this
+        or any other host, and the entry is discarded.
+
+        The store is a JSON file shared by every process using the
+        same path. Each update re-reads the file and replaces it
+        atomically, so concurrent processes do not corrupt it.
+
+        :param: path The cache file, or None for default_path().
+
+        """
+        self.path  = path or default_path()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "ROMCache(%r)"%(self.path)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _store(self, entries):
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            (fd, tmp) = tempfile.mkstemp(dir=directory, prefix='.rom-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            # The cache is an optimization only.
+            logging.getLogger("cp2130.rom_cache").warning("Cannot write %s", self.path, exc_info=True)
+
+    def get(self, serial, lock):
+        """Returns the cached registers of a device.
+
+        :param: serial The serial number of the device.
+        :param: lock The raw lock byte read from the device.
+        :return: A dict mapping bRequest to raw register bytes, empty if
+                 the device is unknown or its ROM has changed.
+
+        """
+        with self._lock:
+            entry = self._load().get(serial)
+        if entry is None or entry.get('lock') != _hex(lock):
+            return {}
+        return dict((int(request), _unhex(data)) for (request, data) in entry['registers'].items())
+
+    def put(self, serial, lock, registers):
+        """Stores the registers of a device read under the given lock byte.
+
+        """
+        with self._lock:
+            entries = self._load()
+            entries[serial] = {
+                'lock'      : _hex(lock),
+                'registers' : dict((str(request), _hex(data)) for (request, data) in registers.items()),
+            }
+            self._store(entries)
+
+    def invalidate(self, serial=None):
+        """Discards the entry of one device, or of every device.
+
+        """
+        with self._lock:
+            entries = self._load()
+            if serial is None:
+                entries = {}
+            else:
+                entries.pop(serial, None)
+            self._store(entries)
+
+class CachedROMDevice(USBDevice):
+
+    def __init__(self, usb_device, cache=None, serial=None):
+        """A USB device handle that serves reads of the OTP ROM from a
+        ROMCache, so that a process opening a known device does not
+        read the ROM again.
+
+        Opening reads the lock byte, to validate the device's entry,
+        and the serial string if it is not given, to find it. Every
+        other ROM read is then a cache hit, until an OTP write
+        through this handle invalidates the entry.
+
+        :param: usb_device The cp2130.usb.USBDevice to wrap.
+        :param: cache The ROMCache, or None for one at the default path.
+        :param: serial The serial number of the device, if known.
+
+        """
+        self.usb_device = usb_device
+        self.cache      = cache if cache is not None else ROMCache()
+        self.hits       = 0
+        self.misses     = 0
+
+        self._lock_byte = self._read(_LOCK_BYTE, commands.get_lock_byte.w_length)
+        if serial is None:
+            self._identify()
+            self._registers = self.cache.get(self.serial, self._lock_byte)
+            self._registers.setdefault(_SERIAL, self._serial_raw)
+        else:
+            self.serial     = serial
+            self._registers = self.cache.get(self.serial, self._lock_byte)
+
+    def __repr__(self):
+        return "CachedROMDevice(%r)"%(self.usb_device)
+
+    def _identify(self):
+        self._serial_raw = self._read(_SERIAL, commands.get_serial_string.w_length)
+        length = min(bytearray(self._serial_raw)[0], len(self._serial_raw))
+        self.serial = self._serial_raw[2:length].decode('utf-16-le')
+
+    def _read(self, request, length):
+        rtype = commands.get_lock_byte.bm_request_type
+        data = self.usb_device.control_transfer(rtype, request, 0, 0, length)
+        return bytes(bytearray(data))
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if not isinstance(wLengthOrData, int):
+            result = self.usb_device.control_transfer(bmRequestType, bRequest, wValue, wIndex, wLengthOrData)
+            if bRequest in _OTP_WRITES:
+                self._registers = {}
+                self._lock_byte = None
+                self.cache.invalidate(self.serial)
+                if bRequest == commands.set_serial_string.b_request:
+                    self._identify()
+            return result
+
+        if bRequest == _LOCK_BYTE:
+            if self._lock_byte is None:
+                self._lock_byte = self._read(bRequest, wLengthOrData)
+            self.hits += 1
+            return array.array('B', self._lock_byte)
+
+        if bRequest not in _CACHED:
+            return self.usb_device.control_transfer(bmRequestType, bRequest, wValue, wIndex, wLengthOrData)
+
+        data = self._registers.get(bRequest)
+        if data is not None and len(data) == wLengthOrData:
+            self.hits += 1
+            return array.array('B', data)
+
+        self.misses += 1
+        data = self._read(bRequest, wLengthOrData)
+        if self._lock_byte is None:
+            self._lock_byte = self._read(_LOCK_BYTE, commands.get_lock_byte.w_length)
+        self._registers[bRequest] = data
+        self.cache.put(self.serial, self._lock_byte, self._registers)
+        return array.array('B', data)
+
+    # ------------------------------ Delegation -----------------------------
+    def close(self):
+        self.usb_device.close()
+
+    def acquire(self):
+        self.usb_device.acquire()
+
+    def release(self):
+        self.usb_device.release()
+
+    def reenumerate(self, reset, timeout=5.0):
+        return CachedROMDevice(self.usb_device.reenumerate(reset, timeout), self.cache, self.serial)
+
+    def endpoints(self):
+        return self.usb_device.endpoints()
+
+    def read(self, endpoint, size):
+        return self.usb_device.read(endpoint, size)
+
+    def readinto(self, endpoint, buffer):
+        return self.usb_device.readinto(endpoint, buffer)
+
+    def write(self, endpoint, data):
+        return self.usb_device.write(endpoint, data)
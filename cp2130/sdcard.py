@@ -0,0 +1,510 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import collections
+import contextlib
+import io
+import os
+import struct
+import time
+
+from cp2130.data import LogicLevel
+from cp2130.spi import SPIChannelGPIO
+
+class SDError(EnvironmentError):
+    """Raised if an SD card rejects a command or a data transfer fails.
+
+    """
+    pass
+
+def _crc7(data):
+    crc = 0
+    for byte in bytearray(data):
+        for bit in range(7, -1, -1):
+            crc <<= 1
+            if ((byte >> bit) & 1) ^ ((crc >> 7) & 1):
+                crc ^= 0x09
+        crc &= 0x7F
+    return (crc << 1) | 1
+
+class SDCard(io.RawIOBase):
+
+    BLOCK_SIZE = 512
+
+    GO_IDLE_STATE        = 0
+    SEND_OP_COND         = 1
+    SEND_IF_COND         = 8
+    SEND_CSD             = 9
+    STOP_TRANSMISSION    = 12
+    SET_BLOCKLEN         = 16
+    READ_SINGLE_BLOCK    = 17
+    READ_MULTIPLE_BLOCK  = 18
+    WRITE_BLOCK          = 24
+    WRITE_MULTIPLE_BLOCK = 25
+    SD_SEND_OP_COND      = 41
+    APP_CMD              = 55
+    READ_OCR             = 58
+
+    TOKEN_START       = 0xFE
+    TOKEN_START_MULTI = 0xFC
+    TOKEN_STOP_MULTI  = 0xFD
+
+    def __init__(self, channel, clock_frequency=12000000, chunk_size=65536,
+                 cache_blocks=0, write_poll=16, timeout=1.0):
+        """A block device driver for an SD or MMC card in SPI mode.
+
+        Multi-block reads use READ_MULTIPLE_BLOCK and are streamed in
+        full-duplex bulk transfers of up to chunk_size bytes, parsing
+        the data tokens and blocks out of each transfer. The read
+        command itself is sent in the same transfer as the start of
+        the data. Multi-block writes use WRITE_MULTIPLE_BLOCK with one
+        bulk transfer per block that also collects the data response
+        and the start of the busy signal.
+
+        The card is available as a raw, seekable file object, so it can
+        be wrapped in io.BufferedRandom, and through read_blocks(),
+        readinto_blocks() and write_blocks(). An optional LRU cache
+        holds recently used blocks.
+
+        The card needs the chip-select held across command, response
+        and data, so the channel must use a GPIO chip-select.
+
+        :param: channel The cp2130.spi.SPIChannelGPIO of the card.
+        :param: clock_frequency The SPI clock frequency after
+                                initialization.
+        :param: chunk_size The maximum number of bytes per bulk transfer.
+        :param: cache_blocks The number of blocks to cache, or 0 for none.
+        :param: write_poll The number of bytes clocked after each written
+                           block to collect the data response and busy
+                           status.
+        :param: timeout The time in seconds to wait for the card.
+        :raises: A ValueError if the channel uses a native chip-select.
+        :raises: An SDError if the card does not initialize.
+
+        """
+        if not isinstance(channel, SPIChannelGPIO):
+            raise ValueError("SDCard requires a channel with a GPIO chip-select")
+        super(SDCard, self).__init__()
+
+        self.channel         = channel
+        self.chip            = channel.chip
+        self.clock_frequency = clock_frequency
+        self.chunk_size      = chunk_size
+        self.cache_blocks    = cache_blocks
+        self.write_poll      = write_poll
+        self.timeout         = timeout
+
+        self.hits   = 0
+        self.misses = 0
+
+        self._cache = collections.OrderedDict()
+        self._ones  = {}
+        self._pos   = 0
+
+        self.high_capacity = False
+        self.block_count   = 0
+        self.initialize()
+
+    def __repr__(self):
+        return "SDCard(%r)"%(self.channel)
+
+    def __str__(self):
+        return """SDCard
+  size:          %d
+  block_count:   %d
+  high_capacity: %s
+  cached blocks: %d
+  hits:          %d
+  misses:        %d"""%(self.size, self.block_count, self.high_capacity,
+                         len(self._cache), self.hits, self.misses)
+
+    @property
+    def size(self):
+        return self.block_count * self.BLOCK_SIZE
+
+    # ------------------------------ Transfers ------------------------------
+    def _fill(self, length):
+        ones = self._ones.get(length)
+        if ones is None:
+            ones = b'\xff' * length
+            if len(self._ones) < 16:
+                self._ones[length] = ones
+        return ones
+
+    def _xfer(self, data):
+        return bytearray(self.chip.write_read(data))
+
+    @contextlib.contextmanager
+    def _selected(self):
+        with self.chip.transaction():
+            self.channel.gpio.value = LogicLevel.LOW
+            try:
+                yield
+            finally:
+                self.channel.gpio.value = LogicLevel.HIGH
+                # Let the card release MISO.
+                self.chip.write(b'\xff')
+
+    def _frame(self, cmd, arg):
+        frame = struct.pack('>BI', 0x40 | cmd, arg)
+        return frame + struct.pack('>B', _crc7(frame))
+
+    def _response(self, buf, pos):
+        """Finds the R1 response in buf at or after pos, polling for more
+        bytes if needed.
+
+        :return: A (r1, buf, pos) tuple, where pos indexes the byte after R1.
+
+        """
+        for _ in range(3):
+            while pos < len(buf):
+                if not buf[pos] & 0x80:
+                    return (buf[pos], buf, pos + 1)
+                pos += 1
+            (buf, pos) = (self._xfer(self._fill(8)), 0)
+        raise SDError("No response from card")
+
+    def _command(self, cmd, arg, extra=0, follow=0):
+        """Sends a command and returns its response. Must be called with the
+        card selected.
+
+        :param: extra The number of response bytes after R1, e.g., 4 for
+                      R3 and R7.
+        :param: follow The number of additional bytes to clock in the
+                       same transfer, e.g., to begin receiving data.
+        :return: A (r1, buf, pos) tuple, where pos indexes the byte after R1.
+
+        """
+        buf = self._xfer(self._frame(cmd, arg) + self._fill(8 + extra + follow))
+        (r1, buf, pos) = self._response(buf, 6)
+        if len(buf) - pos < extra:
+            buf = buf[pos:] + self._xfer(self._fill(extra))
+            pos = 0
+        return (r1, buf, pos)
+
+    def _simple(self, cmd, arg=0, extra=0):
+        with self._selected():
+            (r1, buf, pos) = self._command(cmd, arg, extra)
+            return (r1, bytes(buf[pos:pos + extra]))
+
+    def _app_command(self, cmd, arg=0):
+        with self._selected():
+            self._command(self.APP_CMD, 0)
+            (r1, _, _) = self._command(cmd, arg)
+            return r1
+
+    def _wait_ready(self, buf=None):
+        """Waits for the card to release the busy signal (MISO low).
+
+        """
+        deadline = time.time() + self.timeout
+        while buf is None or buf[-1] != 0xFF:
+            if time.time() > deadline:
+                raise SDError("Card still busy after %s seconds"%self.timeout)
+            buf = self._xfer(self._fill(64))
+
+    def _read_data(self, buf, pos, out, remaining):
+        """Reads one data block (token, payload and CRC) into the writable
+        buffer out, continuing from buf[pos:]. Must be called with the
+        card selected.
+
+        :param: remaining The number of payload bytes still expected in the
+                          whole transfer, to size each bulk read.
+        :return: The (buf, pos) of the bytes after the block.
+
+        """
+        length = len(out)
+        deadline = time.time() + self.timeout
+        while True:
+            while pos < len(buf) and buf[pos] == 0xFF:
+                pos += 1
+            if pos < len(buf):
+                break
+            if time.time() > deadline:
+                raise SDError("Timeout waiting for data token")
+            (buf, pos) = (self._xfer(self._fill(min(self.chunk_size, remaining + 3))), 0)
+
+        token = buf[pos]
+        if token != self.TOKEN_START:
+            raise SDError("Data error token 0x%02x"%token)
+        pos += 1
+
+        needed = length + 2
+        if len(buf) - pos < needed:
+            more = min(self.chunk_size, max(needed - (len(buf) - pos), remaining + 3))
+            buf = buf[pos:] + self._xfer(self._fill(more))
+            pos = 0
+            while len(buf) < needed:
+                buf += self._xfer(self._fill(min(self.chunk_size, needed - len(buf))))
+        out[:] = buf[pos:pos + length]
+        return (buf, pos + needed)
+
+    # ------------------------------ Lifecycle ------------------------------
+    def initialize(self):
+        """Puts the card into SPI mode, negotiates the operating conditions
+        and reads its capacity.
+
+        """
+        self.channel.clock_frequency = 375000
+        self._cache.clear()
+
+        # At least 74 clocks with the card deselected.
+        self.chip.write(self._fill(10))
+
+        deadline = time.time() + self.timeout
+        while self._simple(self.GO_IDLE_STATE)[0] != 0x01:
+            if time.time() > deadline:
+                raise SDError("Card did not enter the idle state")
+
+        (r1, r7) = self._simple(self.SEND_IF_COND, 0x1AA, extra=4)
+        version2 = not (r1 & 0x04)
+        if version2 and bytearray(r7)[2:] != bytearray(b'\x01\xaa'):
+            raise SDError("Card does not support the supply voltage")
+
+        arg = 0x40000000 if version2 else 0
+        r1 = self._app_command(self.SD_SEND_OP_COND, arg)
+        if r1 & 0x04 and not version2:
+            # An MMC card rejects ACMD41 as illegal and initializes with
+            # SEND_OP_COND instead.
+            while self._simple(self.SEND_OP_COND)[0] != 0x00:
+                if time.time() > deadline:
+                    raise SDError("Card did not finish initializing")
+        else:
+            while r1 != 0x00:
+                if time.time() > deadline:
+                    raise SDError("Card did not finish initializing")
+                r1 = self._app_command(self.SD_SEND_OP_COND, arg)
+
+        if version2:
+            (r1, ocr) = self._simple(self.READ_OCR, extra=4)
+            self.high_capacity = bool(bytearray(ocr)[0] & 0x40)
+        if not self.high_capacity:
+            self._simple(self.SET_BLOCKLEN, self.BLOCK_SIZE)
+
+        self.channel.clock_frequency = self.clock_frequency
+
+        csd = bytearray(16)
+        with self._selected():
+            (r1, buf, pos) = self._command(self.SEND_CSD, 0, follow=24)
+            if r1 != 0:
+                raise SDError("SEND_CSD failed with R1 0x%02x"%r1)
+            self._read_data(buf, pos, csd, 16)
+        self.block_count = self._parse_csd(csd)
+
+    @staticmethod
+    def _parse_csd(csd):
+        if csd[0] >> 6 == 1:
+            c_size = ((csd[7] & 0x3F) << 16) | (csd[8] << 8) | csd[9]
+            return (c_size + 1) * 1024
+        read_bl_len = csd[5] & 0x0F
+        c_size      = ((csd[6] & 0x03) << 10) | (csd[7] << 2) | (csd[8] >> 6)
+        c_size_mult = ((csd[9] & 0x03) << 1) | (csd[10] >> 7)
+        return ((c_size + 1) << (c_size_mult + 2 + read_bl_len)) // SDCard.BLOCK_SIZE
+
+    def _address(self, lba):
+        return lba if self.high_capacity else lba * self.BLOCK_SIZE
+
+    def _check(self, lba, count):
+        if lba < 0 or lba + count > self.block_count:
+            raise ValueError("Blocks %d-%d exceed the card size of %d blocks"%(lba, lba + count, self.block_count))
+
+    # ------------------------------- Blocks --------------------------------
+    def read_blocks(self, lba, count):
+        """Reads consecutive blocks.
+
+        :return: The data as a bytearray.
+
+        """
+        data = bytearray(count * self.BLOCK_SIZE)
+        self.readinto_blocks(lba, data)
+        return data
+
+    def readinto_blocks(self, lba, buf):
+        """Reads consecutive blocks into a writable buffer whose length is a
+        multiple of the block size.
+
+        """
+        view = memoryview(buf)
+        if len(view) % self.BLOCK_SIZE:
+            raise ValueError("Buffer length must be a multiple of %d"%self.BLOCK_SIZE)
+        count = len(view) // self.BLOCK_SIZE
+        self._check(lba, count)
+
+        if not self.cache_blocks:
+            self._read_card(lba, count, view)
+            return
+
+        # Fetch each run of missing blocks with one streaming read.
+        start = None
+        for i in range(count + 1):
+            block = self._cache.get(lba + i) if i < count else None
+            if block is not None:
+                self._cache[lba + i] = self._cache.pop(lba + i)
+                view[i * self.BLOCK_SIZE:(i + 1) * self.BLOCK_SIZE] = block
+                self.hits += 1
+            elif i < count and start is None:
+                start = i
+            if start is not None and (block is not None or i == count):
+                self._read_card(lba + start, i - start, view[start * self.BLOCK_SIZE:i * self.BLOCK_SIZE])
+                self.misses += i - start
+                for j in range(start, i):
+                    self._store(lba + j, view[j * self.BLOCK_SIZE:(j + 1) * self.BLOCK_SIZE])
+                start = None
+
+    def _store(self, lba, data):
+        self._cache.pop(lba, None)
+        self._cache[lba] = bytes(data)
+        while len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+
+    def _read_card(self, lba, count, view):
+        size = self.BLOCK_SIZE
+        cmd = self.READ_SINGLE_BLOCK if count == 1 else self.READ_MULTIPLE_BLOCK
+        with self._selected():
+            follow = min(self.chunk_size, count * (size + 3) + 8)
+            (r1, buf, pos) = self._command(cmd, self._address(lba), follow=follow)
+            if r1 != 0:
+                raise SDError("Read of block %d failed with R1 0x%02x"%(lba, r1))
+            for i in range(count):
+                remaining = (count - i) * (size + 3)
+                (buf, pos) = self._read_data(buf, pos, view[i * size:(i + 1) * size], remaining)
+            if cmd == self.READ_MULTIPLE_BLOCK:
+                # The byte after STOP_TRANSMISSION is a stuff byte.
+                buf = self._xfer(self._frame(self.STOP_TRANSMISSION, 0) + self._fill(10))
+                (r1, buf, pos) = self._response(buf, 7)
+                self._wait_ready(buf)
+
+    def write_blocks(self, lba, data):
+        """Writes consecutive blocks. The data length must be a multiple of
+        the block size.
+
+        """
+        view = memoryview(data)
+        if len(view) % self.BLOCK_SIZE:
+            raise ValueError("Data length must be a multiple of %d"%self.BLOCK_SIZE)
+        count = len(view) // self.BLOCK_SIZE
+        self._check(lba, count)
+        size = self.BLOCK_SIZE
+
+        multi = count > 1
+        cmd   = self.WRITE_MULTIPLE_BLOCK if multi else self.WRITE_BLOCK
+        token = struct.pack('>B', self.TOKEN_START_MULTI if multi else self.TOKEN_START)
+        try:
+            with self._selected():
+                (r1, _, _) = self._command(cmd, self._address(lba))
+                if r1 != 0:
+                    raise SDError("Write of block %d failed with R1 0x%02x"%(lba, r1))
+                for i in range(count):
+                    block = view[i * size:(i + 1) * size]
+                    buf = self._xfer(token + block.tobytes() + self._fill(2 + self.write_poll))
+                    pos = size + 3
+                    while pos < len(buf) and buf[pos] == 0xFF:
+                        pos += 1
+                    if pos == len(buf):
+                        buf = self._xfer(self._fill(8))
+                        pos = 0
+                        while pos < len(buf) and buf[pos] == 0xFF:
+                            pos += 1
+                        if pos == len(buf):
+                            raise SDError("No data response for block %d"%(lba + i))
+                    if buf[pos] & 0x1F != 0x05:
+                        raise SDError("Block %d rejected with data response 0x%02x"%(lba + i, buf[pos]))
+                    self._wait_ready(buf)
+                if multi:
+                    buf = self._xfer(struct.pack('>B', self.TOKEN_STOP_MULTI) + self._fill(2))
+                    self._wait_ready(buf)
+        except:
+            # The card may hold any mix of old and new data.
+            for i in range(count):
+                self._cache.pop(lba + i, None)
+            raise
+        for i in range(count):
+            if lba + i in self._cache:
+                self._store(lba + i, view[i * size:(i + 1) * size])
+
+    # ------------------------------ File-like ------------------------------
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence %r"%whence)
+        if pos < 0:
+            raise ValueError("Negative seek position %d"%pos)
+        self._pos = pos
+        return pos
+
+    def _span(self, length):
+        first = self._pos // self.BLOCK_SIZE
+        last  = (self._pos + length + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+        return (first, last - first, self._pos - first * self.BLOCK_SIZE)
+
+    def readinto(self, b):
+        view = memoryview(b)
+        length = max(0, min(len(view), self.size - self._pos))
+        if length == 0:
+            return 0
+        (first, count, offset) = self._span(length)
+        if offset == 0 and length % self.BLOCK_SIZE == 0:
+            self.readinto_blocks(first, view[:length])
+        else:
+            data = self.read_blocks(first, count)
+            view[:length] = data[offset:offset + length]
+        self._pos += length
+        return length
+
+    def write(self, b):
+        view = memoryview(b)
+        length = len(view)
+        if self._pos + length > self.size:
+            raise ValueError("Write exceeds the card size")
+        if length == 0:
+            return 0
+        (first, count, offset) = self._span(length)
+        if offset == 0 and length % self.BLOCK_SIZE == 0:
+            self.write_blocks(first, view)
+        else:
+            # Read-modify-write of the partially covered blocks.
+            data = bytearray(count * self.BLOCK_SIZE)
+            if offset:
+                data[:self.BLOCK_SIZE] = self.read_blocks(first, 1)
+            if (offset + length) % self.BLOCK_SIZE:
+                data[-self.BLOCK_SIZE:] = self.read_blocks(first + count - 1, 1)
+            data[offset:offset + length] = view
+            self.write_blocks(first, data)
+        self._pos += length
+        return length
+
+    def invalidate(self):
+        """Drops all cached blocks.
+
+        """
+        self._cache.clear()
@@ -0,0 +1,308 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import struct
+import time
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Ring header: magic, version, slot size, slot count, next sequence number.
+_HEADER      = struct.Struct('<4sIIIQ')
+_HEADER_SIZE = 64
+_MAGIC       = b'CP2R'
+_VERSION     = 1
+
+# Slot header: sequence number, data length.
+_SLOT        = struct.Struct('<QI')
+_SLOT_SIZE   = 16
+_WRITING     = 0xFFFFFFFFFFFFFFFF
+
+class SharedRingBuffer(object):
+
+    def __init__(self, name=None, slot_size=65536, slots=64, create=True):
+        """A single-producer, multi-consumer ring of fixed-size slots in
+        shared memory, for handing streamed SPI data to other
+        processes without pickling.
+
+        Every chunk written gets a sequence number. The producer
+        never waits for consumers; a consumer that falls more than
+        'slots' chunks behind detects the overrun, skips to the
+        oldest chunk still available and counts the chunks lost.
+
+        Requires Python 3.8 or later.
+
+        :param: name The name of the shared memory block, or None to
+                     generate one when creating.
+        :param: slot_size The maximum number of bytes per chunk.
+        :param: slots The number of slots in the ring.
+        :param: create True to create the block, False to attach to an
+                       existing one, in which case slot_size and slots
+                       are read from it.
+        :raises: An ImportError if multiprocessing.shared_memory is not
+                 available.
+
+        """
+        if shared_memory is None:
+            raise ImportError("SharedRingBuffer requires multiprocessing.shared_memory (Python 3.8+)")
+
+        if create:
+            size = _HEADER_SIZE + slots * (_SLOT_SIZE + slot_size)
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            _HEADER.pack_into(self._shm.buf, 0, _MAGIC, _VERSION, slot_size, slots, 0)
+            for i in range(slots):
+                _SLOT.pack_into(self._shm.buf, self._slot_offset_for(i, slot_size), _WRITING, 0)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            (magic, version, slot_size, slots, _) = _HEADER.unpack_from(self._shm.buf, 0)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("%s is not a compatible ring buffer"%name)
+
+        self.slot_size = slot_size
+        self.slots     = slots
+        self._owner    = create
+        self._reserved = None
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to an existing ring buffer created by another process.
+
+        """
+        return cls(name, create=False)
+
+    def __repr__(self):
+        return "SharedRingBuffer(%r)"%(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        if self._owner:
+            self.unlink()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def sequence(self):
+        """The sequence number of the next chunk to be written.
+
+        """
+        return _HEADER.unpack_from(self._shm.buf, 0)[4]
+
+    def close(self):
+        """Detaches from the shared memory block.
+
+        """
+        self._shm.close()
+
+    def unlink(self):
+        """Destroys the shared memory block. Call once, from the creator,
+        after all processes have closed it.
+
+        """
+        self._shm.unlink()
+
+    @staticmethod
+    def _slot_offset_for(index, slot_size):
+        return _HEADER_SIZE + index * (_SLOT_SIZE + slot_size)
+
+    def _slot_offset(self, seq):
+        return self._slot_offset_for(seq % self.slots, self.slot_size)
+
+    # ------------------------------- Producer ------------------------------
+    def reserve(self):
+        """Reserves the next slot for writing in place.
+
+        :return: A writable memoryview of the slot's data area. Fill it and
+                 call commit() with the number of bytes written.
+
+        """
+        seq = self.sequence
+        offset = self._slot_offset(seq)
+        _SLOT.pack_into(self._shm.buf, offset, _WRITING, 0)
+        self._reserved = seq
+        start = offset + _SLOT_SIZE
+        return self._shm.buf[start:start + self.slot_size]
+
+    def commit(self, length):
+        """Publishes the slot returned by reserve().
+
+        :return: The sequence number of the chunk.
+
+        """
+        seq = self._reserved
+        if seq is None:
+            raise ValueError("No slot is reserved")
+        if not (0 <= length <= self.slot_size):
+            raise ValueError("Length must be between 0 and %d"%self.slot_size)
+        _SLOT.pack_into(self._shm.buf, self._slot_offset(seq), seq, length)
+        struct.pack_into('<Q', self._shm.buf, _HEADER.size - 8, seq + 1)
+        self._reserved = None
+        return seq
+
+    def write(self, data):
+        """Copies a chunk into the next slot and publishes it.
+
+        :return: The sequence number of the chunk.
+
+        """
+        view = self.reserve()
+        length = len(data)
+        view[:length] = data
+        return self.commit(length)
+
+    def stream(self, channel, chunk_size=None, chunks=None):
+        """Reads chunks from an SPI channel straight into the ring, each
+        received directly into its reserved slot.
+
+        :param: channel The cp2130.spi.SPIChannel to read.
+        :param: chunk_size The number of bytes per read, at most the slot
+                           size.
+        :param: chunks The number of chunks to read, or None to read
+                       forever.
+
+        """
+        chunk_size = chunk_size or self.slot_size
+        if chunk_size > self.slot_size:
+            raise ValueError("chunk_size exceeds the slot size")
+        count = 0
+        while chunks is None or count < chunks:
+            view = self.reserve()
+            try:
+                with view[:chunk_size] as chunk:
+                    length = channel.readinto(chunk)
+            finally:
+                view.release()
+            self.commit(length)
+            count += 1
+
+    # ------------------------------- Consumer ------------------------------
+    def reader(self, start='latest'):
+        """Returns a new RingReader with an independent position.
+
+        :param: start 'latest' to begin with the next chunk written, or
+                      'oldest' to begin with the oldest chunk still
+                      available.
+
+        """
+        return RingReader(self, start)
+
+class RingReader(object):
+
+    def __init__(self, ring, start='latest', poll_interval=0.0005):
+        """A consumer of a SharedRingBuffer.
+
+        :param: ring The SharedRingBuffer.
+        :param: start 'latest' or 'oldest'.
+        :param: poll_interval The time in seconds between checks for new
+                              data while blocking.
+
+        """
+        self.ring          = ring
+        self.poll_interval = poll_interval
+        self.overruns      = 0
+        self.lost          = 0
+
+        seq = ring.sequence
+        if start == 'oldest':
+            seq = max(0, seq - ring.slots)
+        elif start != 'latest':
+            raise ValueError("start must be 'latest' or 'oldest'")
+        self.position = seq
+
+    def __repr__(self):
+        return "RingReader(%r)"%(self.ring)
+
+    def available(self):
+        """The number of chunks written but not yet read.
+
+        """
+        return self.ring.sequence - self.position
+
+    def _wait(self, block, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while self.ring.sequence <= self.position:
+            if not block or (deadline is not None and time.time() >= deadline):
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def _skip_overrun(self):
+        oldest = self.ring.sequence - self.ring.slots
+        if self.position < oldest:
+            self.overruns += 1
+            self.lost += oldest - self.position
+            self.position = oldest
+
+    def read_view(self, block=True, timeout=None):
+        """Returns the next chunk without copying it.
+
+        The view refers to the slot in shared memory and is only valid
+        until the producer wraps around to that slot again. Check
+        still_valid() after consuming it.
+
+        :return: A (sequence, memoryview) tuple, or None if no chunk is
+                 available within the timeout.
+
+        """
+        while True:
+            if not self._wait(block, timeout):
+                return None
+            self._skip_overrun()
+            seq = self.position
+            offset = self.ring._slot_offset(seq)
+            (slot_seq, length) = _SLOT.unpack_from(self.ring._shm.buf, offset)
+            if slot_seq != seq:
+                # Overwritten since the overrun check; skip ahead again.
+                self.position += 1
+                self.overruns += 1
+                self.lost += 1
+                continue
+            self.position += 1
+            start = offset + _SLOT_SIZE
+            return (seq, self.ring._shm.buf[start:start + length])
+
+    def still_valid(self, seq):
+        """True if the chunk with the given sequence number has not been
+        overwritten.
+
+        """
+        (slot_seq, _) = _SLOT.unpack_from(self.ring._shm.buf, self.ring._slot_offset(seq))
+        return slot_seq == seq
+
+    def read(self, block=True, timeout=None):
+        """Returns a copy of the next chunk.
+
+        :return: A (sequence, bytes) tuple, or None if no chunk is
+                 available within the timeout.
+
+        """
+        while True:
+            item = self.read_view(block, timeout)
+            if item is None:
+                return None
+            (seq, view) = item
+            data = bytes(view)
+            view.release()
+            if self.still_valid(seq):
+                return (seq, data)
+            self.overruns += 1
+            self.lost += 1
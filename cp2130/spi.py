@@ -14,8 +14,12 @@
 
 from __future__ import absolute_import
 
+import time
+
+from cp2130.chip import registers
 from cp2130.data.gpio import *
 from cp2130.data.spi import *
+from cp2130.transaction import Transaction
 
 class SPIChannel(object):
 
@@ -81,6 +85,19 @@ class SPIChannel(object):
         op = lambda: self.chip.read(length)
         return self._do(op, cs_hold)
 
+    def readinto(self, buffer, cs_hold = False):
+        """Reads len(buffer) bytes from the channel into a preallocated,
+        writable buffer.
+
+        :param: cs_hold True if the CS should remain asserted after
+                        the read completes. This option is only
+                        supported by some implementations.
+        :return: The number of bytes read.
+
+        """
+        op = lambda: self.chip.readinto(buffer)
+        return self._do(op, cs_hold)
+
     def write(self, data, cs_hold = False):
         """Writes the specified data from the channel.
 
@@ -104,6 +121,91 @@ class SPIChannel(object):
         op = lambda: self.chip.write_read(data)
         return self._do(op, cs_hold)
 
+    def read_samples(self, format, frames):
+        """Reads and decodes packed samples from the channel.
+
+        :param: format The cp2130.codec.SampleFormat of the samples.
+        :param: frames The number of frames (one sample per channel) to
+                       read.
+        :return: The decoded samples, as returned by format.decode().
+
+        """
+        data = self.read(format.nbytes(frames))
+        return format.decode(data)
+
+    def transaction(self, fill=0x00):
+        """Returns a new, empty cp2130.transaction.Transaction bound to this
+        channel.
+
+        :param: fill The byte clocked out on MOSI during reads.
+
+        """
+        return Transaction(self, fill)
+
+    def execute(self, transaction):
+        """Executes a cp2130.transaction.Transaction as one unit, asserting
+        the chip-select once for the whole exchange.
+
+        :return: A list with the data for each read and write_read step,
+                 in the order they were queued.
+
+        """
+        segments = transaction.compile()
+        op = lambda: self._run(segments)
+        return self._do(op, False)
+
+    def qualify_clock(self, verify, **kwargs):
+        """Finds the fastest clock frequency at which the slave works
+        reliably. See cp2130.qualify.qualify_clock() for the options.
+
+        :param: verify A function called with this channel that performs a
+                       transfer and returns True if the result is correct.
+        :return: A cp2130.qualify.ClockQualification.
+
+        """
+        from cp2130.qualify import qualify_clock
+        return qualify_clock(self, verify, **kwargs)
+
+    def cost_model(self, overhead=None):
+        """Returns a cp2130.cost.CostModel predicting transfer times on this
+        channel from its current settings.
+
+        :param: overhead The cp2130.cost.USBOverhead, e.g., from
+                         cp2130.cost.calibrate(), or None for the defaults.
+
+        """
+        from cp2130.cost import CostModel
+        return CostModel.from_channel(self, overhead)
+
+    def _run(self, segments):
+        """Issues the bulk commands for compiled transaction segments. The
+        chip-select must already be asserted.
+
+        """
+        results = []
+        for segment in segments:
+            if not segment.data:
+                data = None
+            elif segment.read_only:
+                data = self.chip.read(len(segment.data))
+            elif segment.reads:
+                data = self.chip.write_read(segment.data)
+            else:
+                data = self.chip.write(segment.data)
+            for (offset, length) in segment.reads:
+                results.append(data[offset:offset + length])
+            if segment.delay:
+                time.sleep(segment.delay)
+            if segment.toggle:
+                self._toggle()
+        return results
+
+    def _toggle(self):
+        """Deasserts and reasserts the chip-select between two bulk commands
+        of a transaction.
+
+        """
+
     @property
     def spi_mode(self):
         """Get or set the SPI mode.
@@ -290,11 +392,18 @@ class SPIChannelCS(SPIChannel):
     def _do(self, op, cs_hold):
         if cs_hold:
             raise NotImplementedError("cs_hold is not supported by the CP2130 native chip-select capability.")
-        try:
-            self.gpio.cs_enable = ChipSelectControl.ENABLED_EXCLUSIVE
-            return op()
-        finally:
-            self.gpio.cs_enable = ChipSelectControl.DISABLED
+        with self.chip.transaction():
+            try:
+                self.gpio.cs_enable = ChipSelectControl.ENABLED_EXCLUSIVE
+                return op()
+            finally:
+                self.gpio.cs_enable = ChipSelectControl.DISABLED
+
+    def _toggle(self):
+        # Disabling the chip-select guarantees it is deasserted between
+        # the two bulk commands, whatever the chip does at their ends.
+        self.gpio.cs_enable = ChipSelectControl.DISABLED
+        self.gpio.cs_enable = ChipSelectControl.ENABLED_EXCLUSIVE
 
 class SPIChannelGPIO(SPIChannel):
     """An SPI device addressed using a manually-controlled GPIO on the
@@ -308,11 +417,138 @@ class SPIChannelGPIO(SPIChannel):
     asserted after the transfer. This is useful if a logic transaction
     is made up of multiple transfers.
 
+    While the CS is held, the calling thread retains exclusive access
+    to the device. Other threads block until a transfer without
+    cs_hold releases the CS.
+
     """
+    def __init__(self, master, cs_num):
+        super(SPIChannelGPIO, self).__init__(master, cs_num)
+        self._held = 0
+
     def _do(self, op, cs_hold):
+        transaction = self.chip.transaction()
+        transaction.acquire()
+        held = False
         try:
             self.gpio.value = LogicLevel.LOW
-            return op()
+            result = op()
+            held = cs_hold
+            return result
         finally:
-            if not cs_hold:
-                self.gpio.value = LogicLevel.HIGH
+            # A failed transfer releases the CS and the device even if
+            # cs_hold was requested.
+            if held:
+                self._held += 1
+            else:
+                try:
+                    self.gpio.value = LogicLevel.HIGH
+                finally:
+                    # Also release the acquisitions left outstanding by
+                    # earlier cs_hold transfers on this channel.
+                    for _ in range(self._held + 1):
+                        transaction.release()
+                    self._held = 0
+
+    def _toggle(self):
+        self.gpio.value = LogicLevel.HIGH
+        self.gpio.value = LogicLevel.LOW
+
+class ChannelGroup(object):
+
+    def __init__(self, channels):
+        """A set of SPI channels written to at once, e.g., several identical
+        slaves that receive the same configuration.
+
+        All chip-selects of the group are asserted together and the
+        data is sent with a single bulk write. Native chip-selects are
+        enabled non-exclusively, the first exclusively so any stray
+        enable is cleared at no cost; GPIO chip-selects are driven
+        with one masked write.
+
+        The CP2130 clocks the transfer with the SPI word settings of
+        one channel, so the members must share the same SPI mode and
+        clock frequency. Reading is not supported, as the slaves would
+        drive MISO at the same time.
+
+        :param: channels The SPIChannel instances, all of the same master.
+        :raises: A ValueError if the channels belong to different masters
+                 or have different SPI word settings.
+
+        """
+        channels = sorted(channels, key=lambda channel: channel.cs_num)
+        if not channels:
+            raise ValueError("A channel group needs at least one channel")
+        master = channels[0].master
+        if any(channel.master is not master for channel in channels):
+            raise ValueError("All channels of a group must belong to the same device")
+        if len(set(channel.cs_num for channel in channels)) != len(channels):
+            raise ValueError("A channel appears more than once")
+
+        self.master   = master
+        self.chip     = master.chip
+        self.channels = channels
+        self.native   = [channel for channel in channels if not isinstance(channel, SPIChannelGPIO)]
+        self.manual   = [channel for channel in channels if isinstance(channel, SPIChannelGPIO)]
+
+        words = self.chip.get_spi_words()
+        if len(set(words[channel.cs_num].raw for channel in channels)) > 1:
+            raise ValueError("All channels of a group must have the same SPI mode and clock frequency")
+
+    def __repr__(self):
+        return "ChannelGroup(%r)"%(self.channels)
+
+    def _set_manual(self, level):
+        if self.manual:
+            reg = registers.gpio_values_setter.default()
+            for channel in self.manual:
+                reg.set_level(channel.cs_num, level)
+            self.chip.set_gpio_values(reg)
+
+    def _do(self, op):
+        with self.chip.transaction():
+            enabled = []
+            try:
+                control = ChipSelectControl.ENABLED_EXCLUSIVE
+                for channel in self.native:
+                    cs = registers.one_gpio_chip_select.make(control)
+                    self.chip.set_gpio_chip_select(channel.cs_num, cs)
+                    enabled.append(channel)
+                    control = ChipSelectControl.ENABLED
+                self._set_manual(LogicLevel.LOW)
+                return op()
+            finally:
+                try:
+                    self._set_manual(LogicLevel.HIGH)
+                finally:
+                    disabled = registers.one_gpio_chip_select.make(ChipSelectControl.DISABLED)
+                    for channel in enabled:
+                        self.chip.set_gpio_chip_select(channel.cs_num, disabled)
+
+    def write(self, data):
+        """Writes the data to every channel of the group with one bulk write.
+
+        """
+        return self._do(lambda: self.chip.write(data))
+
+    def execute(self, transaction):
+        """Executes a write-only cp2130.transaction.Transaction on every
+        channel of the group at once.
+
+        :raises: A ValueError if the transaction reads.
+
+        """
+        segments = transaction.compile()
+        if any(segment.reads or (segment.data and segment.read_only) for segment in segments):
+            raise ValueError("A channel group cannot read")
+
+        def run():
+            for segment in segments:
+                if segment.data:
+                    self.chip.write(segment.data)
+                if segment.delay:
+                    time.sleep(segment.delay)
+                if segment.toggle:
+                    self._set_manual(LogicLevel.HIGH)
+                    self._set_manual(LogicLevel.LOW)
+        self._do(run)
@@ -0,0 +1,238 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+from cp2130.chip import registers
+from cp2130.data import ChipSelectControl, OutputMode
+
+CHANNELS = 11
+
+class ChipState(object):
+
+    __slots__ = ('_spi_words', '_spi_delays', '_gpio_mode_and_level',
+                 '_gpio_chip_select', '_clock_divider', '_event_counter',
+                 '_full_threshold', '_outputs')
+
+    def __init__(self, spi_words, spi_delays, gpio_mode_and_level,
+                 gpio_chip_select, clock_divider, event_counter,
+                 full_threshold, outputs):
+        """An immutable snapshot of the volatile runtime configuration of a
+        CP2130, as returned by CP2130.snapshot().
+
+        The registers are stored as raw bytes, so a state is cheap to
+        compare, hash and pickle. The accessors return fresh register
+        objects; modifying them does not change the state.
+
+        Only the GPIOs in outputs, those whose pin function is an
+        output, have their modes and levels restored. The levels
+        recorded for inputs and chip-selects are those seen on the
+        pins, not latches to drive.
+
+        """
+        object.__setattr__(self, '_spi_words',           tuple(spi_words))
+        object.__setattr__(self, '_spi_delays',          tuple(spi_delays))
+        object.__setattr__(self, '_gpio_mode_and_level', gpio_mode_and_level)
+        object.__setattr__(self, '_gpio_chip_select',    gpio_chip_select)
+        object.__setattr__(self, '_clock_divider',       clock_divider)
+        object.__setattr__(self, '_event_counter',       event_counter)
+        object.__setattr__(self, '_full_threshold',      full_threshold)
+        object.__setattr__(self, '_outputs',             tuple(sorted(outputs)))
+
+    @classmethod
+    def read(cls, chip):
+        """Reads the state from a device, reading each register once.
+
+        :param: chip The cp2130.chip.CP2130Chip to read.
+
+        """
+        with chip.transaction():
+            pin_config = chip.get_pin_config()
+            outputs    = [num for num in range(CHANNELS)
+                          if getattr(pin_config, 'gpio%d'%num) in [OutputMode.PUSH_PULL, OutputMode.OPEN_DRAIN]]
+            spi_words  = [reg.raw for reg in chip.get_spi_words()]
+            spi_delays = [chip.get_spi_delay(num).raw for num in range(CHANNELS)]
+            return cls(spi_words, spi_delays,
+                       chip.get_gpio_mode_and_level().raw,
+                       chip.get_gpio_chip_select().raw,
+                       chip.get_clock_divider().raw,
+                       chip.get_event_counter().raw,
+                       chip.get_full_threshold().raw,
+                       outputs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ChipState is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ChipState is immutable")
+
+    def _key(self):
+        return (self._spi_words, self._spi_delays, self._gpio_mode_and_level,
+                self._gpio_chip_select, self._clock_divider,
+                self._event_counter_raw_mode(), self._full_threshold,
+                self._outputs)
+
+    def __eq__(self, other):
+        return isinstance(other, ChipState) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        return (self._spi_words, self._spi_delays, self._gpio_mode_and_level,
+                self._gpio_chip_select, self._clock_divider,
+                self._event_counter, self._full_threshold, self._outputs)
+
+    def __setstate__(self, state):
+        ChipState.__init__(self, *state)
+
+    def __repr__(self):
+        return "ChipState()"
+
+    def __str__(self):
+        lines = ["ChipState"]
+        for num in range(CHANNELS):
+            word  = self.spi_word(num)
+            delay = self.spi_delay(num)
+            (mode, level) = self.gpio_mode_and_level(num)
+            lines.append("  gpio%-2d %s %s cs=%s %s %s %s Hz, delays=%d/%d/%d"%(
+                num, mode, level, self.cs_enabled(num), word.clock_phase,
+                word.clock_polarity, word.clock_frequency,
+                delay.inter_byte_delay_10us, delay.post_assert_delay_10us,
+                delay.pre_deassert_delay_10us))
+        lines.append("  clock_divider:      %d"%self.clock_divider)
+        lines.append("  event_counter_mode: %s"%self.event_counter_mode)
+        lines.append("  full_threshold:     %d"%self.full_threshold)
+        return "\n".join(lines)
+
+    def spi_word(self, num):
+        """Gets a copy of the spi_word register of a channel.
+
+        """
+        return registers.spi_word(self._spi_words[num])
+
+    def spi_delay(self, num):
+        """Gets a copy of the spi_delay register of a channel.
+
+        """
+        return registers.spi_delay(self._spi_delays[num])
+
+    def gpio_mode_and_level(self, num):
+        """Gets the (mode, level) tuple of a GPIO.
+
+        """
+        reg = registers.all_gpio_mode_and_level(self._gpio_mode_and_level)
+        return (reg.mode(num), reg.level(num))
+
+    def is_output(self, num):
+        """True if the pin function of a GPIO is an output.
+
+        """
+        return num in self._outputs
+
+    def cs_enabled(self, num):
+        """True if the chip-select of a channel is enabled.
+
+        """
+        reg = registers.all_gpio_chip_select(self._gpio_chip_select)
+        return getattr(reg, 'channel%d_enable'%num)
+
+    @property
+    def clock_divider(self):
+        return registers.clock_divider(self._clock_divider).clock_divider
+
+    def _event_counter_raw_mode(self):
+        return bytearray(self._event_counter)[0] & 0x07
+
+    @property
+    def event_counter_mode(self):
+        """The event counter mode, or None if GPIO.4 is not configured as an
+        event counter.
+
+        """
+        if self._event_counter_raw_mode() < 4:
+            return None
+        return registers.event_counter(self._event_counter).mode
+
+    @property
+    def full_threshold(self):
+        return registers.full_threshold(self._full_threshold).threshold
+
+    def apply(self, chip, current=None):
+        """Writes the registers of this state that differ from another state,
+        normally the device's current one.
+
+        GPIO levels that change without a mode change are written
+        together with one masked write. GPIOs whose pin function is
+        not an output are left alone. Writing the event counter
+        mode resets the count, so it is only written if the mode
+        differs.
+
+        :param: chip The cp2130.chip.CP2130Chip to write.
+        :param: current The device's current ChipState, or None to read it.
+        :return: The number of control transfers written.
+
+        """
+        writes = 0
+        with chip.transaction():
+            if current is None:
+                current = ChipState.read(chip)
+
+            for num in range(CHANNELS):
+                if self._spi_words[num] != current._spi_words[num]:
+                    chip.set_spi_word(num, self.spi_word(num))
+                    writes += 1
+                if self._spi_delays[num] != current._spi_delays[num]:
+                    chip.set_spi_delay(num, self.spi_delay(num))
+                    writes += 1
+
+            levels = registers.gpio_values_setter.default()
+            changed = False
+            for num in self._outputs:
+                if not current.is_output(num):
+                    continue
+                (mode, level) = self.gpio_mode_and_level(num)
+                (cur_mode, cur_level) = current.gpio_mode_and_level(num)
+                if mode != cur_mode:
+                    chip.set_gpio_mode_and_level(num, registers.one_gpio_mode_and_level.make(mode, level))
+                    writes += 1
+                elif level != cur_level:
+                    levels.set_level(num, level)
+                    changed = True
+            if changed:
+                chip.set_gpio_values(levels)
+                writes += 1
+
+            for num in range(CHANNELS):
+                enabled = self.cs_enabled(num)
+                if enabled != current.cs_enabled(num):
+                    control = ChipSelectControl.ENABLED if enabled else ChipSelectControl.DISABLED
+                    chip.set_gpio_chip_select(num, registers.one_gpio_chip_select.make(control))
+                    writes += 1
+
+            if self._clock_divider != current._clock_divider:
+                chip.set_clock_divider(registers.clock_divider(self._clock_divider))
+                writes += 1
+            if self._event_counter_raw_mode() != current._event_counter_raw_mode():
+                raw = bytearray(len(self._event_counter))
+                raw[0] = self._event_counter_raw_mode()
+                chip.set_event_counter(registers.event_counter(bytes(raw)))
+                writes += 1
+            if self._full_threshold != current._full_threshold:
+                chip.set_full_threshold(registers.full_threshold(self._full_threshold))
+                writes += 1
+        return writes
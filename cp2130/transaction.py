@@ -0,0 +1,167 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import six
+
+class Segment(object):
+
+    def __init__(self, data, reads, read_only, delay, toggle):
+        """A run of steps executed as a single bulk command.
+
+        :param: data The bytes clocked out on MOSI.
+        :param: reads A list of (offset, length) slices of the MISO
+                      data to return.
+        :param: read_only True if the segment contains only reads, so
+                          no MOSI data need be sent.
+        :param: delay The time in seconds to wait after the command.
+        :param: toggle True if the chip-select should be deasserted and
+                       reasserted after the command.
+
+        """
+        self.data      = data
+        self.reads     = reads
+        self.read_only = read_only
+        self.delay     = delay
+        self.toggle    = toggle
+
+    def __repr__(self):
+        return "Segment(%r, %r, %r, %r, %r)"%(self.data, self.reads, self.read_only, self.delay, self.toggle)
+
+class Transaction(object):
+
+    def __init__(self, channel=None, fill=0x00):
+        """A builder for a logical SPI exchange made up of several steps.
+
+        Steps are queued with write(), read(), write_read(), delay()
+        and boundary(), then executed as one unit with execute().
+        Consecutive steps are compiled into a single full-duplex bulk
+        command with the chip-select asserted once, so a "write
+        command, read N bytes" exchange costs one bulk command rather
+        than two.
+
+        :param: channel The cp2130.spi.SPIChannel to execute on. May be
+                        omitted if the transaction is passed to
+                        SPIChannel.execute() instead.
+        :param: fill The byte clocked out on MOSI during reads.
+
+        """
+        self.channel = channel
+        self.fill    = fill
+        self._steps  = []
+
+    def __repr__(self):
+        return "Transaction(%r, %r)"%(self.channel, self.fill)
+
+    def __len__(self):
+        return len(self._steps)
+
+    def write(self, data):
+        """Queues a write of the given data.
+
+        """
+        self._steps.append(('write', bytes(bytearray(data))))
+        return self
+
+    def read(self, length):
+        """Queues a read of the specified number of bytes.
+
+        """
+        self._steps.append(('read', length))
+        return self
+
+    def write_read(self, data):
+        """Queues a simultaneous write of the given data and read of the
+        same number of bytes.
+
+        """
+        self._steps.append(('write_read', bytes(bytearray(data))))
+        return self
+
+    def delay(self, seconds):
+        """Queues a delay. The chip-select remains asserted across the delay
+        for GPIO chip-selects. The native chip-select is deasserted
+        between bulk commands, so it is released during the delay.
+
+        """
+        self._steps.append(('delay', seconds))
+        return self
+
+    def boundary(self):
+        """Queues a chip-select deassertion and reassertion, e.g., to
+        terminate one slave command before starting the next.
+
+        """
+        self._steps.append(('boundary', None))
+        return self
+
+    def compile(self):
+        """Compiles the queued steps into the fewest bulk commands.
+
+        :return: A list of Segment instances.
+
+        """
+        segments = []
+        fill = six.int2byte(self.fill)
+
+        data   = []
+        reads  = []
+        size   = 0
+        writes = False
+        for (kind, arg) in self._steps:
+            if kind == 'write':
+                data.append(arg)
+                size += len(arg)
+                writes = True
+            elif kind == 'read':
+                data.append(fill * arg)
+                reads.append((size, arg))
+                size += arg
+            elif kind == 'write_read':
+                data.append(arg)
+                reads.append((size, len(arg)))
+                size += len(arg)
+                writes = True
+            elif size > 0:
+                segments.append(Segment(b''.join(data), reads, not writes, 0, False))
+                (data, reads, size, writes) = ([], [], 0, False)
+
+            if kind == 'delay':
+                if not segments:
+                    segments.append(Segment(b'', [], False, 0, False))
+                segments[-1].delay += arg
+            elif kind == 'boundary' and segments:
+                segments[-1].toggle = True
+
+        if size > 0:
+            segments.append(Segment(b''.join(data), reads, not writes, 0, False))
+
+        # The chip-select is deasserted at the end of the transaction
+        # anyway, so a trailing boundary is redundant.
+        if segments:
+            segments[-1].toggle = False
+
+        return segments
+
+    def execute(self):
+        """Executes the transaction on the channel as one unit.
+
+        :return: A list with the data for each read and write_read step,
+                 in the order they were queued.
+
+        """
+        if self.channel is None:
+            raise ValueError("Transaction is not bound to a channel")
+        return self.channel.execute(self)
@@ -15,3 +15,37 @@
 from __future__ import absolute_import
 
 from cp2130.usb.usb import NoDeviceError, NoHotplugSupportError, USBDevice
+
+import importlib
+import os
+
+# The USB backends, in order of preference. python-libusb1 calls
+# libusb directly through ctypes, with fewer layers per transfer than
+# PyUSB, and both read into caller buffers without a copy. Neither
+# has been benchmarked against the other.
+BACKENDS = ('libusb1', 'pyusb')
+
+def backend(name=None):
+    """Returns a USB backend module, e.g., cp2130.usb.libusb1.
+
+    :param: name The backend to use, one of BACKENDS, or None to use the
+                 CP2130_USB_BACKEND environment variable if set, else
+                 the first backend available.
+    :raises: A ValueError if the name is unknown, or an ImportError if
+             the backend, or every backend, is unavailable.
+
+    """
+    name = name or os.environ.get('CP2130_USB_BACKEND')
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError("Unknown USB backend %r; expected one of %s"%(name, ", ".join(BACKENDS)))
+        return importlib.import_module('cp2130.usb.%s'%name)
+
+    errors = []
+    for name in BACKENDS:
+        try:
+            return importlib.import_module('cp2130.usb.%s'%name)
+        except (ImportError, OSError) as e:
+            # OSError if the library is installed but libusb is not.
+            errors.append("%s: %s"%(name, e))
+    raise ImportError("No USB backend is available (%s)"%"; ".join(errors))
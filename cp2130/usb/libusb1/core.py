@@ -15,11 +15,15 @@
 from __future__ import absolute_import
 
 from cp2130.usb.usb import NoDeviceError, NoHotplugSupportError, USBDevice
-from cp2130.usb.libusb1.hotplug import HotplugListener, HotpluggedDevice
+from cp2130.usb.libusb1.hotplug import HotplugListener, HotpluggedDevice, port_path
 
 import array
+import ctypes
+import time
 import usb1
 
+from six.moves import queue
+
 def hotplug(vid, pid, on_new_device):
     def create_device(device):
         dev = find_exact(device.getBusNumber(), device.getDeviceAddress())
@@ -30,27 +34,63 @@ def hotplug(vid, pid, on_new_device):
     listener.start()
     return listener
 
-def find(vid, pid):
+def find(vid, pid, serial=None, timeout=1000):
     """Finds the first USB device with the given vendor id and product id.
 
     :param: vid The vendor id to match.
     :param: pid The product id to match.
+    :param: serial The serial number to match, or None to match any.
+    :param: timeout The transfer timeout in milliseconds.
     :return: A LibUSB1Device instance wrapping the matched device.
     :raises: A NoDeviceError error if no matching device is found.
     """
     context = usb1.USBContext()
 
-    handle = context.openByVendorIDAndProductID(vid, pid, skip_on_error = True)
+    if serial is None:
+        handle = context.openByVendorIDAndProductID(vid, pid, skip_on_error = True)
+    else:
+        handle = None
+        for d in context.getDeviceList(skip_on_error=True):
+            if d.getVendorID() == vid and d.getProductID() == pid:
+                h = d.open()
+                if h.getSerialNumber() == serial:
+                    handle = h
+                    break
+                h.close()
+
     if handle is None:
-        raise NoDeviceError("No device with vendor %s and product %s"%(vid, pid))
+        context.close()
+        raise NoDeviceError("No device with vendor %s, product %s and serial %s"%(vid, pid, serial))
+
+    return LibUSB1Device(context, handle, timeout)
+
+def find_all(vid, pid, timeout=1000):
+    """Finds all USB devices with the given vendor id and product id.
+
+    Each device is opened with its own context, so the returned
+    devices may be used concurrently from different threads.
+
+    :param: vid The vendor id to match.
+    :param: pid The product id to match.
+    :param: timeout The transfer timeout in milliseconds.
+    :return: A list of LibUSB1Device instances, possibly empty.
+    """
+    context = usb1.USBContext()
+    try:
+        locations = [(d.getBusNumber(), d.getDeviceAddress())
+                     for d in context.getDeviceList(skip_on_error=True)
+                     if d.getVendorID() == vid and d.getProductID() == pid]
+    finally:
+        context.close()
 
-    return LibUSB1Device(context, handle)
+    return [find_exact(bus, address, timeout) for (bus, address) in locations]
 
-def find_exact(bus, address):
+def find_exact(bus, address, timeout=1000):
     """Finds the USB device on the given bus at the given address.
 
     :param: bus The bus the device is on.
     :param: address The address of the device on the bus.
+    :param: timeout The transfer timeout in milliseconds.
     :return: A LibUSB1Device instance wrapping the matched device.
     :raises: A NoDeviceError error if no matching device is found.
     """
@@ -59,19 +99,23 @@ def find_exact(bus, address):
     for d in context.getDeviceList(skip_on_error=True):
         if d.getBusNumber() == bus and d.getDeviceAddress() == address:
             handle = d.open()
-            return LibUSB1Device(context, handle)
+            return LibUSB1Device(context, handle, timeout)
 
     raise NoDeviceError("No device with bus %d and address %d"%(bus, address))
 
 class LibUSB1Device(USBDevice, HotpluggedDevice):
 
-    def __init__(self, context, handle):
+    def __init__(self, context, handle, timeout=1000):
         """An abstraction of a USB device accessed via the libusb1 library.
 
+        :param: context The usb1.USBContext owning the handle.
+        :param: handle The open usb1.USBDeviceHandle.
+        :param: timeout The transfer timeout in milliseconds.
+
         """
         HotpluggedDevice.__init__(self, handle.getDevice())
 
-        self.timeout = 1000
+        self.timeout = timeout
         self.context = context
         self.handle = handle
 
@@ -83,13 +127,103 @@ class LibUSB1Device(USBDevice, HotpluggedDevice):
     def close(self):
         HotpluggedDevice.close(self)
 
-        self.handle.releaseInterface(0)
+        try:
+            self.handle.releaseInterface(0)
+        except usb1.USBErrorNoDevice:
+            pass
         self.handle.close()
         self.handle = None
 
         self.context.close()
         self.context = None
 
+    def reenumerate(self, reset, timeout=5.0):
+        """Resets the device and waits for the same physical device to
+        leave the bus and arrive again.
+
+        Departures and arrivals are reported by a hotplug listener
+        registered before the reset, so the new device is opened as
+        soon as it enumerates. The bus is also rescanned periodically,
+        in case hotplug events are unsupported or raced the listener's
+        registration. The device is recognized by its port path, or
+        its serial number if no port numbers are available, whatever
+        its new address.
+
+        """
+        (vid, pid, address, path) = (self.vid, self.pid, self.address, self.port_path)
+        serial = None
+        if len(path) == 1:
+            # No port numbers available, so fall back to the serial.
+            serial = self.handle.getSerialNumber()
+
+        def is_old(new_address, new_path):
+            return new_path == path and (serial is None or new_address == address)
+
+        def is_candidate(new_address, new_path):
+            return new_path == path if serial is None else new_path[0] == path[0]
+
+        events = queue.Queue()
+        def on_arrived(device):
+            events.put((True, device.getDeviceAddress(), port_path(device)))
+        def on_left(device):
+            events.put((False, device.getDeviceAddress(), port_path(device)))
+
+        listener = HotplugListener(vid, pid, on_arrived, on_left)
+        try:
+            listener.start()
+            poll_interval = 0.05
+        except NoHotplugSupportError:
+            listener = None
+            poll_interval = 0.01
+
+        context = usb1.USBContext()
+        try:
+            try:
+                reset()
+            except usb1.USBError:
+                # The device may drop off the bus before acknowledging.
+                pass
+            self.close()
+
+            gone = False
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                try:
+                    (arrived, new_address, new_path) = events.get(timeout=poll_interval)
+                    if not arrived:
+                        gone = gone or is_old(new_address, new_path)
+                        continue
+                    candidates = [(new_address, new_path)]
+                except queue.Empty:
+                    candidates = [(d.getDeviceAddress(), port_path(d))
+                                  for d in context.getDeviceList(skip_on_error=True)
+                                  if d.getVendorID() == vid and d.getProductID() == pid]
+                    # Gone if the old instance is no longer listed, e.g.,
+                    # the port now has a device at another address.
+                    gone = gone or (address, path) not in candidates
+                if not gone:
+                    continue
+
+                for (new_address, new_path) in candidates:
+                    if not is_candidate(new_address, new_path):
+                        continue
+                    try:
+                        dev = find_exact(new_path[0], new_address, self.timeout)
+                    except (NoDeviceError, usb1.USBError):
+                        # Not yet accessible, e.g., permissions not yet applied.
+                        time.sleep(0.005)
+                        events.put((True, new_address, new_path))
+                        continue
+                    if serial is None or dev.handle.getSerialNumber() == serial:
+                        return dev
+                    dev.close()
+        finally:
+            if listener is not None:
+                listener.stop()
+            context.close()
+
+        raise NoDeviceError("Device at %s did not re-enumerate within %s s"%(path, timeout))
+
     def endpoints(self):
         """Gets all the endpoint addresses supported by the underlying device.
 
@@ -116,6 +250,22 @@ class LibUSB1Device(USBDevice, HotpluggedDevice):
         """
         return array.array('B', self.handle.bulkRead(endpoint, size, timeout=self.timeout))
 
+    def readinto(self, endpoint, buffer):
+        """Reads up to the size of a preallocated, writable buffer in bytes
+        from the specified endpoint directly into it.
+
+        python-libusb1 has no public synchronous read into a caller's
+        buffer, so this uses the transfer behind bulkRead() with a
+        ctypes array over the buffer.
+
+        :return: The number of bytes read.
+
+        """
+        view = memoryview(buffer)
+        data = (ctypes.c_char * view.nbytes).from_buffer(view)
+        endpoint = (endpoint & ~usb1.ENDPOINT_DIR_MASK) | usb1.ENDPOINT_IN
+        return self.handle._bulkTransfer(endpoint, data, view.nbytes, self.timeout)
+
     def write(self, endpoint, data):
         """Writes the given data to the specified endpoint.
 
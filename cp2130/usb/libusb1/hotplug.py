@@ -20,6 +20,12 @@ import usb1
 
 import cp2130.usb.usb
 
+def port_path(device):
+    """Gets the (bus, port, port, ...) tuple locating a usb1.USBDevice.
+
+    """
+    return (device.getBusNumber(),) + tuple(device.getPortNumberList())
+
 class HotpluggedDevice(object):
 
     def __init__(self, device):
@@ -42,6 +48,15 @@ class HotpluggedDevice(object):
     def address(self):
         return self.device.getDeviceAddress()
 
+    @property
+    def port_path(self):
+        """The bus number and the chain of hub port numbers leading to the
+        device, which identify the physical port and, unlike the
+        address, survive re-enumeration.
+
+        """
+        return port_path(self.device)
+
     @property
     def pid(self):
         return self.device.getProductID()
@@ -104,7 +119,7 @@ class HotplugListener(cp2130.usb.usb.HotplugListener):
     def _verify_hotplug_support(self):
         with usb1.USBContext() as context:
             if not context.hasCapability(usb1.CAP_HAS_HOTPLUG):
-                raise NoHotplugSupportError("Hotplug support is missing. Please update your libusb version.")
+                raise cp2130.usb.usb.NoHotplugSupportError("Hotplug support is missing. Please update your libusb version.")
 
     def start(self):
         self._verify_hotplug_support()
@@ -14,43 +14,182 @@
 
 from __future__ import absolute_import
 
-from cp2130.usb.usb import NoDeviceError, NoHotplugSupportError, USBDevice
+from cp2130._utils.buffer import byte_view
+from cp2130.usb.usb import HotplugListener, NoDeviceError, USBDevice
 
+import array
+import logging
+import threading
+import time
 import usb
 
-def find(vid, pid):
+def _open(dev, timeout):
+    if dev.is_kernel_driver_active(0):
+        dev.detach_kernel_driver(0)
+    return PyUSBDevice(dev, timeout)
+
+def find(vid, pid, serial=None, timeout=1000):
     """Finds the first USB device with the given vendor id and product id.
 
     :param: vid The vendor id to match.
     :param: pid The product id to match.
+    :param: serial The serial number to match, or None to match any.
+    :param: timeout The transfer timeout in milliseconds.
     :return: A PyUSBDevice instance wrapping the matched device.
     :raises: A NoDeviceError error if no matching device is found.
     """
-    dev = usb.core.find(idVendor=vid, idProduct=pid)
+    if serial is None:
+        dev = usb.core.find(idVendor=vid, idProduct=pid)
+    else:
+        dev = usb.core.find(idVendor=vid, idProduct=pid,
+                            custom_match=lambda d: d.serial_number == serial)
     if dev is None:
-        raise NoDeviceError("No device with vendor %s and product %s"%(vid, pid))
+        raise NoDeviceError("No device with vendor %s, product %s and serial %s"%(vid, pid, serial))
 
-    if dev.is_kernel_driver_active(0):
-        dev.detach_kernel_driver(0)
+    return _open(dev, timeout)
+
+def find_all(vid, pid, timeout=1000):
+    """Finds all USB devices with the given vendor id and product id.
+
+    :param: vid The vendor id to match.
+    :param: pid The product id to match.
+    :param: timeout The transfer timeout in milliseconds.
+    :return: A list of PyUSBDevice instances, possibly empty.
+    """
+    return [_open(dev, timeout) for dev in usb.core.find(find_all=True, idVendor=vid, idProduct=pid)]
+
+def hotplug(vid, pid, on_new_device, interval=0.5):
+    """Calls a function with each matching device plugged in from now on.
+
+    PyUSB has no hotplug events, so the bus is polled.
+
+    :return: A PollingHotplugListener. Call '#stop()' to stop polling.
+
+    """
+    listener = PollingHotplugListener(vid, pid, on_new_device, interval)
+    listener.start()
+    return listener
+
+class PollingHotplugListener(HotplugListener):
 
-    return PyUSBDevice(dev)
+    def __init__(self, vid, pid, on_new_device, interval=0.5):
+        """Detects newly plugged devices by scanning the bus periodically.
 
-def hotplug(on_plugged, vid, pid):
-    raise NoHotplugSupportError("The PyUSB backend does not support hotplug events.")
+        The devices present when the listener starts are not
+        reported.
+
+        :param: vid The vendor id to match.
+        :param: pid The product id to match.
+        :param: on_new_device A function called with a PyUSBDevice for
+                              each new device, on the polling thread.
+        :param: interval The time in seconds between scans.
+
+        """
+        self.vid           = vid
+        self.pid           = pid
+        self.on_new_device = on_new_device
+        self.interval      = interval
+        self._stopped      = threading.Event()
+        self._thread       = None
+
+    def __repr__(self):
+        return "PollingHotplugListener(%r, %r)"%(self.vid, self.pid)
+
+    def _scan(self):
+        return dict(((dev.bus, dev.address), dev) for dev in
+                    usb.core.find(find_all=True, idVendor=self.vid, idProduct=self.pid))
+
+    def start(self):
+        known = set(self._scan())
+        def poll():
+            while not self._stopped.wait(self.interval):
+                devices = self._scan()
+                for location in set(devices) - known:
+                    try:
+                        device = _open(devices[location], 1000)
+                    except usb.core.USBError:
+                        # Not yet accessible; retried on the next scan.
+                        continue
+                    known.add(location)
+                    try:
+                        self.on_new_device(device)
+                    except Exception:
+                        logging.getLogger("cp2130.usb.pyusb").error("Error in hotplug callback", exc_info=True)
+                known.intersection_update(devices)
+        self._thread = threading.Thread(target=poll)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
 
 class PyUSBDevice(USBDevice):
 
-    def __init__(self, device):
+    def __init__(self, device, timeout=1000):
         """An abstraction of a USB device accessed via the PyUSB library.
 
+        The interface is claimed for the lifetime of the instance.
+
+        :param: device The usb.core.Device.
+        :param: timeout The transfer timeout in milliseconds.
+
         """
-        self.device = device
+        self.device  = device
+        self.timeout = timeout
         self.device.get_active_configuration()
+        usb.util.claim_interface(self.device, 0)
+        self._buffer = array.array('B')
 
     def close(self):
+        try:
+            usb.util.release_interface(self.device, 0)
+        except usb.core.USBError:
+            # The device may already be gone.
+            pass
         usb.util.dispose_resources(self.device)
         self.device = None
 
+    def reenumerate(self, reset, timeout=5.0):
+        """Resets the device and waits for the same physical device to
+        reappear on the bus.
+
+        PyUSB has no hotplug support, so the bus is polled until the
+        device has disappeared and then reappeared. The device is
+        recognized by its port numbers, or its serial number if they
+        are unavailable, whatever its new address.
+
+        """
+        dev = self.device
+        (vid, pid, bus, address, ports) = (dev.idVendor, dev.idProduct, dev.bus, dev.address, dev.port_numbers)
+        serial = None if ports else dev.serial_number
+
+        try:
+            reset()
+        except usb.core.USBError:
+            # The device may drop off the bus before acknowledging.
+            pass
+        self.close()
+
+        gone = False
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            devices = list(usb.core.find(find_all=True, idVendor=vid, idProduct=pid))
+            gone = gone or not any(dev.bus == bus and dev.address == address for dev in devices)
+            for dev in devices if gone else []:
+                if dev.bus != bus:
+                    continue
+                try:
+                    if (ports and dev.port_numbers == ports) or (serial and dev.serial_number == serial):
+                        return _open(dev, self.timeout)
+                except usb.core.USBError:
+                    # Not yet accessible, e.g., permissions not yet applied.
+                    pass
+            time.sleep(0.01)
+
+        raise NoDeviceError("Device at bus %s, ports %s did not re-enumerate within %s s"%(bus, ports, timeout))
+
     def endpoints(self):
         """Gets all the endpoint addresses supported by the underlying device.
 
@@ -64,16 +203,38 @@ class PyUSBDevice(USBDevice):
         """Issues a control request to the underlying device.
 
         """
-        return self.device.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, wLengthOrData)
+        return self.device.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, wLengthOrData, self.timeout)
 
     def read(self, endpoint, size):
         """Reads the requested number of bytes from the specified endpoint.
 
         """
-        return self.device.read(endpoint, size)
+        return self.device.read(endpoint, size, self.timeout)
+
+    def readinto(self, endpoint, buffer):
+        """Reads up to the size of a preallocated buffer in bytes from the
+        specified endpoint into it.
+
+        An array.array('B') is filled in place by PyUSB. Other buffers
+        are filled from an internal array, reused while the size stays
+        the same.
+
+        :return: The number of bytes read.
+
+        """
+        if isinstance(buffer, array.array) and buffer.typecode == 'B':
+            return self.device.read(endpoint, buffer, self.timeout)
+
+        view = byte_view(buffer)
+        size = len(view)
+        if len(self._buffer) != size:
+            self._buffer = array.array('B', bytes(bytearray(size)))
+        n = self.device.read(endpoint, self._buffer, self.timeout)
+        view[:n] = memoryview(self._buffer)[:n]
+        return n
 
     def write(self, endpoint, data):
         """Writes the given data to the specified endpoint.
 
         """
-        return self.device.write(endpoint, data)
+        return self.device.write(endpoint, data, self.timeout)
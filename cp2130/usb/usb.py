@@ -14,6 +14,8 @@
 
 from __future__ import absolute_import
 
+from cp2130._utils.buffer import byte_view
+
 class NoDeviceError(EnvironmentError):
     """Raised if no USB device matching the specified criteria is
     found.
@@ -43,6 +45,39 @@ class USBDevice(object):
         """
         raise NotImplementedError
 
+    def acquire(self):
+        """Acquires exclusive use of the device for a transaction spanning
+        several transfers. Calls may be nested.
+
+        Only needed by implementations that share the device with
+        other processes. The default does nothing.
+
+        """
+        pass
+
+    def release(self):
+        """Releases one acquire().
+
+        """
+        pass
+
+    def reenumerate(self, reset, timeout=5.0):
+        """Resets the device and waits for the same physical device to
+        reappear on the bus.
+
+        This device is closed. The re-enumerated device is matched by
+        its port path, or by its serial number if the port path is
+        unknown.
+
+        :param: reset A zero-argument function that makes the device reset,
+                      e.g., CP2130Chip.reset_device.
+        :param: timeout The maximum time in seconds to wait.
+        :return: A new USBDevice for the re-enumerated device.
+        :raises: A NoDeviceError if the device does not reappear in time.
+
+        """
+        raise NotImplementedError
+
     def endpoints(self):
         """Gets all the endpoint addresses supported by the underlying device.
 
@@ -61,6 +96,23 @@ class USBDevice(object):
         """
         raise NotImplementedError
 
+    def readinto(self, endpoint, buffer):
+        """Reads up to the size of a preallocated, writable buffer in bytes
+        from the specified endpoint into it.
+
+        Implementations that can read into the caller's buffer
+        directly should override this. The default copies the result
+        of read().
+
+        :return: The number of bytes read.
+
+        """
+        view = byte_view(buffer)
+        data = self.read(endpoint, len(view))
+        n = len(data)
+        view[:n] = memoryview(data)
+        return n
+
     def write(self, endpoint, data):
         """Writes the given data to the specified endpoint.
 
@@ -17,9 +17,45 @@ from __future__ import absolute_import
 import codecs
 
 from cp2130.chip import registers
-from cp2130.data import Version
+from cp2130.data import LockState, Version
+
+class LockedFieldError(ValueError):
+    """Raised if a write targets a field locked in the one-time
+    programmable ROM.
+
+    """
+    pass
+
+def _encode_string(string, max_bytes):
+    encoded = codecs.encode(string, 'utf-16-le')
+    if len(encoded) > max_bytes:
+        raise ValueError("Max string length is %d characters"%(max_bytes // 2))
+    return encoded
 
 class USBConfig(object):
+
+    # The usb_config register fields for each USBConfig property.
+    _USB_FIELDS = {
+        'vendor_id'         : 'vid',
+        'product_id'        : 'pid',
+        'max_power'         : 'max_power_2mA',
+        'power_mode'        : 'power_mode',
+        'release'           : None,
+        'transfer_priority' : 'transfer_priority',
+    }
+
+    # The lock byte fields guarding each USBConfig property.
+    _LOCK_FIELDS = {
+        'vendor_id'           : ['vid'],
+        'product_id'          : ['pid'],
+        'max_power'           : ['max_power'],
+        'power_mode'          : ['power_mode'],
+        'release'             : ['release_version'],
+        'transfer_priority'   : ['transfer_priority'],
+        'manufacturer_string' : ['manufacturing_string1', 'manufacturing_string2'],
+        'product_string'      : ['product_string1', 'product_string2'],
+        'serial_string'       : ['serial_string'],
+    }
     
     def __init__(self, chip):
         self.chip = chip
@@ -235,3 +271,153 @@ class USBConfig(object):
         reg = registers.usb_config_setter.default()
         reg.transfer_priority = transfer_priority
         self.chip.set_usb_config(reg)
+
+    def read(self, *names):
+        """Reads several fields at once with the fewest ROM reads.
+
+        The usb_config register is read at most once for all of the
+        vendor_id, product_id, max_power, power_mode, release and
+        transfer_priority fields. The second register of a
+        manufacturer or product string is only read if the string is
+        too long to fit in the first.
+
+        :param: names The property names to read, or none to read all.
+        :return: A dict of the values keyed by property name.
+        :raises: A ValueError if any field name is invalid.
+
+        """
+        names = names or tuple(self._LOCK_FIELDS)
+        unknown = set(names) - set(self._LOCK_FIELDS)
+        if unknown:
+            raise ValueError("Unknown USB config fields: %s"%", ".join(sorted(unknown)))
+
+        values = {}
+        if any(name in self._USB_FIELDS for name in names):
+            reg = self.chip.get_usb_config()
+            for name in names:
+                if name == 'max_power':
+                    values[name] = reg.max_power_2mA * 2
+                elif name == 'release':
+                    values[name] = Version(reg.major_release, reg.minor_release)
+                elif name in self._USB_FIELDS:
+                    values[name] = getattr(reg, self._USB_FIELDS[name])
+
+        for (name, get1, get2) in [
+                ('manufacturer_string', self.chip.get_manufacturing_string1, self.chip.get_manufacturing_string2),
+                ('product_string', self.chip.get_product_string1, self.chip.get_product_string2)]:
+            if name in names:
+                reg1 = get1()
+                encoded = reg1.string
+                if reg1.length - 2 > len(encoded):
+                    encoded += get2().string
+                values[name] = codecs.decode(encoded[:reg1.length-2], 'utf-16-le')
+
+        if 'serial_string' in names:
+            values['serial_string'] = self.serial_string
+
+        return values
+
+    def update(self, lock=None, **fields):
+        """Writes several fields at once with the fewest ROM writes.
+
+        All of the vendor_id, product_id, max_power, power_mode,
+        release and transfer_priority fields are written by a single
+        masked usb_config transfer. A manufacturer or product string
+        short enough to fit in the first string register is written
+        with one transfer instead of two.
+
+        The lock byte is read once up front. If any requested field is
+        locked, nothing is written.
+
+        WARNING: These fields are stored in the one-time programmable
+        ROM. Each may be changed at once most.
+
+        :param: lock The current lock register, if already read, to avoid
+                     reading it again.
+        :param: fields The new values, keyed by property name, e.g.,
+                       update(vendor_id=0x1234, product_string="Widget").
+        :raises: A LockedFieldError if any requested field is locked.
+        :raises: A ValueError if any field name or value is invalid.
+
+        """
+        unknown = set(fields) - set(self._LOCK_FIELDS)
+        if unknown:
+            raise ValueError("Unknown USB config fields: %s"%", ".join(sorted(unknown)))
+
+        writes = self._plan(fields)
+
+        if lock is None:
+            lock = self.chip.get_lock_byte()
+        locked = sorted(name for name in fields
+                        if any(getattr(lock, f) == LockState.LOCKED for f in self._write_lock_fields(name, fields)))
+        if locked:
+            raise LockedFieldError("Locked fields: %s"%", ".join(locked))
+
+        for write in writes:
+            write()
+
+    def apply_profile(self, profile):
+        """Writes every field in a profile, a dict keyed by property name,
+        using update().
+
+        """
+        self.update(**dict(profile))
+
+    def _write_lock_fields(self, name, fields):
+        lock_fields = self._LOCK_FIELDS[name]
+        if name in ('manufacturer_string', 'product_string') and not self._needs_second_string(fields[name]):
+            lock_fields = lock_fields[:1]
+        return lock_fields
+
+    @staticmethod
+    def _needs_second_string(string):
+        return len(_encode_string(string, 124)) > 61
+
+    def _plan(self, fields):
+        """Validates the fields and returns a list of zero-argument functions
+        performing the ROM writes. Fields sharing the usb_config
+        register are combined into one write.
+
+        """
+        writes = []
+
+        usb_names = [n for n in fields if n in self._USB_FIELDS]
+        if usb_names:
+            reg = registers.usb_config_setter.default()
+            for name in usb_names:
+                value = fields[name]
+                if name == 'max_power':
+                    if not (0 <= value and value <= 500):
+                        raise ValueError("Max power must between 0 and 500 mA")
+                    reg.max_power_2mA = int(value / 2)
+                elif name == 'release':
+                    reg.major_release = value.major
+                    reg.minor_release = value.minor
+                else:
+                    setattr(reg, self._USB_FIELDS[name], value)
+            writes.append(lambda reg=reg: self.chip.set_usb_config(reg))
+
+        for (name, reg1_cls, reg2_cls, set1, set2) in [
+                ('manufacturer_string', registers.manufacturing_string1, registers.manufacturing_string2,
+                 self.chip.set_manufacturing_string1, self.chip.set_manufacturing_string2),
+                ('product_string', registers.product_string1, registers.product_string2,
+                 self.chip.set_product_string1, self.chip.set_product_string2)]:
+            if name not in fields:
+                continue
+            encoded = _encode_string(fields[name], 124)
+            length  = len(encoded) + 2
+            padded  = encoded.ljust(124, b'\x00')
+            reg1 = reg1_cls.make(length, 0x03, padded[:61])
+            if len(encoded) > 61:
+                reg2 = reg2_cls.make(padded[61:])
+                write = lambda reg1=reg1, reg2=reg2, set1=set1, set2=set2: (set1(reg1), set2(reg2))
+            else:
+                write = lambda reg1=reg1, set1=set1: set1(reg1)
+            writes.append(write)
+
+        if 'serial_string' in fields:
+            encoded = _encode_string(fields['serial_string'], 60)
+            reg = registers.serial_string.make(len(encoded) + 2, 0x03, encoded.ljust(60, b'\x00'))
+            writes.append(lambda reg=reg: self.chip.set_serial_string(reg))
+
+        return writes
@@ -0,0 +1,158 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+class PendingResult(object):
+
+    def __init__(self):
+        """The eventual result of an operation submitted to an IOWorker.
+
+        """
+        self._done = threading.Event()
+        self._value = None
+        self._exc_info = None
+
+    def done(self):
+        """Returns True if the operation has completed.
+
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the operation to complete and returns its result.
+
+        :param: timeout The maximum time to wait in seconds, or None to
+                        wait indefinitely.
+        :raises: Any exception raised by the operation.
+        :raises: A RuntimeError if the timeout expires.
+
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Operation did not complete within %s seconds"%timeout)
+        if self._exc_info:
+            six.reraise(*self._exc_info)
+        return self._value
+
+    def _set_result(self, value):
+        self._value = value
+        self._done.set()
+
+    def _set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._done.set()
+
+class IOWorker(object):
+
+    def __init__(self, master, max_pending=0):
+        """A dedicated I/O thread that executes operations on a CP2130 in
+        submission order.
+
+        Any number of producer threads may submit operations. Each
+        operation runs to completion, inside a transaction on the
+        chip, before the next one starts, so control and bulk traffic
+        from different producers never interleave.
+
+        :param: master The cp2130.core.CP2130 instance to operate on.
+        :param: max_pending The maximum number of queued operations
+                            before submit() blocks, or 0 for no limit.
+
+        """
+        self.master = master
+        self.chip   = master.chip
+
+        self._queue  = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return "IOWorker(%r)"%(self.master)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, op, *args, **kwargs):
+        """Queues an operation for execution on the I/O thread.
+
+        :param: op The function to invoke. It is called with the given
+                   positional and keyword arguments.
+        :return: A PendingResult for the operation.
+
+        """
+        pending = PendingResult()
+        self._queue.put((pending, op, args, kwargs))
+        return pending
+
+    def run(self, op, *args, **kwargs):
+        """Executes an operation on the I/O thread and waits for its result.
+
+        """
+        return self.submit(op, *args, **kwargs).result()
+
+    def read(self, channel, length):
+        """Queues a read of the specified number of bytes from the channel.
+
+        :return: A PendingResult for the read data.
+
+        """
+        return self.submit(channel.read, length)
+
+    def write(self, channel, data):
+        """Queues a write of the given data to the channel.
+
+        :return: A PendingResult for the write.
+
+        """
+        return self.submit(channel.write, data)
+
+    def write_read(self, channel, data):
+        """Queues a simultaneous write and read on the channel.
+
+        :return: A PendingResult for the read data.
+
+        """
+        return self.submit(channel.write_read, data)
+
+    def stop(self):
+        """Stops the I/O thread after the already-queued operations
+        complete.
+
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            (pending, op, args, kwargs) = item
+            try:
+                with self.chip.transaction():
+                    value = op(*args, **kwargs)
+            except Exception:
+                pending._set_exception(sys.exc_info())
+            else:
+                pending._set_result(value)
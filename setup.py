@@ -50,5 +50,6 @@ setup(
                 'cp2130.usb.libusb1',
                 'cp2130._utils'],
     install_requires = ['bidict', 'bitstring', 'enum34', 'pyusb', 'libusb1', 'six'],
+    extras_require = {'numpy': ['numpy']},
     zip_safe = False
 )
@@ -0,0 +1,172 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+
+from __future__ import absolute_import
+
+import array
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from cp2130.broker import BrokerError, BrokerServer, BrokerUSBDevice
+from cp2130.chip import CP2130Chip
+from cp2130.usb.usb import USBDevice
+
+class FakeUSB(USBDevice):
+
+    def __init__(self, serial='X'):
+        """A stand-in for a CP2130's USB device that records every call and
+        loops bulk writes back to bulk reads.
+
+        """
+        self.serial = serial
+        self.calls  = []
+        self.data   = b''
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def acquire(self):
+        self.calls.append('acquire')
+
+    def release(self):
+        self.calls.append('release')
+
+    def endpoints(self):
+        return [0x01, 0x82]
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        self.calls.append(('control', bRequest))
+        if bRequest == 0xFF:
+            raise IOError("Pipe error")
+        if not isinstance(wLengthOrData, int):
+            return len(wLengthOrData)
+        if bRequest == 0x6A:
+            text = self.serial.encode('utf-16-le')
+            raw = bytearray([len(text) + 2, 0x03]) + text
+            return array.array('B', raw + bytearray(wLengthOrData - len(raw)))
+        return array.array('B', bytearray(wLengthOrData))
+
+    def read(self, endpoint, size):
+        self.calls.append(('read', endpoint, size))
+        return array.array('B', self.data[:size])
+
+    def write(self, endpoint, data):
+        self.calls.append(('write', endpoint))
+        self.data = bytes(bytearray(data))[8:]
+        return len(data)
+
+class TestChipLocking(unittest.TestCase):
+
+    def test_bulk_exchange_holds_device(self):
+        usb = FakeUSB()
+        chip = CP2130Chip(usb)
+        chip.write_read(b'\x01\x02')
+        self.assertEqual(usb.calls, ['acquire', ('write', 0x01), ('read', 0x82, 2), 'release'])
+
+    def test_read_holds_device(self):
+        usb = FakeUSB()
+        CP2130Chip(usb).read(4)
+        self.assertEqual(usb.calls[0], 'acquire')
+        self.assertEqual(usb.calls[-1], 'release')
+
+class TestBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.dir    = tempfile.mkdtemp()
+        self.path   = os.path.join(self.dir, 'broker.sock')
+        self.opened = []
+        self.server = BrokerServer(self.path, self._opener)
+        self.server.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def _opener(self, vid, pid, serial):
+        usb = FakeUSB(serial or 'X')
+        self.opened.append(usb)
+        return usb
+
+    def _client(self, serial=None):
+        client = BrokerUSBDevice(self.path, serial=serial)
+        self.clients.append(client)
+        return client
+
+    def test_round_trip(self):
+        client = self._client()
+        self.assertEqual(client.endpoints(), [0x01, 0x82])
+        self.assertEqual(client.write(0x01, b'\x00' * 8 + b'abc'), 11)
+        self.assertEqual(bytes(bytearray(client.read(0x82, 3))), b'abc')
+        self.assertEqual(len(client.control_transfer(0xC0, 0x31, 0, 0, 2)), 2)
+        self.assertEqual(client.control_transfer(0x40, 0x32, 0, 0, b'\x01\x02'), 2)
+        client.flush()
+
+    def test_chip_through_broker(self):
+        chip = CP2130Chip(self._client())
+        self.assertEqual(bytes(bytearray(chip.write_read(b'\x10\x20'))), b'\x10\x20')
+        self.assertEqual(self.opened[0].calls[-2:], [('write', 0x01), ('read', 0x82, 2)])
+
+    def test_any_serial_shares_named_device(self):
+        self._client().endpoints()
+        self._client('X').endpoints()
+        self.assertEqual(len(self.opened), 1)
+        self._client('Y').endpoints()
+        self.assertEqual(len(self.opened), 2)
+
+    def test_named_device_shared_with_any_serial(self):
+        self._client('X').endpoints()
+        self._client().endpoints()
+        self.assertEqual(len(self.opened), 1)
+
+    def test_device_closed_with_last_client(self):
+        a = self._client()
+        b = self._client()
+        a.endpoints()
+        b.endpoints()
+        a.close()
+        self.assertFalse(self.opened[0].closed)
+        b.close()
+        self.clients = []
+        self.assertTrue(self.opened[0].closed)
+
+    def test_lock_excludes_other_clients(self):
+        a = self._client()
+        b = self._client()
+        a.acquire()
+        a.flush()
+        done = []
+        thread = threading.Thread(target=lambda: done.append(b.endpoints()))
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(done, [])
+        a.release()
+        thread.join(1.0)
+        self.assertEqual(done, [[0x01, 0x82]])
+
+    def test_error_reported(self):
+        client = self._client()
+        client.control_transfer(0x40, 0xFF, 0, 0, b'\x00')
+        self.assertRaises(BrokerError, client.flush)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cp2130.capture import Capture
+
+class FakeChannel(object):
+
+    def __init__(self):
+        """A stand-in for cp2130.spi.SPIChannel producing a counting byte
+        stream. It has no read(), so only readinto() can be used.
+
+        """
+        self.position = 0
+        self.buffers  = []
+
+    def readinto(self, buffer):
+        self.buffers.append(buffer)
+        for i in range(len(buffer)):
+            buffer[i] = (self.position + i) & 0xFF
+        self.position += len(buffer)
+        return len(buffer)
+
+def _expected(length):
+    return bytes(bytearray(i & 0xFF for i in range(length)))
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.dir  = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'capture.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _index(self):
+        with open(self.path + '.idx') as f:
+            return [line.split() for line in f if not line.startswith('#')]
+
+    def test_capture_to_file(self):
+        channel = FakeChannel()
+        capture = Capture(channel, self.path, chunk_size=1000, buffers=2, preallocate=4096)
+        capture.start(total_bytes=10500)
+        self.assertTrue(capture.wait(5.0))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), _expected(10500))
+        index = self._index()
+        self.assertEqual(len(index), 11)
+        self.assertEqual(index[-1][:4], ['10', '0', '10000', '500'])
+        self.assertEqual(capture.stats.bytes, 10500)
+
+    def test_reads_into_pool_buffers(self):
+        channel = FakeChannel()
+        capture = Capture(channel, self.path, chunk_size=100, buffers=2, preallocate=4096)
+        capture.start(total_bytes=1000)
+        capture.wait(5.0)
+        self.assertTrue(all(isinstance(b, memoryview) for b in channel.buffers))
+
+    def test_segments(self):
+        capture = Capture(FakeChannel(), self.path, chunk_size=100, segment_size=300)
+        capture.start(total_bytes=700)
+        capture.wait(5.0)
+        self.assertEqual(capture.stats.segments, 3)
+        data = b''
+        for segment in range(3):
+            with open("%s.%04d"%(self.path, segment), 'rb') as f:
+                data += f.read()
+        self.assertEqual(data, _expected(700))
+
+    def test_read_hook(self):
+        capture = Capture(None, self.path, chunk_size=64, preallocate=4096,
+                          read=lambda n: b'\xaa' * n)
+        capture.start(total_bytes=100)
+        capture.wait(5.0)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'\xaa' * 100)
+
+    def test_not_started(self):
+        capture = Capture(FakeChannel(), self.path)
+        self.assertTrue(capture.wait())
+        capture.stop()
+        self.assertFalse(os.path.exists(self.path + '.idx'))
+
+    def test_restart_rejected(self):
+        capture = Capture(FakeChannel(), self.path, chunk_size=10, preallocate=100)
+        capture.start(total_bytes=10)
+        capture.wait(5.0)
+        self.assertRaises(RuntimeError, capture.start)
+
+    def test_preallocate_required(self):
+        self.assertRaises(ValueError, Capture, FakeChannel(), self.path, preallocate=0)
+
+if __name__ == '__main__':
+    unittest.main()
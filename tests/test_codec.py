@@ -0,0 +1,86 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import unittest
+
+from cp2130 import codec
+from cp2130.codec import SampleFormat
+
+def flat(samples):
+    if hasattr(samples, 'ravel'):
+        samples = samples.ravel()
+    return list(int(v) for v in samples)
+
+class TestDecode(unittest.TestCase):
+
+    def decode(self, format, data):
+        """Decodes with NumPy, if installed, and with array.array, and
+        checks that both agree.
+
+        """
+        numpy = codec.numpy
+        codec.numpy = None
+        try:
+            fallback = flat(format.decode(data))
+        finally:
+            codec.numpy = numpy
+        if numpy is not None:
+            self.assertEqual(flat(format.decode(bytearray(data))), fallback)
+        return fallback
+
+    def test_8_bit_signed(self):
+        self.assertEqual(self.decode(SampleFormat(8, signed=True), b'\x01\xff'), [1, -1])
+
+    def test_16_bit_byte_order(self):
+        self.assertEqual(self.decode(SampleFormat(16), b'\x01\x02'), [0x0102])
+        self.assertEqual(self.decode(SampleFormat(16, big_endian=False), b'\x01\x02'), [0x0201])
+
+    def test_12_bit_packed(self):
+        self.assertEqual(self.decode(SampleFormat(12), b'\xab\xcd\xef\x12\x30'), [0xABC, 0xDEF, 0x123])
+
+    def test_24_bit(self):
+        self.assertEqual(self.decode(SampleFormat(24), b'\x01\x02\x03'), [0x010203])
+        self.assertEqual(self.decode(SampleFormat(24, big_endian=False), b'\x01\x02\x03'), [0x030201])
+
+    def test_mask_shift_and_sign(self):
+        # 14-bit signed data in the top of a 16-bit word, status bits below.
+        format = SampleFormat(16, signed=True, mask=0xFFFC, shift=2)
+        self.assertEqual(format.bits, 14)
+        self.assertEqual(self.decode(format, b'\xff\xff\x00\x07'), [-1, 1])
+
+    def test_rejects_partial_frame(self):
+        self.assertRaises(ValueError, SampleFormat(16, channels=2).decode, b'\x00\x01\x02')
+
+    @unittest.skipIf(codec.numpy is None, "requires NumPy")
+    def test_channels(self):
+        samples = SampleFormat(8, channels=2).decode(b'\x01\x02\x03\x04')
+        self.assertEqual(samples.shape, (2, 2))
+        self.assertEqual(flat(samples[:, 1]), [2, 4])
+
+class TestIterDecode(unittest.TestCase):
+
+    def test_carries_partial_frames(self):
+        format = SampleFormat(16)
+        chunks = [b'\x00\x01\x00', b'\x02', b'\x00\x03\x00\x04']
+        self.assertEqual([flat(samples) for samples in format.iter_decode(chunks)], [[1], [2], [3, 4]])
+
+    def test_sizes(self):
+        self.assertEqual(SampleFormat(12).nbytes(3), 5)
+        self.assertEqual(SampleFormat(24, channels=2).nbytes(3), 18)
+        self.assertEqual(SampleFormat(12, channels=2).frame_size, 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import unittest
+
+from cp2130.cost import CostModel, USBOverhead, _fit
+from cp2130.transaction import Transaction
+
+OVERHEAD = USBOverhead(control=0.001, bulk=0.001, per_byte=1.0e-6)
+
+class TestPredict(unittest.TestCase):
+
+    def test_spi_bound(self):
+        prediction = CostModel(1000000, overhead=OVERHEAD).predict(1000)
+        self.assertAlmostEqual(prediction.duration, 0.002 + 0.001 + 0.008)
+        self.assertEqual((prediction.bytes, prediction.bulk_commands, prediction.control_transfers), (1000, 1, 2))
+
+    def test_usb_bound(self):
+        prediction = CostModel(12000000, overhead=OVERHEAD).predict(1000)
+        self.assertAlmostEqual(prediction.duration, 0.002 + 0.001 + 0.001)
+
+    def test_inter_byte_delay(self):
+        model = CostModel(1000000, inter_byte_delay=10, overhead=OVERHEAD)
+        self.assertAlmostEqual(model.spi_time(3), 24e-6 + 2 * 10e-6)
+
+    def test_native_delays_only(self):
+        native = CostModel(1000000, post_assert_delay=10, pre_deassert_delay=20, overhead=OVERHEAD)
+        manual = CostModel(1000000, post_assert_delay=10, pre_deassert_delay=20, manual_cs=True, overhead=OVERHEAD)
+        self.assertAlmostEqual(native.spi_time(1), 8e-6 + 30e-6)
+        self.assertAlmostEqual(manual.spi_time(1), 8e-6)
+
+    def test_transaction(self):
+        transaction = Transaction().write(b'\x00' * 10).delay(0.005).read(10)
+        prediction = CostModel(1000000, overhead=OVERHEAD).predict(transaction)
+        self.assertEqual((prediction.bytes, prediction.bulk_commands), (20, 2))
+        self.assertAlmostEqual(prediction.duration, 0.002 + 2 * (0.001 + 80e-6) + 0.005)
+
+class TestMaxBytes(unittest.TestCase):
+
+    def test_largest_within_duration(self):
+        model = CostModel(1000000, overhead=OVERHEAD)
+        n = model.max_bytes(0.0110004)
+        self.assertEqual(n, 1000)
+        self.assertTrue(model.predict(n).duration <= 0.0110004)
+        self.assertTrue(model.predict(n + 1).duration > 0.0110004)
+
+    def test_too_short(self):
+        self.assertEqual(CostModel(1000000, overhead=OVERHEAD).max_bytes(0.003), 0)
+
+class TestFit(unittest.TestCase):
+
+    def test_line(self):
+        (intercept, slope) = _fit([(0, 1.0), (10, 3.0), (20, 5.0)])
+        self.assertAlmostEqual(intercept, 1.0)
+        self.assertAlmostEqual(slope, 0.2)
+
+if __name__ == '__main__':
+    unittest.main()
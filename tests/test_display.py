@@ -0,0 +1,135 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+
+from __future__ import absolute_import
+
+import contextlib
+import random
+import struct
+import unittest
+
+from cp2130.data import LogicLevel
+from cp2130.display import Display, Framebuffer, Rect
+
+class FakeChip(object):
+
+    def __init__(self, dc_num):
+        """A stand-in for cp2130.chip.CP2130Chip recording the level of the
+        data/command line with each bulk write.
+
+        """
+        self.dc_num = dc_num
+        self.dc     = None
+        self.writes = []
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+    def set_gpio_values(self, reg):
+        self.dc = getattr(reg, 'gpio%d_level'%self.dc_num)
+
+    def write(self, data):
+        self.writes.append((self.dc, bytes(data)))
+
+class FakeGPIO(object):
+
+    def __init__(self, num):
+        self.num       = num
+        self.cs_enable = None
+
+class FakeChannel(object):
+
+    def __init__(self, chip):
+        self.chip   = chip
+        self.cs_num = 0
+        self.gpio   = FakeGPIO(0)
+
+class TestDirtyTracking(unittest.TestCase):
+
+    def setUp(self):
+        self.fb = Framebuffer(240, 240)
+        self.fb.take_dirty()
+
+    def test_adjacent_pixels_fold(self):
+        for x in range(10, 20):
+            self.fb.set_pixel(x, 5, (255, 0, 0))
+        self.assertEqual(self.fb.dirty, [Rect(10, 5, 10, 1)])
+
+    def test_contained_rect_folds(self):
+        self.fb.fill_rect(10, 10, 50, 50, (0, 0, 255))
+        self.fb.fill_rect(20, 20, 5, 5, (0, 255, 0))
+        self.assertEqual(self.fb.dirty, [Rect(10, 10, 50, 50)])
+
+    def test_disjoint_rects_kept(self):
+        self.fb.set_pixel(0, 0, (1, 2, 3))
+        self.fb.set_pixel(100, 100, (1, 2, 3))
+        self.assertEqual(self.fb.take_dirty(), [Rect(0, 0, 1, 1), Rect(100, 100, 1, 1)])
+        self.assertEqual(self.fb.dirty, [])
+
+    def test_many_pixels_capped(self):
+        rng = random.Random(1)
+        pixels = [(rng.randrange(240), rng.randrange(240)) for _ in range(800)]
+        for (x, y) in pixels:
+            self.fb.set_pixel(x, y, (255, 255, 255))
+        self.assertTrue(len(self.fb.dirty) <= self.fb.max_dirty_rects)
+        rects = self.fb.take_dirty(overhead=100)
+        for (x, y) in pixels:
+            self.assertTrue(any(r.x <= x < r.x + r.width and r.y <= y < r.y + r.height for r in rects))
+
+    def test_take_dirty_merges_with_overhead(self):
+        self.fb.set_pixel(0, 0, (1, 2, 3))
+        self.fb.set_pixel(2, 0, (1, 2, 3))
+        self.assertEqual(len(self.fb.take_dirty(overhead=0)), 2)
+        self.fb.set_pixel(0, 0, (1, 2, 3))
+        self.fb.set_pixel(2, 0, (1, 2, 3))
+        self.assertEqual(self.fb.take_dirty(overhead=1), [Rect(0, 0, 3, 1)])
+
+class TestFlush(unittest.TestCase):
+
+    def setUp(self):
+        self.chip    = FakeChip(5)
+        self.display = Display(FakeChannel(self.chip), FakeGPIO(5), 8, 4, x_offset=2, y_offset=1)
+        self.display.framebuffer.take_dirty()
+
+    def test_flush_sends_window_and_pixels(self):
+        self.display.framebuffer.fill_rect(1, 2, 2, 1, (255, 255, 255))
+        rects = self.display.flush()
+        self.assertEqual(rects, [Rect(1, 2, 2, 1)])
+        low, high = LogicLevel.LOW, LogicLevel.HIGH
+        self.assertEqual(self.chip.writes, [
+            (low,  struct.pack('B', Display.CASET)),
+            (high, struct.pack('>HH', 3, 4)),
+            (low,  struct.pack('B', Display.RASET)),
+            (high, struct.pack('>HH', 3, 3)),
+            (low,  struct.pack('B', Display.RAMWR)),
+            (high, b'\xff\xff\xff\xff'),
+        ])
+        self.assertEqual(self.display.pixels_sent, 2)
+
+    def test_flush_without_changes_sends_nothing(self):
+        self.assertEqual(self.display.flush(), [])
+        self.assertEqual(self.chip.writes, [])
+
+    def test_failed_flush_keeps_dirty(self):
+        def fail(data):
+            raise IOError("write failed")
+        self.chip.write = fail
+        self.display.framebuffer.set_pixel(0, 0, (255, 0, 0))
+        self.assertRaises(IOError, self.display.flush)
+        self.assertEqual(self.display.framebuffer.dirty, [Rect(0, 0, 1, 1)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+
+from __future__ import absolute_import
+
+import os
+import struct
+import unittest
+
+from cp2130.flash import SPIFlash
+from cp2130.transaction import Transaction
+
+class FakeFlash(object):
+
+    def __init__(self, size, program_samples=4, erase_samples=4):
+        """A SPI NOR flash that stays busy after a program or erase for the
+        given number of status register samples, ignoring any other
+        command meanwhile.
+
+        """
+        self.memory          = bytearray(b'\xff' * size)
+        self.program_samples = program_samples
+        self.erase_samples   = erase_samples
+        self.busy            = 0
+        self.write_enabled   = False
+        self.ops             = []
+        self.ignored         = 0
+
+    def frame(self, mosi):
+        """Handles one chip-select frame and returns the MISO bytes.
+
+        """
+        mosi = bytearray(mosi)
+        miso = bytearray(len(mosi))
+        op = mosi[0]
+        self.ops.append(op)
+        if op == SPIFlash.READ_STATUS:
+            for i in range(1, len(mosi)):
+                miso[i] = 0x03 if self.busy else 0x00
+                self.busy = max(0, self.busy - 1)
+        elif self.busy:
+            self.ignored += 1
+        elif op == SPIFlash.WRITE_ENABLE:
+            self.write_enabled = True
+        elif op == SPIFlash.READ_ID:
+            miso[1:4] = b'\xef\x40\x14'
+        elif op == SPIFlash.FAST_READ:
+            (address,) = struct.unpack('>I', b'\x00' + bytes(mosi[1:4]))
+            n = len(mosi) - 5
+            miso[5:] = self.memory[address:address + n]
+        elif op in (SPIFlash.PAGE_PROGRAM, SPIFlash.SECTOR_ERASE) and self.write_enabled:
+            (address,) = struct.unpack('>I', b'\x00' + bytes(mosi[1:4]))
+            if op == SPIFlash.PAGE_PROGRAM:
+                base = address - address % 256
+                for (i, b) in enumerate(mosi[4:]):
+                    a = base + (address + i) % 256
+                    self.memory[a] &= b
+                self.busy = self.program_samples
+            else:
+                address -= address % 4096
+                self.memory[address:address + 4096] = b'\xff' * 4096
+                self.busy = self.erase_samples
+            self.write_enabled = False
+        return miso
+
+class FakeChannel(object):
+
+    def __init__(self, flash):
+        """A stand-in for cp2130.spi.SPIChannel that runs transactions
+        against a FakeFlash, one frame per chip-select assertion.
+
+        """
+        self.flash           = flash
+        self.clock_frequency = 12000000
+        self.transactions    = 0
+
+    def transaction(self, fill=0x00):
+        return Transaction(self, fill)
+
+    def write_read(self, data):
+        return self.flash.frame(data)
+
+    def execute(self, transaction):
+        self.transactions += 1
+        results = []
+        (frame, reads) = (bytearray(), [])
+        segments = transaction.compile()
+        for (i, segment) in enumerate(segments):
+            reads += [(len(frame) + offset, length) for (offset, length) in segment.reads]
+            frame += segment.data
+            if segment.toggle or i == len(segments) - 1:
+                miso = self.flash.frame(frame)
+                results += [miso[offset:offset + length] for (offset, length) in reads]
+                (frame, reads) = (bytearray(), [])
+        return results
+
+class TestProgram(unittest.TestCase):
+
+    def _flash(self, **kwargs):
+        self.fake = FakeFlash(64 * 1024, **kwargs)
+        return SPIFlash(FakeChannel(self.fake), page_program_time=0)
+
+    def test_program_and_read_back(self):
+        flash = self._flash()
+        data = os.urandom(10000)
+        report = flash.program(100, data)
+        self.assertEqual(flash.read(100, 10000), bytearray(data))
+        self.assertEqual(report.sectors_erased, 0)
+        self.assertEqual(report.pages_programmed, 40)
+
+    def test_incremental_skips_unchanged(self):
+        flash = self._flash()
+        data = os.urandom(8192)
+        flash.program(0, data)
+        report = flash.program(0, data)
+        self.assertEqual(report.sectors_skipped, 2)
+        self.assertEqual(report.pages_programmed, 0)
+
+    def test_reprogram_erases(self):
+        flash = self._flash()
+        flash.program(0, b'\x00' * 4096)
+        report = flash.program(0, b'\x5a' * 4096)
+        self.assertEqual(report.sectors_erased, 1)
+        self.assertEqual(flash.read(0, 4096), bytearray(b'\x5a' * 4096))
+
+    def test_pages_pipelined(self):
+        fake = FakeFlash(4096, program_samples=1000)
+        channel = FakeChannel(fake)
+        flash = SPIFlash(channel, page_program_time=0.001)
+        flash.program(0, os.urandom(4096), incremental=False, verify=False)
+        # The erase and its wait, one transaction per page and the final
+        # wait, rather than several polls after every page.
+        self.assertEqual(fake.ops.count(SPIFlash.PAGE_PROGRAM), 16)
+        self.assertEqual(fake.ignored, 0)
+        self.assertTrue(channel.transactions <= 24)
+
+class TestProgramPages(unittest.TestCase):
+
+    def test_poll_sized_from_program_time(self):
+        fake = FakeFlash(4096, program_samples=1500)
+        flash = SPIFlash(FakeChannel(fake), page_program_time=0.001)
+        pages = [(a, os.urandom(256)) for a in range(0, 4096, 256)]
+        self.assertEqual(flash.program_pages(pages), 16)
+        self.assertEqual(fake.ignored, 0)
+        self.assertEqual(fake.memory, bytearray(b''.join(d for (_, d) in pages)))
+
+    def test_still_busy_falls_back(self):
+        fake = FakeFlash(4096, program_samples=1000)
+        flash = SPIFlash(FakeChannel(fake), poll_bytes=16, page_program_time=0)
+        pages = [(a, os.urandom(256)) for a in range(0, 4096, 256)]
+        self.assertEqual(flash.program_pages(pages), 16)
+        self.assertTrue(fake.ignored > 0)
+        self.assertEqual(fake.memory, bytearray(b''.join(d for (_, d) in pages)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import os
+import unittest
+
+from cp2130.flash_view import FlashView
+
+class FakeFlash(object):
+
+    def __init__(self, size):
+        """A stand-in for cp2130.flash.SPIFlash holding random data.
+
+        """
+        self.size  = size
+        self.data  = os.urandom(size)
+        self.reads = 0
+
+    def read(self, address, length):
+        self.reads += 1
+        return self.data[address:address + length]
+
+    def add_write_listener(self, callback):
+        pass
+
+    def remove_write_listener(self, callback):
+        pass
+
+class FlashViewTest(unittest.TestCase):
+
+    def test_range_larger_than_cache(self):
+        flash = FakeFlash(64 * 4096)
+        view = FlashView(flash, cache_pages=8)
+        self.assertEqual(view[0:7 * 4096], flash.data[0:7 * 4096])
+        self.assertEqual(view[100:20 * 4096 + 7], flash.data[100:20 * 4096 + 7])
+
+    def test_read_whole_device(self):
+        flash = FakeFlash(2 * 1024 * 1024)
+        view = FlashView(flash)
+        self.assertEqual(view.read(), flash.data)
+        self.assertEqual(bytes(view.memoryview()), flash.data)
+
+    def test_read_ahead_keeps_requested_pages(self):
+        flash = FakeFlash(64 * 4096)
+        view = FlashView(flash, cache_pages=8, read_ahead=4)
+        view[0:6 * 4096]
+        reads = flash.reads
+        self.assertEqual(view[0:6 * 4096], flash.data[0:6 * 4096])
+        self.assertEqual(flash.reads, reads)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import struct
+import unittest
+
+from cp2130.chip import CP2130Chip, registers
+from cp2130.core import CP2130
+from cp2130.data import LogicLevel
+from cp2130.spi import ChannelGroup
+from cp2130.transaction import Transaction
+from cp2130.usb.usb import USBDevice
+
+# GPIO.0 and GPIO.1 are native chip-selects; GPIO.2 and GPIO.3 are
+# push-pull outputs driven as chip-selects.
+PIN_CONFIG = bytearray(20)
+PIN_CONFIG[0:4] = [0x03, 0x03, 0x02, 0x02]
+
+def _gpio_mask(num):
+    # The bit of a GPIO in the set_gpio_values level and mask words.
+    reg = registers.gpio_values_setter.default()
+    reg.set_level(num, LogicLevel.LOW)
+    return struct.unpack('>HH', reg.raw)[1]
+
+class FakeUSB(USBDevice):
+
+    def __init__(self):
+        """A stand-in for a CP2130's USB device that records chip-select
+        changes and bulk commands in order and loops write_read data
+        back.
+
+        """
+        self.events  = []
+        self.pending = b''
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if isinstance(wLengthOrData, int):
+            if bRequest == 0x6C:
+                return bytes(PIN_CONFIG)
+            return bytes(bytearray(wLengthOrData))
+        data = bytearray(wLengthOrData)
+        if bRequest == 0x25:
+            self.events.append(('cs', data[0], data[1]))
+        elif bRequest == 0x21:
+            (levels, mask) = struct.unpack('>HH', bytes(data))
+            self.events.append(('gpio', levels & mask, mask))
+        return len(data)
+
+    def write(self, endpoint, data):
+        (command, size) = struct.unpack('<2xBxI', data[:8])
+        payload = bytes(data[8:8 + size])
+        self.events.append((['read', 'write', 'write_read'][command], payload))
+        self.pending = payload
+        return len(data)
+
+    def read(self, endpoint, size):
+        return self.pending[:size]
+
+class TestChannelGroup(unittest.TestCase):
+
+    def setUp(self):
+        self.usb    = FakeUSB()
+        self.device = CP2130(CP2130Chip(self.usb))
+        del self.usb.events[:]
+
+    def test_write_selects_all_at_once(self):
+        d = self.device
+        ChannelGroup([d.channel3, d.channel1, d.channel0, d.channel2]).write(b'\x5a')
+        both = _gpio_mask(2) | _gpio_mask(3)
+        self.assertEqual(self.usb.events, [('cs', 0, 2), ('cs', 1, 1), ('gpio', 0, both),
+                                           ('write', b'\x5a'),
+                                           ('gpio', both, both), ('cs', 0, 0), ('cs', 1, 0)])
+
+    def test_boundary_toggles_manual_chip_selects(self):
+        d = self.device
+        ChannelGroup([d.channel2, d.channel3]).execute(Transaction().write(b'\x01').boundary().write(b'\x02'))
+        both = _gpio_mask(2) | _gpio_mask(3)
+        self.assertEqual(self.usb.events, [('gpio', 0, both), ('write', b'\x01'),
+                                           ('gpio', both, both), ('gpio', 0, both),
+                                           ('write', b'\x02'), ('gpio', both, both)])
+
+    def test_rejects_repeated_channel(self):
+        d = self.device
+        self.assertRaises(ValueError, ChannelGroup, [d.channel0, d.channel0])
+
+    def test_rejects_foreign_channel(self):
+        other = CP2130(CP2130Chip(FakeUSB()))
+        self.assertRaises(ValueError, ChannelGroup, [self.device.channel0, other.channel1])
+
+    def test_rejects_empty(self):
+        self.assertRaises(ValueError, ChannelGroup, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import unittest
+
+from cp2130.chip import CP2130Chip
+from cp2130.provision import Profile, ProvisionError, Provisioner, UnitReport
+from cp2130.usb.usb import USBDevice
+from cp2130.usb_config import LockedFieldError, USBConfig
+
+GET_USB_CONFIG = 0x60
+GET_LOCK_BYTE  = 0x6E
+
+# The usb_config mask bits and the register bytes each one writes.
+_USB_CONFIG_MASK = [(0x01, 0, 2), (0x02, 2, 4), (0x04, 4, 5), (0x08, 5, 6), (0x10, 6, 8), (0x80, 8, 9)]
+
+class FakeROM(USBDevice):
+
+    def __init__(self, ignore=()):
+        """A stand-in for a CP2130's USB device with a blank OTP ROM. The
+        setters (even bRequests plus one) write the registers read by
+        the getters, and are recorded.
+
+        :param: ignore The bRequests of writes the ROM accepts but drops.
+
+        """
+        self.rom = {
+            GET_USB_CONFIG : bytearray(9),
+            GET_LOCK_BYTE  : bytearray(b'\xff\xff'),
+        }
+        for request in (0x62, 0x66, 0x6A):
+            self.rom[request] = bytearray([2, 3]) + bytearray(62)
+        for request in (0x64, 0x68):
+            self.rom[request] = bytearray(64)
+        self.ignore = ignore
+        self.writes = []
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if isinstance(wLengthOrData, int):
+            return bytes(self.rom.get(bRequest, bytearray(wLengthOrData))[:wLengthOrData])
+        data = bytearray(wLengthOrData)
+        self.writes.append(bRequest)
+        if bRequest in self.ignore:
+            return len(data)
+        target = self.rom.setdefault(bRequest - 1, bytearray(len(data)))
+        if bRequest - 1 == GET_USB_CONFIG:
+            for (bit, start, end) in _USB_CONFIG_MASK:
+                if data[9] & bit:
+                    target[start:end] = data[start:end]
+        else:
+            target[:len(data)] = data
+        return len(data)
+
+class FakeDevice(object):
+
+    def __init__(self, rom):
+        """A stand-in for cp2130.core.CP2130 with only its chip and USB
+        configuration.
+
+        """
+        self.chip = CP2130Chip(rom)
+        self.usb  = USBConfig(self.chip)
+
+PROFILE = Profile(usb={'vendor_id': 0x1234, 'product_string': u'Widget'}, lock=['vid'])
+
+class TestProvisioner(unittest.TestCase):
+
+    def test_programs_only_differences(self):
+        rom = FakeROM()
+        report = Provisioner(PROFILE).provision(FakeDevice(rom), u'0001')
+        self.assertEqual(report.status, UnitReport.PROGRAMMED)
+        self.assertTrue(report.verified)
+        self.assertEqual(report.writes, ['product_string', 'serial_string', 'vendor_id', 'lock'])
+        self.assertEqual(FakeDevice(rom).usb.read('vendor_id', 'product_string', 'serial_string'),
+                         {'vendor_id': 0x1234, 'product_string': u'Widget', 'serial_string': u'0001'})
+
+        del rom.writes[:]
+        report = Provisioner(PROFILE).provision(FakeDevice(rom), u'0001')
+        self.assertEqual(report.status, UnitReport.UNCHANGED)
+        self.assertEqual(rom.writes, [])
+
+    def test_locked_field_fails_before_writing(self):
+        rom = FakeROM()
+        rom.rom[GET_LOCK_BYTE][0] = 0xFE    # vid locked
+        report = Provisioner(PROFILE).provision(FakeDevice(rom), u'0001')
+        self.assertEqual(report.status, UnitReport.FAILED)
+        self.assertTrue(isinstance(report.error, LockedFieldError))
+        self.assertEqual(rom.writes, [])
+
+    def test_readback_mismatch(self):
+        rom = FakeROM(ignore=[0x67])
+        report = Provisioner(PROFILE).provision(FakeDevice(rom))
+        self.assertEqual(report.status, UnitReport.FAILED)
+        self.assertTrue(isinstance(report.error, ProvisionError))
+
+    def test_run(self):
+        roms = [FakeROM(), FakeROM(ignore=[0x67]), FakeROM()]
+        report = Provisioner(PROFILE, max_workers=2).run([FakeDevice(rom) for rom in roms], [u'1', u'2', u'3'])
+        self.assertEqual([unit.serial for unit in report.units], [u'1', u'2', u'3'])
+        self.assertEqual((len(report.programmed), len(report.failed)), (2, 1))
+        self.assertFalse(report.units[1].ok)
+
+    def test_run_needs_a_serial_per_device(self):
+        self.assertRaises(ValueError, Provisioner(PROFILE).run, [FakeDevice(FakeROM())] * 2, [u'1'])
+
+class TestProfile(unittest.TestCase):
+
+    def test_rejects_serial(self):
+        self.assertRaises(ValueError, Profile, usb={'serial_string': u'0001'})
+
+    def test_rejects_unknown_lock(self):
+        self.assertRaises(ValueError, Profile, lock=['color'])
+
+    def test_rounds_max_power(self):
+        self.assertEqual(Profile(usb={'max_power': 101}).usb['max_power'], 100)
+
+if __name__ == '__main__':
+    unittest.main()
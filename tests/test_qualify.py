@@ -0,0 +1,108 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cp2130.qualify import load_clock, loopback, qualify_clock
+
+class FakeUSBConfig(object):
+
+    def read(self, *names):
+        return {'serial_string': u'ABC'}
+
+class FakeMaster(object):
+
+    def __init__(self):
+        self.usb = FakeUSBConfig()
+
+class FakeChannel(object):
+
+    def __init__(self, limit, clock_frequency=93800):
+        """A stand-in for cp2130.spi.SPIChannel whose slave corrupts data
+        clocked faster than a limit.
+
+        """
+        self.master          = FakeMaster()
+        self.cs_num          = 1
+        self.limit           = limit
+        self.clock_frequency = clock_frequency
+        self.trials          = []
+
+    def write_read(self, data):
+        self.trials.append(self.clock_frequency)
+        if self.clock_frequency > self.limit:
+            return b'\x00' * len(data)
+        return data
+
+class TestQualifyClock(unittest.TestCase):
+
+    def test_stops_at_first_failure(self):
+        channel = FakeChannel(limit=1500000)
+        result = qualify_clock(channel, loopback(16), trials=3)
+        self.assertEqual(result.frequency, 1500000)
+        self.assertEqual(channel.clock_frequency, 1500000)
+        self.assertEqual([step.frequency for step in result.steps],
+                         [93800, 187500, 375000, 750000, 1500000, 3000000])
+        self.assertEqual([step.reliable for step in result.steps], [True] * 5 + [False])
+        self.assertEqual(channel.trials.count(3000000), 3)
+        self.assertNotIn(6000000, channel.trials)
+        self.assertEqual(result.steps[0].bytes, 16)
+
+    def test_margin(self):
+        self.assertEqual(qualify_clock(FakeChannel(limit=1500000), loopback(), trials=1, margin=2).frequency, 375000)
+        self.assertEqual(qualify_clock(FakeChannel(limit=1500000), loopback(), trials=1, margin=10).frequency, 93800)
+
+    def test_nothing_reliable(self):
+        channel = FakeChannel(limit=0, clock_frequency=750000)
+        result = qualify_clock(channel, loopback(), trials=1)
+        self.assertIsNone(result.frequency)
+        self.assertEqual(channel.clock_frequency, 750000)
+
+    def test_no_apply_restores_clock(self):
+        channel = FakeChannel(limit=1500000, clock_frequency=750000)
+        self.assertEqual(qualify_clock(channel, loopback(), trials=1, apply=False).frequency, 1500000)
+        self.assertEqual(channel.clock_frequency, 750000)
+
+    def test_error_rate_and_exceptions(self):
+        calls = []
+        def verify(channel):
+            calls.append(channel.clock_frequency)
+            if len(calls) % 4 == 0:
+                raise IOError("Pipe error")
+            return True
+        channel = FakeChannel(limit=12000000)
+        result = qualify_clock(channel, verify, trials=4, max_error_rate=0.25, frequencies=[93800, 187500])
+        self.assertEqual([step.errors for step in result.steps], [1, 1])
+        self.assertEqual(result.frequency, 187500)
+        result = qualify_clock(channel, verify, trials=4, frequencies=[93800, 187500])
+        self.assertIsNone(result.frequency)
+
+    def test_persist(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'clocks.json')
+            qualify_clock(FakeChannel(limit=750000), loopback(), trials=1, persist=path)
+            channel = FakeChannel(limit=750000)
+            self.assertEqual(load_clock(channel, path), 750000)
+            self.assertEqual(channel.clock_frequency, 750000)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import unittest
+
+from cp2130.regmap import RegisterMap
+from cp2130.transaction import Transaction
+
+class FakeSlave(object):
+
+    def __init__(self, addr_bytes=1, big_endian=True):
+        """A stand-in for cp2130.spi.SPIChannel in front of a register-based
+        slave with 8-bit registers, a 0x80 read flag and auto-increment.
+
+        Each chip-select frame is one access: the address, then the
+        values written or read.
+
+        """
+        self.addr_bytes   = addr_bytes
+        self.big_endian   = big_endian
+        self.regs         = {}
+        self.frames       = []
+        self.transactions = 0
+
+    def transaction(self, fill=0x00):
+        return Transaction(self, fill)
+
+    def _access(self, frame):
+        header = bytearray(frame[:self.addr_bytes])
+        read = bool(header[0] & 0x80)
+        header[0] &= 0x7F
+        if not self.big_endian:
+            header.reverse()
+        reg = 0
+        for b in header:
+            reg = (reg << 8) | b
+        data = bytearray(frame[self.addr_bytes:])
+        if read:
+            return header + bytearray(self.regs.get(reg + i, 0) for i in range(len(data)))
+        for (i, value) in enumerate(data):
+            self.regs[reg + i] = value
+        return bytearray(frame)
+
+    def execute(self, transaction):
+        self.transactions += 1
+        results = []
+        for segment in transaction.compile():
+            self.frames.append(segment.data)
+            response = bytes(self._access(segment.data))
+            for (offset, length) in segment.reads:
+                results.append(response[offset:offset + length])
+        return results
+
+class TestFraming(unittest.TestCase):
+
+    def test_big_endian_address(self):
+        slave = FakeSlave(addr_bytes=2)
+        RegisterMap(slave, addr_bits=16).write(0x0102, 0xAB)
+        self.assertEqual(slave.frames, [b'\x01\x02\xab'])
+
+    def test_little_endian_address(self):
+        slave = FakeSlave(addr_bytes=2, big_endian=False)
+        RegisterMap(slave, addr_bits=16, big_endian=False).write(0x0102, 0xAB)
+        self.assertEqual(slave.frames, [b'\x02\x01\xab'])
+        self.assertEqual(slave.regs, {0x0102: 0xAB})
+
+    def test_read_flag_on_first_byte(self):
+        slave = FakeSlave(addr_bytes=2, big_endian=False)
+        slave.regs[0x0102] = 0x5A
+        regmap = RegisterMap(slave, addr_bits=16, big_endian=False)
+        self.assertEqual(regmap.read(0x0102), 0x5A)
+        self.assertEqual(slave.frames, [b'\x82\x01\x00'])
+
+    def test_wide_values(self):
+        slave = FakeSlave()
+        RegisterMap(slave, val_bits=16, big_endian=False).bulk_write(0x10, [0x0102])
+        self.assertEqual(slave.frames, [b'\x10\x02\x01'])
+
+class TestCache(unittest.TestCase):
+
+    def test_read_is_cached(self):
+        slave = FakeSlave()
+        slave.regs[0x01] = 0x11
+        regmap = RegisterMap(slave)
+        self.assertEqual(regmap.read(0x01), 0x11)
+        self.assertEqual(regmap.read(0x01), 0x11)
+        self.assertEqual(slave.transactions, 1)
+
+    def test_volatile_is_not_cached(self):
+        slave = FakeSlave()
+        regmap = RegisterMap(slave, volatile=[0x01])
+        regmap.read(0x01)
+        regmap.read(0x01)
+        self.assertEqual(slave.transactions, 2)
+
+    def test_unchanged_update_bits_does_not_write(self):
+        slave = FakeSlave()
+        regmap = RegisterMap(slave, defaults={0x01: 0x0F})
+        self.assertFalse(regmap.update_bits(0x01, 0x03, 0x03))
+        self.assertEqual(slave.transactions, 0)
+
+    def test_sync_coalesces_runs(self):
+        slave = FakeSlave()
+        regmap = RegisterMap(slave)
+        regmap.cache_only = True
+        for (reg, value) in [(0x01, 1), (0x02, 2), (0x05, 5)]:
+            regmap.write(reg, value)
+        regmap.cache_only = False
+        self.assertEqual(regmap.sync(), 3)
+        self.assertEqual(slave.frames, [b'\x01\x01\x02', b'\x05\x05'])
+        self.assertEqual(slave.transactions, 1)
+        self.assertEqual(regmap.dirty, [])
+
+    def test_bulk_read_keeps_dirty_values(self):
+        slave = FakeSlave()
+        regmap = RegisterMap(slave)
+        regmap.cache_only = True
+        regmap.write(0x02, 0x22)
+        regmap.cache_only = False
+        self.assertEqual(regmap.bulk_read(0x01, 3), [0, 0x22, 0])
+        self.assertEqual(regmap.dirty, [0x02])
+
+    def test_bulk_read_rejects_precious(self):
+        regmap = RegisterMap(FakeSlave(), precious=[0x02])
+        self.assertRaises(ValueError, regmap.bulk_read, 0x01, 3)
+
+if __name__ == '__main__':
+    unittest.main()
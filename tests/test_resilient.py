@@ -0,0 +1,154 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import collections
+import struct
+import threading
+import unittest
+
+from cp2130.chip import CP2130Chip, registers
+from cp2130.data import ChipSelectControl, LogicLevel, OutputMode
+from cp2130.resilient import DisconnectedError, ReconnectStats, ResilientUSBDevice, _gpio_mask
+from cp2130.usb.usb import NoDeviceError, USBDevice
+
+SET_GPIO_VALUES = 0x21
+
+class FakeUSB(USBDevice):
+
+    def __init__(self):
+        """A stand-in for a CP2130's USB device recording control OUT
+        transfers as (bRequest, data) tuples.
+
+        """
+        self.writes = []
+        self.closed = False
+        self.gone   = False
+
+    def close(self):
+        self.closed = True
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if self.gone:
+            raise NoDeviceError("No such device")
+        self.writes.append((bRequest, bytes(bytearray(wLengthOrData))))
+        return len(wLengthOrData)
+
+class FakeBackend(object):
+
+    def __init__(self, device):
+        self.device = device
+
+    def find(self, vid, pid, serial):
+        if self.device is None:
+            raise NoDeviceError("No device found")
+        return self.device
+
+def resilient(device, block=False):
+    # A ResilientUSBDevice without a hotplug listener or reconnect
+    # thread, which need libusb1, so the cache and replay can be
+    # driven directly.
+    dev = ResilientUSBDevice.__new__(ResilientUSBDevice)
+    dev.vid        = 0x10c4
+    dev.pid        = 0x87A0
+    dev.serial     = u'ABC'
+    dev.block      = block
+    dev.timeout    = None
+    dev.stats      = ReconnectStats()
+    dev._backend   = FakeBackend(None)
+    dev._no_device = (NoDeviceError,)
+    dev._device    = device
+    dev._cache     = collections.OrderedDict()
+    dev._condition = threading.Condition(threading.RLock())
+    dev._connected = True
+    dev._closed    = False
+    dev._left_at   = None
+    dev._arrived   = threading.Event()
+    return dev
+
+def levels(*pairs):
+    reg = registers.gpio_values_setter.default()
+    for (num, level) in pairs:
+        reg.set_level(num, level)
+    return reg
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dev  = resilient(FakeUSB())
+        self.chip = CP2130Chip(self.dev)
+
+    def cached(self):
+        return [(request, data) for (_, request, _, _, data) in self.dev._cache.values()]
+
+    def test_keeps_last_write_per_register(self):
+        self.chip.set_clock_divider(registers.clock_divider.make(2))
+        self.chip.set_clock_divider(registers.clock_divider.make(3))
+        self.assertEqual(self.cached(), [(0x47, b'\x03')])
+
+    def test_channel_registers_are_kept_per_channel(self):
+        cs = registers.one_gpio_chip_select.make(ChipSelectControl.ENABLED)
+        self.chip.set_gpio_chip_select(1, cs)
+        self.chip.set_gpio_chip_select(2, cs)
+        self.chip.set_gpio_chip_select(1, registers.one_gpio_chip_select.make(ChipSelectControl.DISABLED))
+        self.assertEqual(self.cached(), [(0x25, b'\x02\x01'), (0x25, b'\x01\x00')])
+
+    def test_merges_gpio_values(self):
+        self.chip.set_gpio_values(levels((0, LogicLevel.HIGH), (1, LogicLevel.HIGH)))
+        self.chip.set_gpio_values(levels((1, LogicLevel.LOW), (2, LogicLevel.HIGH)))
+        [(request, data)] = self.cached()
+        (level, mask) = struct.unpack('>HH', data)
+        self.assertEqual(mask, _gpio_mask(0) | _gpio_mask(1) | _gpio_mask(2))
+        self.assertEqual(level & mask, _gpio_mask(0) | _gpio_mask(2))
+
+    def test_mode_and_level_supersedes_level(self):
+        self.chip.set_gpio_values(levels((0, LogicLevel.HIGH), (1, LogicLevel.HIGH)))
+        self.chip.set_gpio_mode_and_level(0, registers.one_gpio_mode_and_level.make(OutputMode.PUSH_PULL, LogicLevel.LOW))
+        requests = dict(self.cached())
+        (_, mask) = struct.unpack('>HH', requests[SET_GPIO_VALUES])
+        self.assertEqual(mask, _gpio_mask(1))
+        self.chip.set_gpio_mode_and_level(1, registers.one_gpio_mode_and_level.make(OutputMode.PUSH_PULL, LogicLevel.LOW))
+        self.assertNotIn(SET_GPIO_VALUES, dict(self.cached()))
+
+    def test_ignores_other_writes(self):
+        self.dev.control_transfer(0x40, 0x10, 0, 0, b'\x00\x00')
+        self.assertEqual(self.cached(), [])
+
+class TestReconnect(unittest.TestCase):
+
+    def test_disconnect_and_replay(self):
+        old = FakeUSB()
+        dev = resilient(old)
+        chip = CP2130Chip(dev)
+        chip.set_clock_divider(registers.clock_divider.make(2))
+        chip.set_full_threshold(registers.full_threshold.make(16))
+
+        old.gone = True
+        self.assertRaises(DisconnectedError, chip.set_clock_divider, registers.clock_divider.make(4))
+        self.assertTrue(old.closed)
+        self.assertFalse(dev.connected)
+        self.assertEqual(dev.stats.disconnects, 1)
+        self.assertRaises(DisconnectedError, chip.set_clock_divider, registers.clock_divider.make(4))
+
+        self.assertFalse(dev._reconnect())
+        new = FakeUSB()
+        dev._backend = FakeBackend(new)
+        self.assertTrue(dev._reconnect())
+        self.assertTrue(dev.connected)
+        self.assertEqual(new.writes, [(0x47, b'\x02'), (0x35, b'\x10')])
+        self.assertEqual((dev.stats.reconnects, dev.stats.replayed), (1, 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cp2130.chip import commands
+from cp2130.rom_cache import CachedROMDevice, ROMCache
+from cp2130.usb.usb import USBDevice
+
+LOCK       = commands.get_lock_byte
+SERIAL     = commands.get_serial_string
+USB_CONFIG = commands.get_usb_config
+
+class FakeUSB(USBDevice):
+
+    def __init__(self, serial=u'ABC'):
+        """A stand-in for a CP2130's USB device with an OTP ROM, counting the
+        control transfers that reach it by bRequest.
+
+        """
+        raw = serial.encode('utf-16-le')
+        self.rom = {
+            LOCK.b_request       : b'\xff\xff',
+            SERIAL.b_request     : (bytearray([2 + len(raw), 0x03]) + raw).ljust(SERIAL.w_length, b'\x00'),
+            USB_CONFIG.b_request : b'\x01' * USB_CONFIG.w_length,
+        }
+        self.reads = {}
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if not isinstance(wLengthOrData, int):
+            # Programming a field locks it.
+            self.rom[LOCK.b_request] = b'\x00\xff'
+            self.rom[USB_CONFIG.b_request] = b'\x02' * USB_CONFIG.w_length
+            return len(wLengthOrData)
+        self.reads[bRequest] = self.reads.get(bRequest, 0) + 1
+        return bytes(self.rom[bRequest][:wLengthOrData])
+
+def usb_config(device):
+    return device.control_transfer(0xC0, USB_CONFIG.b_request, 0, 0, USB_CONFIG.w_length).tobytes()
+
+class TestROMCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ROMCache(os.path.join(self.directory, 'cp2130', 'rom.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_second_open_is_served_from_cache(self):
+        usb = FakeUSB()
+        usb_config(CachedROMDevice(usb, self.cache))
+        device = CachedROMDevice(usb, self.cache)
+        self.assertEqual(device.serial, u'ABC')
+        self.assertEqual(usb_config(device), b'\x01' * USB_CONFIG.w_length)
+        self.assertEqual(usb.reads[USB_CONFIG.b_request], 1)
+        self.assertEqual((device.hits, device.misses), (1, 0))
+
+    def test_changed_lock_byte_discards_entry(self):
+        usb = FakeUSB()
+        usb_config(CachedROMDevice(usb, self.cache))
+        usb.rom[LOCK.b_request] = b'\x00\xff'
+        usb.rom[USB_CONFIG.b_request] = b'\x02' * USB_CONFIG.w_length
+        self.assertEqual(usb_config(CachedROMDevice(usb, self.cache)), b'\x02' * USB_CONFIG.w_length)
+        self.assertEqual(usb.reads[USB_CONFIG.b_request], 2)
+
+    def test_otp_write_invalidates(self):
+        usb = FakeUSB()
+        device = CachedROMDevice(usb, self.cache)
+        usb_config(device)
+        device.control_transfer(0x40, commands.set_usb_config.b_request, 0, 0xA5F1, b'\x00' * 10)
+        self.assertEqual(usb_config(device), b'\x02' * USB_CONFIG.w_length)
+        self.assertEqual(self.cache.get(u'ABC', b'\x00\xff')[USB_CONFIG.b_request], b'\x02' * USB_CONFIG.w_length)
+
+    def test_invalidate(self):
+        self.cache.put(u'A', b'\xff\xff', {1: b'\x01'})
+        self.cache.put(u'B', b'\xff\xff', {1: b'\x02'})
+        self.cache.invalidate(u'A')
+        self.assertEqual(self.cache.get(u'A', b'\xff\xff'), {})
+        self.assertEqual(self.cache.get(u'B', b'\xff\xff'), {1: b'\x02'})
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get(u'B', b'\xff\xff'), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import collections
+import io
+import struct
+import unittest
+
+from cp2130.chip import CP2130Chip, registers
+from cp2130.core import CP2130
+from cp2130.data import LogicLevel
+from cp2130.sdcard import SDCard, SDError
+from cp2130.usb.usb import USBDevice
+
+# GPIO.0 is a native chip-select; GPIO.1 is a push-pull output for the
+# card's chip-select.
+PIN_CONFIG = bytearray(20)
+PIN_CONFIG[0:2] = [0x03, 0x02]
+
+BLOCK = 512
+
+def _gpio_mask(num):
+    reg = registers.gpio_values_setter.default()
+    reg.set_level(num, LogicLevel.LOW)
+    return struct.unpack('>HH', reg.raw)[1]
+
+class FakeCard(object):
+
+    def __init__(self, mmc=False, blocks=1024):
+        """An SD card (or an MMC card) in SPI mode, clocked one byte at a
+        time. High-capacity SD cards are block addressed; MMC cards are
+        byte addressed.
+
+        """
+        self.mmc      = mmc
+        self.blocks   = blocks
+        self.data     = {}
+        self.reject   = False
+        self.idle     = True
+        self.acmd     = False
+        self.op_polls = 0
+
+        self._out     = collections.deque()
+        self._command = bytearray()
+        self._reading = None    # next block of a multi-block read
+        self._writing = None    # 'single' or 'multi'
+        self._block   = None    # bytes of a block being written
+        self._lba     = 0
+
+    def deselect(self):
+        self._out.clear()
+        self._command = bytearray()
+        self._block   = None
+
+    def _lba_of(self, arg):
+        return arg // BLOCK if self.mmc else arg
+
+    def _send_block(self, data):
+        self._out.extend(bytearray([0xFF, 0xFE]) + bytearray(data) + bytearray(2))
+
+    def _csd(self):
+        csd = bytearray(16)
+        if self.mmc:
+            # CSD version 1: READ_BL_LEN 9, C_SIZE 255, C_SIZE_MULT 0.
+            (csd[5], csd[7], csd[8]) = (0x09, 0x3F, 0xC0)
+        else:
+            # CSD version 2: C_SIZE (blocks / 1024) - 1.
+            csd[0] = 0x40
+            c_size = self.blocks // 1024 - 1
+            (csd[7], csd[8], csd[9]) = ((c_size >> 16) & 0x3F, (c_size >> 8) & 0xFF, c_size & 0xFF)
+        return csd
+
+    def _execute(self, cmd, arg):
+        acmd, self.acmd = self.acmd, False
+        response = bytearray()
+        if cmd == 0:
+            self.idle = True
+            r1 = 0x01
+        elif cmd == 8:
+            if self.mmc:
+                r1 = 0x05
+            else:
+                r1 = 0x01
+                response = bytearray([0x00, 0x00, 0x01, arg & 0xFF])
+        elif cmd == 55:
+            self.acmd = True
+            r1 = 0x01 if self.idle else 0x00
+        elif cmd == 41 and acmd:
+            if self.mmc:
+                r1 = 0x05
+            else:
+                self.op_polls += 1
+                self.idle = self.op_polls < 2
+                r1 = 0x01 if self.idle else 0x00
+        elif cmd == 1 and self.mmc:
+            self.op_polls += 1
+            self.idle = self.op_polls < 2
+            r1 = 0x01 if self.idle else 0x00
+        elif cmd == 58:
+            r1 = 0x00
+            response = bytearray([0xC0, 0xFF, 0x80, 0x00])
+        elif cmd == 9:
+            r1 = 0x00
+        elif cmd == 16:
+            r1 = 0x00
+        elif cmd in (17, 18):
+            r1 = 0x00
+            self._lba = self._lba_of(arg)
+        elif cmd == 12:
+            self._reading = None
+            self._out.clear()
+            self._out.extend([0xFF, 0x00, 0x00, 0x00])
+            return
+        elif cmd in (24, 25):
+            r1 = 0x00
+            self._lba = self._lba_of(arg)
+            self._writing = 'single' if cmd == 24 else 'multi'
+        else:
+            r1 = 0x04
+
+        self._out.extend(bytearray([0xFF, r1]) + response)
+        if cmd == 9:
+            self._send_block(self._csd())
+        elif cmd == 17:
+            self._send_block(self.data.get(self._lba, bytes(BLOCK)))
+        elif cmd == 18:
+            self._reading = self._lba
+
+    def _receive(self, byte):
+        if self._block is None:
+            if byte == 0xFD and self._writing == 'multi':
+                self._writing = None
+                self._out.extend([0xFF, 0x00])
+            elif byte in (0xFE, 0xFC):
+                self._block = bytearray()
+            return
+        self._block.append(byte)
+        if len(self._block) < BLOCK + 2:
+            return
+        if self.reject:
+            self._out.extend([0x0B, 0x00])
+        else:
+            self.data[self._lba] = bytes(self._block[:BLOCK])
+            self._out.extend([0x05, 0x00, 0x00])
+        self._lba += 1
+        self._block = None
+        if self._writing == 'single':
+            self._writing = None
+
+    def clock(self, byte):
+        """Clocks one byte in on MOSI and returns the byte clocked out on
+        MISO.
+
+        """
+        if not self._out and self._reading is not None:
+            self._send_block(self.data.get(self._reading, bytes(BLOCK)))
+            self._reading += 1
+        out = self._out.popleft() if self._out else 0xFF
+
+        if self._writing is not None and not self._command:
+            self._receive(byte)
+        elif self._command or (byte & 0xC0) == 0x40:
+            self._command.append(byte)
+            if len(self._command) == 6:
+                (cmd, arg) = struct.unpack('>BI', bytes(self._command[:5]))
+                self._command = bytearray()
+                self._execute(cmd & 0x3F, arg)
+        return out
+
+class FakeUSB(USBDevice):
+
+    def __init__(self, card):
+        """A stand-in for a CP2130's USB device wired to a card on GPIO.1.
+
+        """
+        self.card     = card
+        self.selected = False
+        self.pending  = b''
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if isinstance(wLengthOrData, int):
+            if bRequest == 0x6C:
+                return bytes(PIN_CONFIG)
+            return bytes(bytearray(wLengthOrData))
+        data = bytearray(wLengthOrData)
+        if bRequest == 0x21:
+            (levels, mask) = struct.unpack('>HH', bytes(data))
+            if mask & _gpio_mask(1):
+                self.selected = not (levels & _gpio_mask(1))
+                if not self.selected:
+                    self.card.deselect()
+        return len(data)
+
+    def write(self, endpoint, data):
+        (command, size) = struct.unpack('<2xBxI', bytes(data[:8]))
+        mosi = bytearray(data[8:8 + size])
+        if self.selected:
+            miso = bytearray(self.card.clock(b) for b in mosi)
+        else:
+            miso = bytearray(b'\xff' * size)
+        self.pending = bytes(miso)
+        return len(data)
+
+    def read(self, endpoint, size):
+        return self.pending[:size]
+
+def pattern(blocks, seed=0):
+    return bytes(bytearray((i * 7 + seed) & 0xFF for i in range(blocks * BLOCK)))
+
+class TestSDCard(unittest.TestCase):
+
+    def card(self, fake=None, **kwargs):
+        self.fake = fake or FakeCard()
+        device = CP2130(CP2130Chip(FakeUSB(self.fake)))
+        return SDCard(device.channel1, timeout=0.5, **kwargs)
+
+    def test_initialize(self):
+        card = self.card()
+        self.assertTrue(card.high_capacity)
+        self.assertEqual(card.block_count, 1024)
+
+    def test_initialize_mmc(self):
+        card = self.card(FakeCard(mmc=True))
+        self.assertFalse(card.high_capacity)
+        self.assertEqual(card.block_count, 1024)
+        card.write_blocks(3, pattern(1))
+        self.assertEqual(self.fake.data[3], pattern(1))
+
+    def test_requires_gpio_chip_select(self):
+        device = CP2130(CP2130Chip(FakeUSB(FakeCard())))
+        self.assertRaises(ValueError, SDCard, device.channel0)
+
+    def test_single_block(self):
+        card = self.card()
+        card.write_blocks(5, pattern(1))
+        self.assertEqual(self.fake.data[5], pattern(1))
+        self.assertEqual(bytes(card.read_blocks(5, 1)), pattern(1))
+
+    def test_multiple_blocks(self):
+        card = self.card(chunk_size=700)
+        card.write_blocks(10, pattern(3))
+        self.assertEqual([self.fake.data[10 + i] for i in range(3)],
+                         [pattern(3)[i * BLOCK:(i + 1) * BLOCK] for i in range(3)])
+        self.assertEqual(bytes(card.read_blocks(10, 3)), pattern(3))
+        self.assertEqual(bytes(card.read_blocks(11, 1)), pattern(3)[BLOCK:2 * BLOCK])
+
+    def test_out_of_range(self):
+        card = self.card()
+        self.assertRaises(ValueError, card.read_blocks, 1023, 2)
+
+    def test_cache(self):
+        card = self.card(cache_blocks=4)
+        card.write_blocks(0, pattern(2))
+        card.read_blocks(0, 2)
+        self.fake.data[0] = bytes(BLOCK)
+        self.assertEqual(bytes(card.read_blocks(0, 2)), pattern(2))
+        self.assertEqual((card.hits, card.misses), (2, 2))
+        card.invalidate()
+        self.assertEqual(bytes(card.read_blocks(0, 1)), bytes(BLOCK))
+
+    def test_rejected_write_drops_cached_blocks(self):
+        card = self.card(cache_blocks=4)
+        card.write_blocks(0, pattern(1))
+        card.read_blocks(0, 1)
+        self.fake.reject = True
+        self.assertRaises(SDError, card.write_blocks, 0, pattern(1, seed=1))
+        self.fake.reject = False
+        self.fake.data[0] = pattern(1, seed=2)
+        self.assertEqual(bytes(card.read_blocks(0, 1)), pattern(1, seed=2))
+
+    def test_file_like(self):
+        card = self.card()
+        f = io.BufferedRandom(card)
+        f.seek(BLOCK - 2)
+        f.write(b'\x01\x02\x03\x04')
+        f.flush()
+        self.assertEqual(self.fake.data[0][-2:] + self.fake.data[1][:2], b'\x01\x02\x03\x04')
+        f.seek(BLOCK - 1)
+        self.assertEqual(f.read(2), b'\x02\x03')
+
+if __name__ == '__main__':
+    unittest.main()
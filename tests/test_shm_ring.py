@@ -0,0 +1,76 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import unittest
+
+from cp2130 import shm_ring
+from cp2130.shm_ring import SharedRingBuffer
+
+class FakeChannel(object):
+
+    def __init__(self):
+        """A stand-in for cp2130.spi.SPIChannel that fills each read with a
+        counter and records the buffers it was given.
+
+        """
+        self.count   = 0
+        self.buffers = []
+
+    def read(self, length):
+        raise AssertionError("stream() should read in place")
+
+    def readinto(self, buffer):
+        self.count += 1
+        self.buffers.append(len(buffer))
+        buffer[:] = bytes(bytearray([self.count]) * len(buffer))
+        return len(buffer)
+
+@unittest.skipIf(shm_ring.shared_memory is None, "requires multiprocessing.shared_memory")
+class TestSharedRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = SharedRingBuffer(slot_size=16, slots=4)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def test_stream_reads_into_slots(self):
+        channel = FakeChannel()
+        reader  = self.ring.reader()
+        self.ring.stream(channel, chunk_size=8, chunks=3)
+        self.assertEqual(channel.buffers, [8, 8, 8])
+        self.assertEqual([reader.read(block=False) for _ in range(3)],
+                         [(0, b'\x01' * 8), (1, b'\x02' * 8), (2, b'\x03' * 8)])
+        self.assertIsNone(reader.read(block=False))
+
+    def test_overrun(self):
+        reader = self.ring.reader()
+        for i in range(6):
+            self.ring.write(bytes(bytearray([i])))
+        self.assertEqual(reader.read(block=False), (2, b'\x02'))
+        self.assertEqual((reader.overruns, reader.lost), (1, 2))
+
+    def test_missing_shared_memory(self):
+        shared_memory = shm_ring.shared_memory
+        shm_ring.shared_memory = None
+        try:
+            self.assertRaises(ImportError, SharedRingBuffer)
+        finally:
+            shm_ring.shared_memory = shared_memory
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import pickle
+import unittest
+
+from cp2130.chip import CP2130Chip
+from cp2130.state import ChipState
+from cp2130.usb.usb import USBDevice
+
+PIN_CONFIG = bytearray(20)
+PIN_CONFIG[0:11] = [0x02, 0x00] + [0x03] * 9   # gpio0 push-pull, gpio1 input
+
+class FakeUSB(USBDevice):
+
+    def __init__(self, levels=(0x00, 0x00)):
+        """A stand-in for a CP2130's USB device that answers the state
+        registers from fixed values and records every OUT transfer.
+
+        :param: levels The level bytes of get_gpio_mode_and_level.
+
+        """
+        self.levels = bytearray(levels)
+        self.writes = []
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if not isinstance(wLengthOrData, int):
+            self.writes.append((bRequest, bytes(bytearray(wLengthOrData))))
+            return len(wLengthOrData)
+        if bRequest == 0x6C:
+            return bytes(PIN_CONFIG)
+        if bRequest == 0x22:
+            return bytes(self.levels + bytearray([0x01, 0x00]))
+        if bRequest == 0x32:
+            return bytes(bytearray([wIndex]) + bytearray(7))
+        return bytes(bytearray(wLengthOrData))
+
+class TestChipState(unittest.TestCase):
+
+    def _snapshot(self, usb):
+        chip = CP2130Chip(usb)
+        return (chip, ChipState.read(chip))
+
+    def test_read(self):
+        (_, state) = self._snapshot(FakeUSB())
+        self.assertTrue(state.is_output(0))
+        self.assertFalse(state.is_output(1))
+        self.assertFalse(state.is_output(2))
+
+    def test_round_trip(self):
+        (chip, state) = self._snapshot(FakeUSB(levels=(0x08, 0x00)))
+        copy = pickle.loads(pickle.dumps(state))
+        self.assertEqual(copy, state)
+        self.assertEqual(hash(copy), hash(state))
+        self.assertEqual(copy.gpio_mode_and_level(0), state.gpio_mode_and_level(0))
+        self.assertEqual(copy.apply(chip, current=state), 0)
+        self.assertEqual(chip.usb_device.writes, [])
+
+    def test_restores_output_level(self):
+        (chip, state) = self._snapshot(FakeUSB(levels=(0x08, 0x00)))    # gpio0 high
+        chip.usb_device.levels[0] = 0x00
+        self.assertEqual(state.apply(chip), 1)
+        self.assertEqual([request for (request, _) in chip.usb_device.writes], [0x21])
+
+    def test_skips_input_and_chip_select_levels(self):
+        (chip, state) = self._snapshot(FakeUSB(levels=(0x30, 0x00)))    # gpio1, gpio2 high
+        chip.usb_device.levels[0] = 0x00
+        self.assertEqual(state.apply(chip), 0)
+        self.assertEqual(chip.usb_device.writes, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import struct
+import unittest
+
+from cp2130.chip import CP2130Chip, registers
+from cp2130.core import CP2130
+from cp2130.data import LogicLevel
+from cp2130.transaction import Transaction
+from cp2130.usb.usb import USBDevice
+
+# GPIO.0 and GPIO.1 are native chip-selects; GPIO.2 and GPIO.3 are
+# push-pull outputs driven as chip-selects.
+PIN_CONFIG = bytearray(20)
+PIN_CONFIG[0:4] = [0x03, 0x03, 0x02, 0x02]
+
+def _gpio_mask(num):
+    # The bit of a GPIO in the set_gpio_values level and mask words.
+    reg = registers.gpio_values_setter.default()
+    reg.set_level(num, LogicLevel.LOW)
+    return struct.unpack('>HH', reg.raw)[1]
+
+class FakeUSB(USBDevice):
+
+    def __init__(self):
+        """A stand-in for a CP2130's USB device that records chip-select
+        changes and bulk commands in order and loops write_read data
+        back.
+
+        """
+        self.events  = []
+        self.pending = b''
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if isinstance(wLengthOrData, int):
+            if bRequest == 0x6C:
+                return bytes(PIN_CONFIG)
+            return bytes(bytearray(wLengthOrData))
+        data = bytearray(wLengthOrData)
+        if bRequest == 0x25:
+            self.events.append(('cs', data[0], data[1]))
+        elif bRequest == 0x21:
+            (levels, mask) = struct.unpack('>HH', bytes(data))
+            self.events.append(('gpio', levels & mask, mask))
+        return len(data)
+
+    def write(self, endpoint, data):
+        (command, size) = struct.unpack('<2xBxI', data[:8])
+        payload = bytes(data[8:8 + size])
+        self.events.append((['read', 'write', 'write_read'][command], payload))
+        self.pending = payload
+        return len(data)
+
+    def read(self, endpoint, size):
+        return self.pending[:size]
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.usb    = FakeUSB()
+        self.device = CP2130(CP2130Chip(self.usb))
+        del self.usb.events[:]
+
+    def test_native_single_enable_each(self):
+        d = self.device
+        results = d.sweep([(d.channel1, b'\x11'), (d.channel0, b'\x00')])
+        self.assertEqual(results, {d.channel0: b'\x00', d.channel1: b'\x11'})
+        self.assertEqual(self.usb.events, [('cs', 0, 2), ('write_read', b'\x00'),
+                                           ('cs', 1, 2), ('write_read', b'\x11'),
+                                           ('cs', 1, 0)])
+
+    def test_manual_single_gpio_write_each(self):
+        d = self.device
+        d.sweep([(d.channel3, b'\x33'), (d.channel2, b'\x22')])
+        self.assertEqual(self.usb.events, [('gpio', 0, _gpio_mask(2)), ('write_read', b'\x22'),
+                                           ('gpio', _gpio_mask(2), _gpio_mask(2) | _gpio_mask(3)),
+                                           ('write_read', b'\x33'),
+                                           ('gpio', _gpio_mask(3), _gpio_mask(3))])
+
+    def test_native_before_manual(self):
+        d = self.device
+        results = d.sweep([(d.channel2, Transaction().write(b'\x02').read(1)), (d.channel0, b'\x00')])
+        self.assertEqual(results[d.channel2], [b'\x00'])
+        self.assertEqual([event[0] for event in self.usb.events],
+                         ['cs', 'write_read', 'cs', 'gpio', 'write_read', 'gpio'])
+
+    def test_rejects_repeated_channel(self):
+        d = self.device
+        self.assertRaises(ValueError, d.sweep, [(d.channel0, b'\x00'), (d.channel0, b'\x01')])
+        self.assertEqual(self.usb.events, [])
+
+    def test_rejects_foreign_channel(self):
+        other = CP2130(CP2130Chip(FakeUSB()))
+        self.assertRaises(ValueError, self.device.sweep, [(other.channel0, b'\x00')])
+
+if __name__ == '__main__':
+    unittest.main()
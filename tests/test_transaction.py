@@ -0,0 +1,128 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+
+from __future__ import absolute_import
+
+import contextlib
+import unittest
+
+from cp2130.cost import CostModel
+from cp2130.data.gpio import ChipSelectControl
+from cp2130.spi import ChannelGroup, SPIChannelCS
+from cp2130.transaction import Transaction
+
+class FakeWord(object):
+
+    raw = 0
+
+class FakeChip(object):
+
+    def __init__(self):
+        """A stand-in for cp2130.chip.CP2130Chip recording bulk writes.
+
+        """
+        self.writes       = []
+        self.chip_selects = []
+
+    def get_spi_words(self):
+        return [FakeWord()] * 11
+
+    def set_gpio_chip_select(self, cs_num, cs):
+        self.chip_selects.append((cs_num, cs.control))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+    def write(self, data):
+        self.writes.append(data)
+        return len(data)
+
+    def write_read(self, data):
+        self.writes.append(data)
+        return data
+
+class FakeGPIO(object):
+
+    def __init__(self, chip, num):
+        self.chip = chip
+        self.num  = num
+
+    @property
+    def cs_enable(self):
+        raise NotImplementedError
+
+    @cs_enable.setter
+    def cs_enable(self, cs_enable):
+        self.chip.chip_selects.append((self.num, cs_enable))
+
+class FakeMaster(object):
+
+    def __init__(self):
+        self.chip  = FakeChip()
+        self.gpio0 = FakeGPIO(self.chip, 0)
+
+class FakeChannel(object):
+
+    def __init__(self, master, cs_num):
+        self.master = master
+        self.cs_num = cs_num
+
+class TestCompile(unittest.TestCase):
+
+    def test_leading_delay_is_not_read_only(self):
+        segments = Transaction().delay(0.001).write(b'\x01').compile()
+        self.assertEqual(segments[0].data, b'')
+        self.assertFalse(segments[0].read_only)
+        self.assertEqual(segments[0].delay, 0.001)
+
+    def test_write_accepts_integer_sequences(self):
+        segments = Transaction().write([1, 2]).write_read(bytearray(b'\x03')).compile()
+        self.assertEqual(segments[0].data, b'\x01\x02\x03')
+
+    def test_boundary_costs_control_transfers(self):
+        transaction = Transaction().write(b'\x01').boundary().write(b'\x02')
+        self.assertEqual(CostModel(1000000).predict(transaction).control_transfers, 4)
+
+class TestSPIChannelCS(unittest.TestCase):
+
+    def test_boundary_cycles_chip_select(self):
+        master  = FakeMaster()
+        channel = SPIChannelCS(master, 0)
+        del master.chip.chip_selects[:]
+        channel.execute(Transaction().write(b'\x01').boundary().write_read(b'\x02'))
+        self.assertEqual(master.chip.writes, [b'\x01', b'\x02'])
+        self.assertEqual(master.chip.chip_selects,
+                         [(0, ChipSelectControl.ENABLED_EXCLUSIVE),
+                          (0, ChipSelectControl.DISABLED),
+                          (0, ChipSelectControl.ENABLED_EXCLUSIVE),
+                          (0, ChipSelectControl.DISABLED)])
+
+class TestChannelGroup(unittest.TestCase):
+
+    def setUp(self):
+        master = FakeMaster()
+        self.chip  = master.chip
+        self.group = ChannelGroup([FakeChannel(master, 0), FakeChannel(master, 1)])
+
+    def test_execute_leading_delay(self):
+        self.group.execute(Transaction().delay(0.001).write(b'\x01'))
+        self.assertEqual(self.chip.writes, [b'\x01'])
+
+    def test_execute_rejects_reads(self):
+        self.assertRaises(ValueError, self.group.execute, Transaction().read(2))
+
+if __name__ == '__main__':
+    unittest.main()
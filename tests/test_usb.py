@@ -0,0 +1,116 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import array
+import os
+import unittest
+
+import cp2130.usb
+from cp2130.chip import CP2130Chip
+from cp2130.usb.usb import USBDevice
+
+class FakeUSB(USBDevice):
+
+    def __init__(self):
+        """A stand-in for a USB device whose bulk reads return a counting
+        pattern and whose bulk writes are recorded.
+
+        """
+        self.writes = []
+
+    def read(self, endpoint, size):
+        return array.array('B', bytearray(i & 0xFF for i in range(1, size + 1)))
+
+    def write(self, endpoint, data):
+        self.writes.append(bytes(data))
+        return len(data)
+
+class FakeImporter(object):
+
+    def __init__(self, available):
+        """A stand-in for importlib importing only the given modules.
+
+        """
+        self.available = available
+        self.imported  = []
+
+    def import_module(self, name):
+        self.imported.append(name)
+        if name not in self.available:
+            raise ImportError("No module named %s"%name)
+        return name
+
+class TestBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.importlib = cp2130.usb.importlib
+        self.environ   = os.environ.pop('CP2130_USB_BACKEND', None)
+
+    def tearDown(self):
+        cp2130.usb.importlib = self.importlib
+        os.environ.pop('CP2130_USB_BACKEND', None)
+        if self.environ is not None:
+            os.environ['CP2130_USB_BACKEND'] = self.environ
+
+    def _available(self, *names):
+        cp2130.usb.importlib = FakeImporter(['cp2130.usb.%s'%name for name in names])
+        return cp2130.usb.importlib
+
+    def test_first_available(self):
+        self._available('libusb1', 'pyusb')
+        self.assertEqual(cp2130.usb.backend(), 'cp2130.usb.libusb1')
+
+    def test_falls_back(self):
+        importer = self._available('pyusb')
+        self.assertEqual(cp2130.usb.backend(), 'cp2130.usb.pyusb')
+        self.assertEqual(importer.imported, ['cp2130.usb.libusb1', 'cp2130.usb.pyusb'])
+
+    def test_none_available(self):
+        self._available()
+        self.assertRaises(ImportError, cp2130.usb.backend)
+
+    def test_named(self):
+        self._available('libusb1', 'pyusb')
+        self.assertEqual(cp2130.usb.backend('pyusb'), 'cp2130.usb.pyusb')
+
+    def test_environment(self):
+        self._available('libusb1', 'pyusb')
+        os.environ['CP2130_USB_BACKEND'] = 'pyusb'
+        self.assertEqual(cp2130.usb.backend(), 'cp2130.usb.pyusb')
+
+    def test_unknown(self):
+        self._available('libusb1', 'pyusb')
+        self.assertRaises(ValueError, cp2130.usb.backend, 'winusb')
+
+class TestReadinto(unittest.TestCase):
+
+    def test_bytes(self):
+        buffer = bytearray(4)
+        self.assertEqual(FakeUSB().readinto(0x82, buffer), 4)
+        self.assertEqual(buffer, bytearray(b'\x01\x02\x03\x04'))
+
+    def test_wide_items(self):
+        buffer = array.array('H', [0, 0])
+        self.assertEqual(FakeUSB().readinto(0x82, buffer), 4)
+        self.assertEqual(buffer.tobytes(), b'\x01\x02\x03\x04')
+
+    def test_chip_requests_bytes(self):
+        usb = FakeUSB()
+        CP2130Chip(usb).readinto(array.array('H', [0] * 4))
+        self.assertEqual(usb.writes, [b'\x00\x00\x00\x00\x08\x00\x00\x00'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import unittest
+
+from cp2130.chip import CP2130Chip
+from cp2130.usb.usb import USBDevice
+from cp2130.usb_config import LockedFieldError, USBConfig
+
+SET_USB_CONFIG      = 0x61
+SET_PRODUCT_STRING1 = 0x67
+SET_PRODUCT_STRING2 = 0x69
+GET_LOCK_BYTE       = 0x6E
+
+class FakeUSB(USBDevice):
+
+    def __init__(self, lock=b'\xff\xff'):
+        """A stand-in for a CP2130's USB device with the given lock byte,
+        recording control transfers as (bRequest, data) tuples.
+
+        """
+        self.lock      = lock
+        self.transfers = []
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if isinstance(wLengthOrData, int):
+            self.transfers.append((bRequest, None))
+            return self.lock if bRequest == GET_LOCK_BYTE else bytes(bytearray(wLengthOrData))
+        self.transfers.append((bRequest, bytes(bytearray(wLengthOrData))))
+        return len(wLengthOrData)
+
+class TestUpdate(unittest.TestCase):
+
+    def config(self, lock=b'\xff\xff'):
+        self.usb = FakeUSB(lock)
+        return USBConfig(CP2130Chip(self.usb))
+
+    def requests(self):
+        return [request for (request, _) in self.usb.transfers]
+
+    def test_usb_fields_share_one_write(self):
+        self.config().update(vendor_id=0x1234, product_id=0x5678, max_power=100)
+        self.assertEqual(self.requests(), [GET_LOCK_BYTE, SET_USB_CONFIG])
+        data = self.usb.transfers[1][1]
+        self.assertEqual(data[:2], b'\x34\x12')
+        self.assertEqual(bytearray(data)[-1], 0x07)
+
+    def test_short_string_one_write(self):
+        self.config().update(product_string=u'Widget')
+        self.assertEqual(self.requests(), [GET_LOCK_BYTE, SET_PRODUCT_STRING1])
+
+    def test_long_string_two_writes(self):
+        self.config().update(product_string=u'W' * 40)
+        self.assertEqual(self.requests(), [GET_LOCK_BYTE, SET_PRODUCT_STRING1, SET_PRODUCT_STRING2])
+
+    def test_short_string_ignores_second_lock(self):
+        self.config(lock=b'\xff\xfd').update(product_string=u'Widget')
+        self.assertEqual(self.requests(), [GET_LOCK_BYTE, SET_PRODUCT_STRING1])
+
+    def test_locked_field_writes_nothing(self):
+        config = self.config(lock=b'\xfe\xff')
+        self.assertRaises(LockedFieldError, config.update, vendor_id=0x1234, product_string=u'Widget')
+        self.assertEqual(self.requests(), [GET_LOCK_BYTE])
+
+    def test_invalid_writes_nothing(self):
+        config = self.config()
+        self.assertRaises(ValueError, config.update, max_power=600)
+        self.assertRaises(ValueError, config.update, color=u'red')
+        self.assertEqual(self.requests(), [])
+
+    def test_given_lock_is_not_read(self):
+        config = self.config()
+        lock = config.chip.get_lock_byte()
+        del self.usb.transfers[:]
+        config.apply_profile({'product_id': 0x5678})
+        config.update(lock=lock, product_id=0x5678)
+        self.assertEqual(self.requests(), [GET_LOCK_BYTE, SET_USB_CONFIG, SET_USB_CONFIG])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# Copyright 2017 David R. Bild
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License
+
+from __future__ import absolute_import
+
+import struct
+import threading
+import time
+import unittest
+
+from cp2130.chip import CP2130Chip, registers
+from cp2130.core import CP2130
+from cp2130.data import LogicLevel
+from cp2130.usb.usb import USBDevice
+from cp2130.worker import IOWorker
+
+# GPIO.2 is a push-pull output driven as a chip-select.
+PIN_CONFIG = bytearray(20)
+PIN_CONFIG[0:3] = [0x03, 0x03, 0x02]
+
+def _gpio_mask(num):
+    reg = registers.gpio_values_setter.default()
+    reg.set_level(num, LogicLevel.LOW)
+    return struct.unpack('>HH', reg.raw)[1]
+
+class FakeUSB(USBDevice):
+
+    def __init__(self):
+        """A stand-in for a CP2130's USB device that tracks the GPIO.2
+        chip-select and device acquisitions, and loops bulk data back.
+
+        """
+        self.selected = False
+        self.acquired = 0
+        self.fail     = False
+        self.pending  = b''
+
+    def acquire(self):
+        self.acquired += 1
+
+    def release(self):
+        self.acquired -= 1
+
+    def control_transfer(self, bmRequestType, bRequest, wValue, wIndex, wLengthOrData):
+        if isinstance(wLengthOrData, int):
+            if bRequest == 0x6C:
+                return bytes(PIN_CONFIG)
+            return bytes(bytearray(wLengthOrData))
+        data = bytearray(wLengthOrData)
+        if bRequest == 0x21:
+            (levels, mask) = struct.unpack('>HH', bytes(data))
+            if mask & _gpio_mask(2):
+                self.selected = not (levels & _gpio_mask(2))
+        return len(data)
+
+    def write(self, endpoint, data):
+        if self.fail:
+            raise IOError("Pipe error")
+        (size,) = struct.unpack('<4xI', bytes(data[:8]))
+        self.pending = bytes(data[8:8 + size])
+        return len(data)
+
+    def read(self, endpoint, size):
+        return self.pending[:size]
+
+class TestTransactionLock(unittest.TestCase):
+
+    def test_nested_transactions_acquire_once(self):
+        usb = FakeUSB()
+        chip = CP2130Chip(usb)
+        with chip.transaction():
+            with chip.transaction():
+                self.assertEqual(usb.acquired, 1)
+        self.assertEqual(usb.acquired, 0)
+
+    def test_excludes_other_threads(self):
+        chip = CP2130Chip(FakeUSB())
+        entered = []
+        def other():
+            with chip.transaction():
+                entered.append(time.time())
+        with chip.transaction():
+            thread = threading.Thread(target=other)
+            thread.start()
+            time.sleep(0.05)
+            self.assertEqual(entered, [])
+        thread.join()
+        self.assertEqual(len(entered), 1)
+
+class TestHeldChipSelect(unittest.TestCase):
+
+    def setUp(self):
+        self.usb = FakeUSB()
+        self.channel = CP2130(CP2130Chip(self.usb)).channel2
+
+    def test_hold_keeps_chip_select_and_device(self):
+        self.channel.write(b'\x01', cs_hold=True)
+        self.assertTrue(self.usb.selected)
+        self.assertEqual(self.usb.acquired, 1)
+        self.assertEqual(self.channel.write_read(b'\x02'), b'\x02')
+        self.assertFalse(self.usb.selected)
+        self.assertEqual(self.usb.acquired, 0)
+
+    def test_failed_hold_releases(self):
+        self.channel.write(b'\x01', cs_hold=True)
+        self.usb.fail = True
+        self.assertRaises(IOError, self.channel.write, b'\x02', cs_hold=True)
+        self.assertFalse(self.usb.selected)
+        self.assertEqual(self.usb.acquired, 0)
+
+class TestIOWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.usb    = FakeUSB()
+        self.device = CP2130(CP2130Chip(self.usb))
+
+    def test_runs_in_order(self):
+        order = []
+        with IOWorker(self.device) as worker:
+            pending = [worker.submit(order.append, i) for i in range(10)]
+            self.assertEqual(worker.write_read(self.device.channel2, b'\x05').result(1.0), b'\x05')
+        self.assertTrue(all(p.done() for p in pending))
+        self.assertEqual(order, list(range(10)))
+
+    def test_runs_in_transaction(self):
+        with IOWorker(self.device) as worker:
+            self.assertEqual(worker.run(lambda: self.usb.acquired), 1)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError("bad")
+        with IOWorker(self.device) as worker:
+            self.assertRaises(ValueError, worker.run, fail)
+            self.assertEqual(worker.run(lambda: 1), 1)
+
+    def test_timeout(self):
+        gate = threading.Event()
+        with IOWorker(self.device) as worker:
+            pending = worker.submit(gate.wait)
+            self.assertRaises(RuntimeError, pending.result, 0.01)
+            gate.set()
+            pending.result(1.0)
+
+if __name__ == '__main__':
+    unittest.main()